@@ -1,520 +1,278 @@
-import arcpy as apy
-import pandas as pd
 import os
 import timeit
 import datetime
 import sys
 import traceback
 import configparser
-import json
+import argparse
+import mappluto_pipeline as pipeline
+import mappluto_stages as stages
+import mappluto_backends as backends
+import mappluto_shard as shard
+import mappluto_publish as publish
+import mappluto_catalog as catalog
+import mappluto_instrument as instrument
+import mappluto_index as indexing
+
+# Stages run in worker processes that re-import this script, so all work happens under the main guard
+
+if __name__ == '__main__':
+    # Arguments are parsed before the build starts, so --help and usage errors exit without being logged as a failed
+    # build
+
+    parser = argparse.ArgumentParser(description="Convert MapPLUTO csv and shapefile outputs to ESRI "
+                                                 "feature classes")
+    parser.add_argument('--force', action='store_true',
+                        help="Rebuild every stage even if its inputs are unchanged since the last build")
+    args = parser.parse_args()
+
+    try:
+        # Set date with datetime to use for properly labeling final outputs
+
+        start_time = timeit.default_timer()
+        records = []
+        log = None
+        log_path = None
+        version = None
+        max_workers = None
+
+        today_dt = datetime.date.today()
+        today = today_dt.strftime('%m_%d_%Y')
+
+        # Define inputs for process
+
+        '''
+        VARIABLE EXPLANATIONS
+
+        Input CSV - CSV path for PLUTO table generated in Postgresql
+        Output CSV - CSV path for processed intermediary table, written only when export_csv is set under [PIPELINE]
+        Data Path - Path for all non-spatial data inputs and outputs associated with this process
+        GDB Path - Path for all spatial data outputs associated with this process
+        Blank Table - Text name for final dbf table
+        Out FC - Text name for final spatial output with date of process included
+        Export Date - Date of the DOF tax map export whose shoreline file is used for the erase method. Set export_date
+        under [DOF] in the configuration file to newest (the default) or a specific export date as YYYYMMDD. The
+        exports found are cached in dof_catalog.json in the data path until the DOF directory changes
+        Force - Pass --force on the command line to rebuild every stage. Otherwise stages whose inputs are unchanged
+        since the build recorded in build_manifest.json in the data path are skipped, and the manifest records which
+        stages ran and why
+        Shard Boroughs - Set shard_boroughs under [PIPELINE] in the configuration file to build each borough in
+        parallel and merge the results city-wide. BBLs must be unique across the merged feature classes
+        Backend - Set backend under [PIPELINE] in the configuration file to arcpy (the default) to build file
+        geodatabases, or geopackage to build GeoPackages with GDAL, shapely and SQLite on machines without ArcGIS
+        Shared Ingest - Set shared_ingest under [PIPELINE] in the configuration file to derive the corrections from the
+        originals when both are exported, reusing the originals' repaired Join file and clipped lots
+        Exports - MapPLUTO versions to produce. Each export works in its own data and geodatabase subdirectory named
+        after its outpath, so exports listed together run concurrently
 
-try:
-    # Set date with datetime to use for properly labeling final outputs
+        ADDITIONAL INFORMATION
 
-    start_time = timeit.default_timer()
-    today_dt = datetime.date.today()
-    today = today_dt.strftime('%m_%d_%Y')
+        If utilizing a subset for speed gains and quick review set subset_present variable according to the below
+        borough dictionary.
+        If no subset is being utilized, assign subset_present variable a value of zero
+        '''
 
-    # Define inputs for process
+        # Set configuration file for defining path and credential information
+        print("Parsing configuration file")
+        config = configparser.ConfigParser()
+        config.read(r'mappluto_convert_sample_config.ini')
 
-    '''
-    VARIABLE EXPLANATIONS
-    
-    Input CSV - CSV path for PLUTO table generated in Postgresql
-    Output CSV - CSV path for processed intermediary table
-    Data Path - Path for all non-spatial data inputs and outputs associated with this process
-    GDB Path - Path for all spatial data outputs associated with this process
-    Blank Table - Text name for final dbf table
-    CSV Table - Text name for intermediary dbf table
-    Layer Name - Text name for intermediary feature layer
-    View Name - Text name for intermediary table view
-    Out FC - Text name for final spatial output with date of process included
-    Shoreline Date - Text describing date of shoreline file to use for erase method. Can use either a specific date
-    or can use newest release. To alter, change the key used on line 463 for the dof_dir dictionary. E.g.
-    For the newest shoreline file use dof_dir[newest] or for a specific date use dof_dir[shoreline_date] and alter the 
-    variable accordingly
-    
-    ADDITIONAL INFORMATION
-    
-    If utilizing a subset for speed gains and quick review set subset_present variable according to the below borough
-    dictionary.
-    If no subset is being utilized, assign subset_present variable a value of zero
-    '''
+        # Open log file for outputting start-time, end-time, and uploaded datasets
+        print("Assigning log path")
+        log_path = config.get('PATHS', 'log_path')
+        log = open(log_path, "a")
 
-    # Set configuration file for defining path and credential information
-    print("Parsing configuration file")
-    config = configparser.ConfigParser()
-    config.read(r'mappluto_convert_sample_config.ini')
+        # Needs to be changed for each subsequent release version
+        version = '19v2'
 
-    # Open log file for outputting start-time, end-time, and uploaded datasets
-    print("Assigning log path")
-    log_path = config.get('PATHS', 'log_path')
-    log = open(log_path, "a")
+        def write_run_report(status):
+            # Step timings, CPU time, peak memory and row counts for this run, written next to the log
+            report_path = os.path.join(os.path.dirname(log_path), 'mappluto_run_report_{}_{}'.format(version, today))
+            instrument.write_report(report_path, records,
+                                    {'version': version,
+                                     'today': today,
+                                     'status': status,
+                                     'force': args.force,
+                                     'max_workers': max_workers,
+                                     'minutes': round((timeit.default_timer() - start_time) / 60, 2)})
 
-    # Needs to be changed for each subsequent release version
-    version = '19v2'
 
-    boro_dict = {0: '', 1: '_manhattan', 2: '_bronx', 3: '_brooklyn', 4: '_queens', 5: '_staten_island'}
+        boro_dict = {0: '', 1: '_manhattan', 2: '_bronx', 3: '_brooklyn', 4: '_queens', 5: '_staten_island'}
 
-    # Needs to be changed for subset generations, typically for quick turnaround/review
-    subset_present = 0
+        # Needs to be changed for subset generations, typically for quick turnaround/review
+        subset_present = 0
 
-    data_path = config.get('PATHS', 'data_path').format(version, boro_dict[subset_present].replace('_', ''))
+        # Needs to be changed to select exports - outpath, input csv key, schema key, output name. Begin processing
+        # standard version of MapPLUTO without correction flag field by enabling originals.
 
-    if not os.path.isdir(data_path):
-        os.mkdir(data_path)
+        exports = [('corrections', 'corrections_input_csv', 'corrections_schema_path', 'Corrected')]
+        # exports.insert(0, ('originals', 'original_input_csv', 'original_schema_path', None))
 
-    print(data_path)
+        # Number of worker processes for independent pipeline stages. Defaults to one per core, 1 runs serially.
 
-    output_csv = config.get('PATHS', 'output_csv').format(version, boro_dict[subset_present].replace('_', ''),
-                                                          boro_dict[subset_present],
-                                                          today)
-    fgdb_path = config.get('PATHS', 'fgdb_path')
+        max_workers = config.getint('PIPELINE', 'max_workers', fallback=None)
 
-    if not os.path.isdir(fgdb_path):
-        os.mkdir(fgdb_path)
+        # Stages exchange a typed Arrow copy of the table. The text output csv and schema.ini are only written for
+        # consumers that still read them when export_csv is set.
 
-    gdb_path_water_area = config.get('PATHS', 'gdb_path_water_area')
+        export_csv = config.getboolean('PIPELINE', 'export_csv', fallback=False)
 
-    if not apy.Exists(gdb_path_water_area):
-        apy.CreateFileGDB_management(fgdb_path, 'MapPLUTO_WaterArea.gdb')
+        # Geoprocessing backend the stages build their workspaces with
 
-    gdb_path_shoreline_clip = config.get('PATHS', 'gdb_path_shoreline_clip')
+        backend = config.get('PIPELINE', 'backend', fallback='arcpy')
+        backends.backend_class(backend)
 
-    if not apy.Exists(gdb_path_shoreline_clip):
-        apy.CreateFileGDB_management(fgdb_path, 'MapPLUTO_ShorelineClip.gdb')
+        # Full city builds can be sharded by borough - each borough is typed, joined and erased in parallel and the
+        # results merged city-wide. Subset builds already cover a single borough.
 
-    x_path = config.get('PATHS', 'x_path')
+        shard_codes = sorted(shard.BOROUGHS) if config.getboolean('PIPELINE', 'shard_boroughs', fallback=False) \
+            and subset_present == 0 else []
 
-    if not os.path.isdir(x_path):
-        os.mkdir(x_path)
+        # Attribute indexes and spatial index grid size built on both outputs, see mappluto_index. The grid is sized
+        # from the lots' extents when spatial_grid is not set.
 
-    tax_lot_in = os.path.join(gdb_path_water_area, 'Join_File')
+        attribute_indexes = indexing.parse_indexes(config.get('INDEXES', 'attribute_indexes', fallback='')) \
+            or indexing.ATTRIBUTE_INDEXES
+        spatial_grid = config.getfloat('INDEXES', 'spatial_grid', fallback=None)
 
-    blank_table = "MapPLUTO_final"
-    csv_table = "MapPLUTO_intermediary"
-    lyr_name = "MapPlutoSpatialLayer"
-    view_name = "mappluto_allboro_view"
-    out_fc = "MapPLUTO_{}_Water_Included".format(today)
+        data_path = config.get('PATHS', 'data_path').format(version, boro_dict[subset_present].replace('_', ''))
 
+        if not os.path.isdir(data_path):
+            os.mkdir(data_path)
 
-    def original_corrections_export(csv, schema_test, outpath, outname):
+        print(data_path)
 
-        input_csv = csv.format(version, boro_dict[subset_present].replace('_', ''), boro_dict[subset_present])
+        output_csv = config.get('PATHS', 'output_csv').format(version, boro_dict[subset_present].replace('_', ''),
+                                                              boro_dict[subset_present],
+                                                              today)
+        fgdb_path = config.get('PATHS', 'fgdb_path')
 
-        # Crawling DOF directory to pull date of latest export for Shoreline and Tax Map Inputs
+        if not os.path.isdir(fgdb_path):
+            os.mkdir(fgdb_path)
 
-        dof_dir = {}
+        gdb_path_water_area = backends.workspace_path(backend, config.get('PATHS', 'gdb_path_water_area'))
+        gdb_path_shoreline_clip = backends.workspace_path(backend, config.get('PATHS', 'gdb_path_shoreline_clip'))
 
-        dof_path = config.get('PATHS', 'dof_path')
-        apy.env.workspace = dof_path
-        exports = apy.ListWorkspaces(None, 'FileGDB')
-
-        print("Listing all available tax map export locations.")
-        for workspace in exports:
-            workspace_date = workspace.split("_")[3][:-4]
-            workspace_date_time = datetime.datetime.strptime(workspace_date, '%Y%m%d')
-            print(workspace_date_time)
-            dof_dir[workspace_date] = workspace
-
-        newest = max(dof_dir)
-
-        # Reads static csv file into pandas dataframe for field analysis and to validate schema definitions
-        # Sets field schemas in dictionary data structure to be applied later upon append of data tables/schema initialization
-
-        print("Reading input csv to obtain field list.")
-        mappluto_initial = pd.read_csv(input_csv)
-        print("Completed reading input csv.")
-
-        # Load in schema dictionary from external json files
-
-        schema = open(schema_test)
-        schema_t = schema.read()
-        schema_dict = json.loads(schema_t)
-
-        print(schema_dict)
-
-        print("Writing schema.ini used to properly import output csv into ESRI format with correct data types.")
-
-        # Generate list of fields and field indices for potential troubleshooting
-
-        fields = [field for field in mappluto_initial.columns.values]
-
-        # Define list of fields we expect in static input table that we do not desire in output
-
-        input_field_drop = ['geom', 'mappluto_f', 'rpaddate', 'dcasdate', 'zoningdate', 'landmkdate', 'basempdate',
-                            'masdate', 'polidate', 'edesigdate', 'exemptland']
-
-        # Drop undesired fields from input csv
+        x_path = publish.destination_path(config.get('PATHS', 'x_path'))
 
-        for field in fields[:]:
-            print(field)
-            if field in input_field_drop:
-                print("Dropping {} field from input csv.".format(field))
-                mappluto_initial = mappluto_initial.drop(labels=[field], axis=1)
-                print("Removing {}".format(field))
-                fields.remove(field)
+        if not os.path.isdir(x_path):
+            os.mkdir(x_path)
 
-        indices = [count for count in range(len(fields))]
+        out_fc = "MapPLUTO_{}_Water_Included".format(today)
 
-        # Open schema text file and write header text describing the csv filename
+        # Data Engineering shapefile copied into each export's gdb as the Join file
 
-        schema_ini_dict = dict(zip(fields, indices))
-        f = open(os.path.join(data_path, "schema.ini"), "w")
-        f.write("[" + str(output_csv.split("\\")[-1]) + "]\n")
+        join_shapefile = None
+        for file in os.listdir(data_path):
+            if "dcp_mappluto" in file and file.endswith(".shp"):
+                join_shapefile = os.path.join(data_path, file)
 
-        converter_dict = {}
+        # Build manifest recording input hashes and completed stages, used to skip stages whose inputs are unchanged
 
-        # Write proper data type assignment to converter dictionary to be used to read static
-        # csv into pandas dataframe with correct dtypes
+        manifest_path = os.path.join(data_path, 'build_manifest.json')
 
-        print("Writing schema and converter dictionary to read input csv values with appropriate data types.")
+        # Catalog of DOF exports for Shoreline and Tax Map Inputs, keyed by export date. The DOF directory is only
+        # crawled again when its exports change.
 
-        for field in fields:
-            if field not in input_field_drop:
-                print("Writing to schema ini - Col{0}={1} {2}\n".format(str(schema_ini_dict[field] + 2), str(field),
-                                                                        str(schema_dict[field][1])))
-                f.write("Col{0}={1} {2}\n".format(str(schema_ini_dict[field] + 2), str(field), str(schema_dict[field][1])))
-                converter_dict[field] = lambda x: str(x)
-        f.close()
+        def find_shoreline(dataset_path):
+            layers = backends.list_layers(backend, dataset_path, '*{}*'.format(catalog.SHORELINE_LAYER))
+            return os.path.join(dataset_path, layers[0]) if layers else None
 
-        print("Converter dict and schema ini complete.")
 
-        print("Reading input csv with converter.")
-
-        # Re-read static csv file into pandas dataframe utilizing converter dictionary
-
-        mappluto_allboro_df = pd.read_csv(input_csv, engine="python", dtype=object) # , converters=converter_dict
-        mappluto_allboro_df = mappluto_allboro_df[fields]
-
-        # Export to a new static csv table utilizing schema dictionary
-
-        print("Exporting to output csv.")
-        mappluto_allboro_df.to_csv(output_csv)
-        print("Export complete.")
-
-
-        # Remove old table files
-
-        def refresh_gdb(path):
-            apy.env.workspace = path
-            print("Checking table existence.")
-            table_list = apy.ListTables()
-            fc_list = apy.ListFeatureClasses()
-            print("The following tables are present in your geodatabase:")
-            for table in table_list:
-                print("Deleting {} from fgdb".format(table))
-                delete_table = os.path.join(path, table)
-                apy.Delete_management(delete_table)
-            for feature in fc_list:
-                if "Join" not in feature:
-                    print("Deleting {} from fgdb".format(feature))
-                    delete_fc = os.path.join(path, feature)
-                    apy.Delete_management(delete_fc)
-                else:
-                    print("{0} is a critical file. "
-                          "If you wish to generate a new {0} file, manually delete from fgdb".format(feature))
-
-
-        refresh_gdb(gdb_path_water_area)
-        refresh_gdb(gdb_path_shoreline_clip)
-        print("Deletions complete. Re-generating tables.")
-
-        # Create new table files
-
-        # Set appropriate workspace path
-        apy.env.workspace = gdb_path_water_area
-        # Create blank tables
-        print("Creating dbase table with appropriate field names and schema.")
-        apy.CreateTable_management(gdb_path_water_area, blank_table)
-        print("Table created.")
-        print("Creating dbase table with appropriate field names and schema for append.")
-        apy.CreateTable_management(gdb_path_water_area, csv_table)
-        print("Table created.")
-
-
-        def create_table(table_name, type):
-            # Add field schemas to blank table
-            print("Adding the following schemas for field - " + str(item))
-            print("Name : " + str(schema_dict[item][0]))
-            print("Type : " + type)
-            print("Precision : " + str(schema_dict[item][2]))
-            print("Scale : " + str(schema_dict[item][3]))
-            print("Length : " + str(schema_dict[item][4]))
-            print("Alias : " + str(schema_dict[item][5]))
-            print("Nullable : " + str(schema_dict[item][6]))
-
-            apy.AddField_management(table_name, schema_dict[item][0],
-                                    type,
-                                    schema_dict[item][2],
-                                    schema_dict[item][3],
-                                    schema_dict[item][4],
-                                    schema_dict[item][5],
-                                    schema_dict[item][6])
-
-
-        for item in schema_dict:
-            print(item)
-            # Create target DBase with string schema
-            create_table(csv_table, "TEXT")
-            # Create target DBase table with pre-defined schema
-            create_table(blank_table, str(schema_dict[item][1]))
-
-
-        # Create input DBase table from field-limited csv dataset
-
-        print("Appending static csv to dbase table")
-        apy.Append_management(output_csv, csv_table, "NO_TEST")
-        print("Append complete.")
-
-        # Append input DBase table to target DBase table.
-        # NO_TEST is important because it forces input dbf to inherit target dbf schema in the appending process
-
-        print("Appending target and input dbase tables to combine correct fields/schema with correct attribute info.")
-        apy.Append_management(csv_table, blank_table, "NO_TEST")
-        print("Appending tables complete.")
-
-        apy.env.workspace = gdb_path_water_area
-        print("Generating DBF table.")
-        apy.TableSelect_analysis(blank_table, 'UNMAPPABLES', '"PLUTOMapID" = \'2\' OR "PLUTOMapID" = \'4\'')
-
-        # Check for join polygon in gdb, if it exists, continue, if not, create it.
-        print("Checking GDB for Join file")
-
-        gdb_check_list = apy.ListFeatureClasses()
-        join_hit_count = 0
-        dissolve_hit_count = 0
-
-        for file in gdb_check_list:
-            print(file)
-            if "Join_File" in file:
-                print("Join file present in GDB. Continuing")
-                join_hit_count += 1
-
-        if join_hit_count == 0:
-            print("Join file not present in GDB. Creating it now.")
-            for file in os.listdir(data_path):
-                if "dcp_mappluto" in file and file.endswith(".shp"):
-                    print("Copying Join file to GDB")
-                    apy.FeatureClassToFeatureClass_conversion(os.path.join(data_path, file),
-                                                              gdb_path_water_area,
-                                                              "Join_File")
-        elif join_hit_count == 1:
-            print("Join file exists. Skipping")
-
-        # Join in-memory datasets and export to a new FeatureClass -- ShorelineNotClipped
-
-        join_fields = apy.ListFields(tax_lot_in)
-        bbl_check = 0
-
-        print("Checking for Double BBL field in Join File")
-        for field in join_fields:
-            if 'BBL' in field.name.upper() and field.type == 'Double':
-                print("Spatial join file contains {} with {} type. Proceeding with join.".format(field.name, field.type))
-            elif 'BBL' in field.name.upper() and field.type is not 'Double':
-                print("Spatial join file lacks {} with {} type. Generating field now.".format(field.name, field.type))
-                apy.AddField_management(tax_lot_in, 'BBL_Dbl', 'DOUBLE')
-                apy.CalculateField_management(tax_lot_in, 'BBL_Dbl', '!BBL!', 'PYTHON3')
-                bbl_check = 1
-
-        # Repair geometry of join shapefile to eliminate the need to repair across network drives in the future
-        print("Repairing geometry for input.")
-        apy.RepairGeometry_management(tax_lot_in)
-
-        print("Creating in-memory layer.")
-        # Create in-memory layer from DOF Tax Map feature class
-
-        apy.MakeFeatureLayer_management(in_features=tax_lot_in, out_layer=lyr_name)
-        print("Creating in-memory table.")
-        # Create in-memory table from target DBase table
-
-        apy.MakeTableView_management(in_table=blank_table, out_view=view_name)
-
-        # Join layer to table in-memory on bbl, keep matching only
-
-        if bbl_check == 1:
-            print("Joining in-memory table with in-memory layer using double")
-            apy.AddJoin_management(in_layer_or_view=lyr_name,
-                                   in_field="BBL_Dbl",
-                                   join_table=view_name,
-                                   join_field="BBL",
-                                   join_type="KEEP_COMMON")
-        elif bbl_check == 0:
-            print("Joining in-memory table with in-memory layer")
-            apy.AddJoin_management(in_layer_or_view=lyr_name,
-                                   in_field="BBL",
-                                   join_table=view_name,
-                                   join_field="BBL",
-                                   join_type="KEEP_COMMON")
-
-        # Copy layer to feature class
-
-        print("Exporting to FeatureClass")
-        apy.CopyFeatures_management(in_features=lyr_name, out_feature_class=out_fc)
-        print("Export of new FeatureClass complete")
-
-        # Remove all Tax Map Polygon fields and ObjectID from joined table
-
-        apy.env.workspace = gdb_path_water_area
-        output_fields = apy.ListFields(out_fc)
-        for field in output_fields:
-            if "dcp_mappluto_{}".format(
-                    version) in field.name or "MapPLUTO_final_OBJECTID" in field.name or "Join_File" in field.name:
-                print("Deleting the following unnecessary fields: {}".format(field.name))
-                apy.DeleteField_management(out_fc, field.name)
-        print("Field deletion complete")
-
-        # Rename all fields to reflect original MapPluto FeatureClass
-
-        table_name_string = "MapPLUTO_final_"
-
-        field_list = apy.ListFields(out_fc)
-        field_count = 0
-        for field in field_list:
-            if table_name_string in field.name:
-                apy.AlterField_management(out_fc, field.name, field.name.replace(table_name_string, ""),
-                                          field.name.replace(table_name_string, ""))
-                print(field.name + " replaced with " + field.name.replace(table_name_string, ""))
-                field_count += 1
-                print(str(field_count) + " fields completed out of " + str(len(field_list) - 4))
-
-        shoreline_path = os.path.join(dof_dir[newest], "DCP")
-        apy.env.workspace = shoreline_path
-        shoreline_list = []
-        for fc in apy.ListFeatureClasses():
-            if "Shoreline_Polygon" in fc:
-                shoreline_list.append(fc)
-
-        print("Adding attribute indices to BBL fields")
-        print("Adding index to Water Included")
-        apy.AddIndex_management(os.path.join(gdb_path_water_area, out_fc), 'BBL', 'BBL_Water', 'UNIQUE')
-
-        # Create shoreline clipped version of FC
-
-        apy.env.workspace = gdb_path_shoreline_clip
-
-        print("Generating shoreline clipped feature class via erase analysis tool")
-
-        apy.Erase_analysis(os.path.join(gdb_path_water_area, out_fc), os.path.join(shoreline_path, shoreline_list[0]),
-                           out_fc.replace("Water_Included", "Shoreline_Clipped"))
-
-        print("Erase complete. Shoreline clipped feature generated")
-
-        print("Adding index to Shoreline Clipped")
-        apy.AddIndex_management(
-            os.path.join(gdb_path_shoreline_clip, out_fc.replace("Water_Included", "Shoreline_Clipped")), 'BBL',
-            'BBL_Shore', 'UNIQUE')
-        print("Attribute indices added to BBL fields")
-
-        apy.env.workspace = gdb_path_shoreline_clip
-        if apy.Exists('UNMAPPABLES'):
-            print("Unmappable DBF already exists. Skipping this step.")
-        else:
-            print("Generating DBF table.")
-            apy.TableSelect_analysis(os.path.join(gdb_path_water_area, blank_table), 'UNMAPPABLES', '"PLUTOMapID" = \'2\'')
-
-        # Outputting final results to X: drive location
-
-        x_version_path = os.path.join(x_path, version)
-
-        if os.path.isdir(x_version_path):
-            print("Output version directory exists. Skipping")
-        else:
-            print("Output version directory does not exist. Creating now.")
-            os.mkdir(x_version_path)
-
-        x_version_output_path = os.path.join(x_version_path, 'output')
-
-        if os.path.isdir(x_version_output_path):
-            print("Output version directory exists. Skipping")
-        else:
-            print("Output version directory does not exist. Creating now.")
-            os.mkdir(x_version_output_path)
-
-        x_output_gdb_path = os.path.join(x_version_path, 'output', outpath)
-
-        if not os.path.isdir(x_output_gdb_path):
-            print("Original or Correction directory does not exist. Creating now.")
-            os.mkdir(x_output_gdb_path)
-        else:
-            print("Original or Correction directory already exists. Skipping")
-
-        apy.env.workspace = x_output_gdb_path
-        apy.env.overwriteOutput = True
-
-        print("Outputting MapPLUTO_WaterArea_Included")
-        apy.Copy_management(os.path.join(fgdb_path, 'MapPLUTO_WaterArea.gdb'),
-                            os.path.join(x_output_gdb_path, 'MapPLUTO_WaterArea_{}_{}.gdb'.format(outname, today)))
-        print("Outputting new MapPLUTO_Shoreline_Clippped")
-        apy.Copy_management(os.path.join(fgdb_path, 'MapPLUTO_ShorelineClip.gdb'),
-                            os.path.join(x_output_gdb_path, 'MapPLUTO_ShorelineClip_{}_{}.gdb'.format(outname, today)))
-        print("Outputs complete")
-
-        retain_files = ['MapPLUTO_{}_Shoreline_Clipped'.format(today), 'MapPLUTO_{}_Water_Included'.format(today),
-                        'UNMAPPABLES', 'MapPLUTO', 'MapPLUTO_UNCLIPPED', 'NOT_MAPPED_LOTS_UNCLIPPED', 'NOT_MAPPED_LOTS']
-
-        print("Modifying outputs to include only desired files")
-        apy.env.workspace = x_output_gdb_path
-        for out_gdb_path in apy.ListWorkspaces():
-            if today in out_gdb_path:
-                apy.env.workspace = out_gdb_path
-                output_fc_list = apy.ListFeatureClasses()
-                output_table_list = apy.ListTables()
-                for fc in output_fc_list:
-                    if fc not in retain_files:
-                        print("Deleting {}".format(fc))
-                        apy.Delete_management(fc)
-                    if outname is 'Corrected' and 'MapPLUTO_{}'.format(today) in fc:
-                        print("Renaming {} to {}".format(fc, fc.split('.')[0] + '_Corrected'))
-                        apy.Rename_management(fc, fc.split('.')[0] + '_Corrected')
-                output_fc_list = apy.ListFeatureClasses()
-                for tbl in output_table_list:
-                    if 'unclipped' in out_gdb_path or 'UNCLIPPED' in output_fc_list[0]:
-                        if tbl not in retain_files:
-                            print("Deleting {}".format(tbl))
-                            apy.Delete_management(tbl)
-                        else:
-                            print("Renaming {} to {}".format(tbl, 'NOT_MAPPED_LOTS_UNCLIPPED.dbf'))
-                            apy.Rename_management(tbl, "NOT_MAPPED_LOTS_UNCLIPPED.dbf")
-                    else:
-                        if tbl not in retain_files:
-                            print("Deleting {}".format(tbl))
-                            apy.Delete_management(tbl)
-                        else:
-                            print("Renaming {} to {}".format(tbl, 'NOT_MAPPED_LOTS.dbf'))
-                            apy.Rename_management(tbl, 'NOT_MAPPED_LOTS.dbf')
-
-    # Begin processing standard version of MapPLUTO without correction flag field
-
-    # print("Beginning original MapPLUTO export")
-    # original_corrections_export(config.get('PATHS', 'original_input_csv'),
-    #                             config.get('PATHS', 'original_schema_path'),
-    #                             'originals',
-    #                             None)
-    # print("Original MapPLUTO export complete.")
-
-    # Begin processing version of MapPLUTO with dcpedit correction flag field
-
-    print("Beginning corrected MapPLUTO export")
-    original_corrections_export(config.get('PATHS', 'corrections_input_csv'),
-                                config.get('PATHS', 'corrections_schema_path'),
-                                'corrections',
-                                'Corrected')
-    print("Corrected MapPLUTO export complete.")
-
-    print("Script complete. Finished in " + str((timeit.default_timer() - start_time) / 60) + " minutes.")
-
-except:
-    tb = sys.exc_info()[2]
-    tbinfo = traceback.format_tb(tb)[0]
-
-    pymsg = "PYTHON ERRORS:\nTraceback Info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
-    msgs = "ArcPy ERRORS:\n" + apy.GetMessages() + "\n"
-
-    print(pymsg)
-    print(msgs)
-
-    log.write("" + pymsg + "\n")
-    log.write("" + msgs + "")
-    log.write("\n")
-    log.close()
\ No newline at end of file
+        dof_path = config.get('PATHS', 'dof_path')
+        dof_exports = catalog.load_catalog(dof_path, os.path.join(data_path, 'dof_catalog.json'), find_shoreline)
+
+        print("Available tax map exports: {}".format(', '.join(sorted(dof_exports))))
+        dof_export = catalog.select_export(dof_exports, config.get('DOF', 'export_date', fallback='newest'))
+        print("Using tax map export {}".format(dof_export['name']))
+
+
+        def export_gdb_path(gdb_path, outpath):
+            return os.path.join(os.path.dirname(gdb_path), outpath, os.path.basename(gdb_path))
+
+
+        def export_run(csv, schema_path, outpath, outname):
+            # Paths and names used by the stages of one export
+
+            work_path = os.path.join(data_path, outpath)
+            gdb_path_water_area_export = export_gdb_path(gdb_path_water_area, outpath)
+
+            return {'version': version,
+                    'today': today,
+                    'outpath': outpath,
+                    'outname': outname,
+                    'input_csv': csv.format(version, boro_dict[subset_present].replace('_', ''),
+                                            boro_dict[subset_present]),
+                    'schema_path': schema_path,
+                    'schema_cache': os.path.join(data_path, 'schema_cache'),
+                    'data_path': data_path,
+                    'work_path': work_path,
+                    'output_csv': os.path.join(work_path, os.path.basename(output_csv)),
+                    'gdb_path_water_area': gdb_path_water_area_export,
+                    'gdb_path_shoreline_clip': export_gdb_path(gdb_path_shoreline_clip, outpath),
+                    'tax_lot_in': os.path.join(gdb_path_water_area_export, 'Join_File'),
+                    'out_fc': out_fc,
+                    'join_shapefile': join_shapefile,
+                    'shoreline_workspace': dof_export['workspace'],
+                    'shoreline_fc': dof_export['shoreline_fc'],
+                    'x_path': x_path,
+                    'max_workers': max_workers,
+                    'export_csv': export_csv,
+                    'backend': backend,
+                    'indexes': attribute_indexes,
+                    'spatial_grid': spatial_grid,
+                    'shard': None,
+                    'shard_codes': shard_codes}
+
+
+        runs = {outpath: export_run(config.get('PATHS', csv_key), config.get('PATHS', schema_key), outpath, outname)
+                for outpath, csv_key, schema_key, outname in exports}
+
+        # With shared_ingest set under [PIPELINE], corrections exported alongside originals are derived from them -
+        # the Join file is copied and repaired once and only BBLs the corrections add are erased. Sharded builds
+        # keep separate exports.
+
+        pipeline_stages = []
+        if config.getboolean('PIPELINE', 'shared_ingest', fallback=False) and not shard_codes \
+                and 'originals' in runs and 'corrections' in runs:
+            print("Scheduling originals and corrections MapPLUTO exports from one shared ingest")
+            pipeline_stages += stages.shared_export_stages(runs.pop('originals'), runs.pop('corrections'))
+        for outpath, run in runs.items():
+            print("Scheduling {} MapPLUTO export".format(outpath))
+            pipeline_stages += stages.export_stages(run)
+
+        pipeline.run_stages(pipeline_stages, max_workers, manifest_path, args.force, records)
+        print("MapPLUTO exports complete.")
+
+        write_run_report('complete')
+        print("Script complete. Finished in " + str((timeit.default_timer() - start_time) / 60) + " minutes.")
+
+    except:
+        error = sys.exc_info()[1]
+        tbinfo = traceback.format_exc()
+
+        # Stage failures carry the failing stage, the step it failed in with its timing, and the full traceback
+        # from the worker process that ran it
+        if isinstance(error, instrument.StageFailure):
+            tbinfo += "\n" + error.describe()
+
+        pymsg = "PYTHON ERRORS:\nTraceback Info:\n" + tbinfo + "\nError Info:\n" + str(error) + \
+                "\nFailed after " + str((timeit.default_timer() - start_time) / 60) + " minutes."
+        msgs = "ArcPy ERRORS:\n" + backends.geoprocessing_messages() + "\n"
+
+        print(pymsg)
+        print(msgs)
+
+        # The run report is only written once the log path and version are set, and a failure writing it is printed
+        # rather than raised so it cannot replace the original error
+        if log_path is not None and version is not None:
+            try:
+                write_run_report('failed')
+            except Exception as report_error:
+                print("Run report not written: {}".format(report_error))
+
+        if log is not None:
+            log.write("" + pymsg + "\n")
+            log.write("" + msgs + "")
+            log.write("\n")
+            log.close()
@@ -0,0 +1,860 @@
+import os
+import shutil
+import fnmatch
+import sqlite3
+import functools
+import itertools
+import numpy as np
+import pandas as pd
+import mappluto_geometry as geometry
+import mappluto_index as indexing
+from mappluto_ingest import CHUNK_SIZE
+
+# Writers share one interface - create_table(table, compiled) builds an empty table from a compiled table
+# definition (see mappluto_schema) and write(table, frames) bulk inserts an iterable of typed data frames in a
+# single session. Frames carrying geometry hold it in the geometry.GEOMETRY_FIELD column. read_chunks(table, fields)
+# streams a table back as frames, read_features(source, fields, template) reads attribute fields and geometry from a
+# feature source in the template's coordinate system, and create_feature_class(table, compiled, template) builds an
+# empty feature class matching the template's geometry and coordinate system.
+#
+# Writers are also the pipeline's geoprocessing backend - each wraps one workspace (a file geodatabase for ArcPy, a
+# GeoPackage for the open-source backend) and provides the workspace operations the stages use: create_workspace,
+# copy_features, field_is_text, table_fields, add_index, add_spatial_index, list_feature_classes, list_tables,
+# rename, delete, copy_workspace and release. exists(path) checks a workspace or a dataset inside one. Joins and
+# erases already run on the writers' frames with pandas and shapely, so every stage runs on either backend.
+
+
+def frame_rows(frame):
+    # Convert a typed frame into plain python row tuples with None for nulls
+
+    return frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+
+
+def peek_frames(frames):
+    # Return the first frame along with an iterator over all frames, or None if there are no frames
+
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
+        return None, frames
+    return first, itertools.chain([first], frames)
+
+
+class ArcPyWriter(object):
+    # Writes tables into a file geodatabase through an ArcPy insert cursor. Geometry is read and written as arcpy
+    # geometry objects through the SHAPE@ cursor token, or as WKB with geometry_token='SHAPE@WKB' for stages that
+    # operate on geometries outside ArcGIS.
+
+    # Object id field token for read_features, matching the keys update_geometries takes
+
+    oid_field = 'OID@'
+
+    def __init__(self, workspace, geometry_token='SHAPE@'):
+        import arcpy
+        self.apy = arcpy
+        self.workspace = workspace
+        self.geometry_token = geometry_token
+
+        # Stages only run when their inputs changed, so they replace their own outputs rather than clearing each gdb
+
+        self.apy.env.overwriteOutput = True
+
+    @staticmethod
+    def exists(path):
+        import arcpy
+        return arcpy.Exists(path)
+
+    def create_workspace(self):
+        if not self.apy.Exists(self.workspace):
+            self.apy.CreateFileGDB_management(os.path.dirname(self.workspace), os.path.basename(self.workspace))
+
+    def field_is_text(self, source, field):
+        return self.apy.ListFields(source, field)[0].type == 'String'
+
+    def copy_features(self, source, table, where_clause=None):
+        self.apy.FeatureClassToFeatureClass_conversion(source, self.workspace, table, where_clause)
+
+    def table_fields(self, table):
+        return [field.name for field in self.apy.ListFields(os.path.join(self.workspace, table))]
+
+    def add_index(self, table, fields, index_name, unique=True):
+        # Attribute index on a field, or on several fields given as a list
+
+        self.apy.AddIndex_management(os.path.join(self.workspace, table), fields, index_name,
+                                     'UNIQUE' if unique else 'NON_UNIQUE')
+
+    def feature_bounds(self, table):
+        import shapely
+        with self.apy.da.SearchCursor(os.path.join(self.workspace, table), ['SHAPE@WKB']) as cursor:
+            return shapely.bounds(geometry.from_values([row[0] for row in cursor]))
+
+    def add_spatial_index(self, table, grid_size=None):
+        # Rebuild the spatial index with a single grid level, sized from the features' extents unless grid_size is
+        # given. Returns the grid size used.
+
+        if grid_size is None:
+            grid_size = indexing.grid_size(self.feature_bounds(table))
+        self.apy.AddSpatialIndex_management(os.path.join(self.workspace, table), grid_size or 0)
+        return grid_size
+
+    def list_feature_classes(self, wildcard=None):
+        self.apy.env.workspace = self.workspace
+        return self.apy.ListFeatureClasses(wildcard) or []
+
+    def list_tables(self, wildcard=None):
+        self.apy.env.workspace = self.workspace
+        return self.apy.ListTables(wildcard) or []
+
+    def rename(self, name, new_name):
+        self.apy.env.workspace = self.workspace
+        self.apy.Rename_management(name, new_name)
+
+    def delete(self, name):
+        self.apy.env.workspace = self.workspace
+        self.apy.Delete_management(name)
+
+    def copy_workspace(self, destination):
+        # Replace destination with a copy of the whole workspace
+
+        if self.apy.Exists(destination):
+            self.apy.Delete_management(destination)
+        self.apy.Copy_management(self.workspace, destination)
+
+    def release(self):
+        # Drop the workspace's cached connections so its files can be copied
+
+        self.apy.ClearWorkspaceCache_management(self.workspace)
+
+    def add_fields(self, table, compiled):
+        table_path = os.path.join(self.workspace, table)
+        if compiled['add_fields']:
+            self.apy.AddFields_management(table_path, compiled['add_fields'])
+        for field in compiled['add_field']:
+            self.apy.AddField_management(table_path, *field)
+        print("Table created with {} fields.".format(len(compiled['columns'])))
+
+    def create_table(self, table, compiled):
+        print("Creating {} with appropriate field names and schema.".format(table))
+        self.apy.CreateTable_management(self.workspace, table)
+        self.add_fields(table, compiled)
+
+    def create_feature_class(self, table, compiled, template):
+        print("Creating {} feature class with appropriate field names and schema.".format(table))
+        description = self.apy.Describe(template)
+        self.apy.CreateFeatureclass_management(self.workspace, table, description.shapeType.upper(),
+                                               spatial_reference=description.spatialReference)
+        self.add_fields(table, compiled)
+
+    def cursor_fields(self, columns):
+        return [self.geometry_token if column == geometry.GEOMETRY_FIELD else column for column in columns]
+
+    def read_chunks(self, table, fields, chunksize=CHUNK_SIZE):
+        with self.apy.da.SearchCursor(os.path.join(self.workspace, table), self.cursor_fields(fields)) as cursor:
+            while True:
+                rows = list(itertools.islice(cursor, chunksize))
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=fields)
+
+    def read_features(self, source, fields, template=None, where_clause=None):
+        # Features are projected on the fly into the coordinate system of the template feature class, when given,
+        # as geoprocessing tools do
+
+        fields = list(fields) + [geometry.GEOMETRY_FIELD]
+        options = {} if template is None else {'spatial_reference': self.apy.Describe(template).spatialReference}
+        with self.apy.da.SearchCursor(source, self.cursor_fields(fields), where_clause, **options) as cursor:
+            return pd.DataFrame(list(cursor), columns=fields)
+
+    def update_geometries(self, table, geometries):
+        # Replace the geometry of features by object id, deleting the features mapped to None
+
+        if not geometries:
+            return 0
+        table_path = os.path.join(self.workspace, table)
+        where_clause = '{} IN ({})'.format(self.apy.Describe(table_path).OIDFieldName,
+                                           ', '.join(str(oid) for oid in geometries))
+        with self.apy.da.UpdateCursor(table_path, ['OID@', self.geometry_token], where_clause) as cursor:
+            for oid, shape in cursor:
+                if geometries[oid] is None:
+                    cursor.deleteRow()
+                else:
+                    cursor.updateRow([oid, geometries[oid]])
+        print("{} geometries updated in {}".format(len(geometries), table))
+        return len(geometries)
+
+    def write(self, table, frames):
+        first, frames = peek_frames(frames)
+        if first is None:
+            return 0
+
+        row_count = 0
+        with self.apy.da.InsertCursor(os.path.join(self.workspace, table), self.cursor_fields(first.columns)) as cursor:
+            for frame in frames:
+                for row in frame_rows(frame):
+                    cursor.insertRow(row)
+                row_count += len(frame)
+        print("{} rows inserted into {}".format(row_count, table))
+        return row_count
+
+
+# SQLite column types used by the GeoPackage writer for each ESRI field type
+
+GPKG_TYPES = {'TEXT': 'TEXT', 'SHORT': 'SMALLINT', 'LONG': 'MEDIUMINT', 'FLOAT': 'FLOAT', 'DOUBLE': 'DOUBLE',
+              'DATE': 'DATETIME'}
+
+GPKG_GEOMETRY_TYPE = 'MULTIPOLYGON'
+
+# First srs_id used for coordinate systems registered from the definitions of feature sources outside the GeoPackage
+
+GPKG_CUSTOM_SRS_ID = 100000
+
+GPKG_APPLICATION_ID = 0x47504B47
+GPKG_USER_VERSION = 10200
+
+# Seconds a connection waits for another stage's write to the same GeoPackage to commit. SQLite allows one writer
+# at a time, so stages writing different tables of one GeoPackage take turns rather than fail.
+
+GPKG_BUSY_TIMEOUT = 3600
+
+# GeoPackage R-tree spatial index extension. The triggers keep each index current as features are written, using
+# the ST_ functions every GeoPackage connection registers - see gpkg_st_functions. Placeholders are the feature
+# table (t), its geometry column (c), its object id column (i) and the R-tree table (r).
+
+GPKG_RTREE_EXTENSION = ('gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')
+
+GPKG_RTREE_VALUES = 'ST_MinX({c}), ST_MaxX({c}), ST_MinY({c}), ST_MaxY({c})'
+
+GPKG_RTREE_TRIGGERS = {
+    'insert': 'AFTER INSERT ON "{t}" WHEN (NEW."{c}" NOT NULL AND NOT ST_IsEmpty(NEW."{c}")) BEGIN '
+              'INSERT OR REPLACE INTO "{r}" VALUES (NEW."{i}", ' + GPKG_RTREE_VALUES.replace('{c}', 'NEW."{c}"') +
+              '); END',
+    'update1': 'AFTER UPDATE OF "{c}" ON "{t}" WHEN OLD."{i}" = NEW."{i}" AND '
+               '(NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}")) BEGIN '
+               'INSERT OR REPLACE INTO "{r}" VALUES (NEW."{i}", ' + GPKG_RTREE_VALUES.replace('{c}', 'NEW."{c}"') +
+               '); END',
+    'update2': 'AFTER UPDATE OF "{c}" ON "{t}" WHEN OLD."{i}" = NEW."{i}" AND '
+               '(NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}")) BEGIN DELETE FROM "{r}" WHERE id = OLD."{i}"; END',
+    'update3': 'AFTER UPDATE ON "{t}" WHEN OLD."{i}" != NEW."{i}" AND '
+               '(NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}")) BEGIN DELETE FROM "{r}" WHERE id = OLD."{i}"; '
+               'INSERT OR REPLACE INTO "{r}" VALUES (NEW."{i}", ' + GPKG_RTREE_VALUES.replace('{c}', 'NEW."{c}"') +
+               '); END',
+    'update4': 'AFTER UPDATE ON "{t}" WHEN OLD."{i}" != NEW."{i}" AND (NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}")) '
+               'BEGIN DELETE FROM "{r}" WHERE id IN (OLD."{i}", NEW."{i}"); END',
+    'delete': 'AFTER DELETE ON "{t}" WHEN OLD."{c}" NOT NULL BEGIN DELETE FROM "{r}" WHERE id = OLD."{i}"; END'}
+
+
+def st_bound(position, blob):
+    return None if blob is None else geometry.gpkg_bounds(bytes(blob))[position]
+
+
+def st_is_empty(blob):
+    return None if blob is None else int(geometry.gpkg_is_empty(bytes(blob)))
+
+
+def gpkg_st_functions(connection):
+    # Register the SQL functions the R-tree triggers call - plain SQLite does not provide them
+
+    for position, name in enumerate(('ST_MinX', 'ST_MaxX', 'ST_MinY', 'ST_MaxY')):
+        connection.create_function(name, 1, functools.partial(st_bound, position), deterministic=True)
+    connection.create_function('ST_IsEmpty', 1, st_is_empty, deterministic=True)
+
+
+def has_gdal():
+    try:
+        from osgeo import ogr
+    except ImportError:
+        return False
+    return True
+
+
+def import_ogr():
+    # GDAL's vector module, with an error naming the missing dependency when the GDAL Python bindings are not
+    # installed. Only shapefiles can be read without them.
+
+    try:
+        from osgeo import ogr
+    except ImportError:
+        raise ImportError("The GDAL Python bindings (osgeo) are needed to read file geodatabases and other GDAL "
+                          "layers with the geopackage backend. Install GDAL, or use the arcpy backend.")
+    return ogr
+
+
+def ogr_source(path):
+    # Split the path of a layer in a GDAL readable workspace - a feature class, perhaps inside a feature dataset, of
+    # a file geodatabase such as a DOF tax map export, or a shapefile - into the workspace path and the layer name
+
+    if path.lower().endswith('.shp'):
+        return path, os.path.splitext(os.path.basename(path))[0]
+    workspace, layer = os.path.split(path)
+    while not os.path.splitext(workspace)[1] and os.path.dirname(workspace) != workspace:
+        workspace = os.path.dirname(workspace)
+    return workspace, layer
+
+
+def ogr_layers(path):
+    # Layer names of a GDAL readable workspace or of the feature dataset inside one. GDAL lists every layer of a
+    # file geodatabase, whichever feature dataset holds it.
+
+    ogr = import_ogr()
+    dataset = ogr.Open(ogr_source(os.path.join(path, ''))[0])
+    if dataset is None:
+        raise IOError("GDAL cannot open {}".format(path))
+    return [dataset.GetLayerByIndex(index).GetName() for index in range(dataset.GetLayerCount())]
+
+
+def open_ogr(source):
+    # GDAL dataset and layer of a feature source. The layer is only valid while the dataset is referenced.
+
+    ogr = import_ogr()
+    workspace, name = ogr_source(source)
+    dataset = ogr.Open(workspace)
+    layer = None if dataset is None else dataset.GetLayerByName(name)
+    if layer is None:
+        raise IOError("GDAL cannot open {}".format(source))
+    return dataset, layer
+
+
+def read_ogr(source, fields=None, where_clause=None):
+    # Read attribute fields, all of them when fields is None, and geometry as little-endian WKB from a layer GDAL can
+    # read, keeping the features selected by where_clause. Numeric fields are numeric even when every value read is
+    # null. Returns the attribute frame, the WKB of each feature, None for null geometries, and the layer's
+    # coordinate system WKT.
+
+    ogr = import_ogr()
+    dataset, layer = open_ogr(source)
+    definition = layer.GetLayerDefn()
+    if fields is None:
+        fields = [definition.GetFieldDefn(index).GetName() for index in range(definition.GetFieldCount())]
+    if where_clause and layer.SetAttributeFilter(where_clause) != 0:
+        raise ValueError("GDAL cannot filter {} on {}".format(source, where_clause))
+
+    records = []
+    wkbs = []
+    for feature in layer:
+        records.append([feature.GetField(field) for field in fields])
+        shape = feature.GetGeometryRef()
+        wkbs.append(None if shape is None else bytes(shape.ExportToIsoWkb(ogr.wkbNDR)))
+    frame = pd.DataFrame(records, columns=fields)
+    for field in fields:
+        field_type = definition.GetFieldDefn(definition.GetFieldIndex(field)).GetType()
+        if field_type in (ogr.OFTInteger, ogr.OFTInteger64, ogr.OFTReal):
+            frame[field] = pd.to_numeric(frame[field])
+    srs = layer.GetSpatialRef()
+    return frame, wkbs, None if srs is None else srs.ExportToWkt()
+
+
+def ogr_field_is_text(source, field):
+    # Whether a field of a layer GDAL can read is a text field, from the layer definition alone
+
+    ogr = import_ogr()
+    dataset, layer = open_ogr(source)
+    definition = layer.GetLayerDefn()
+    index = definition.GetFieldIndex(field)
+    return index >= 0 and definition.GetFieldDefn(index).GetType() == ogr.OFTString
+
+
+def where_mask(frame, where_clause):
+    # Boolean mask of the rows of an attribute frame selected by an SQL where clause, evaluated by SQLite so it
+    # matches a filter applied in a GeoPackage
+
+    connection = sqlite3.connect(':memory:')
+    try:
+        frame.to_sql('features', connection, index=False)
+        selected = [row[0] - 1 for row in connection.execute(
+            'SELECT rowid FROM features WHERE coalesce(({}), 0)'.format(where_clause))]
+    finally:
+        connection.close()
+    mask = np.zeros(len(frame), dtype=bool)
+    mask[selected] = True
+    return mask
+
+
+def is_shapefile(path):
+    return path.lower().endswith('.shp')
+
+
+def gpkg_table_path(path):
+    # GeoPackage path and table name of a dataset path inside a GeoPackage, or None when path is not inside one
+
+    workspace, table = os.path.split(path)
+    return (workspace, table) if workspace.lower().endswith('.gpkg') else None
+
+
+class GeoPackageWriter(object):
+    # Writes tables into a local GeoPackage so the pipeline can run without ArcGIS. Feature sources outside it, such
+    # as the dcp_mappluto shapefile and the DOF file geodatabases, are read through GDAL, and geometry is written as
+    # GeoPackage blobs. Without GDAL, shapefiles are read by the reader in mappluto_geometry.py.
+
+    oid_field = 'OBJECTID'
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=GPKG_BUSY_TIMEOUT)
+        gpkg_st_functions(self.connection)
+        self.initialize()
+
+    @staticmethod
+    def exists(path):
+        located = gpkg_table_path(path)
+        if located is None:
+            return os.path.exists(path)
+        if not os.path.isfile(located[0]):
+            return False
+        connection = sqlite3.connect(located[0])
+        try:
+            return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                      (located[1],)).fetchone() is not None
+        finally:
+            connection.close()
+
+    def create_workspace(self):
+        # The GeoPackage file and its metadata tables are created when the writer connects
+
+        pass
+
+    def table_name(self, source):
+        # Table name of a dataset path in this GeoPackage, or None when source is a table or file elsewhere
+
+        located = gpkg_table_path(source)
+        if located is None:
+            return None if os.path.dirname(source) else source
+        return located[1] if os.path.abspath(located[0]) == os.path.abspath(self.path) else None
+
+    def initialize(self):
+        # Create the GeoPackage core metadata tables if this is a new file. An existing GeoPackage is left untouched,
+        # so reading from one does not change its fingerprint for the next build.
+
+        cursor = self.connection.cursor()
+        if cursor.execute("PRAGMA application_id").fetchone()[0] == GPKG_APPLICATION_ID:
+            return
+        cursor.execute("PRAGMA application_id = {}".format(GPKG_APPLICATION_ID))
+        cursor.execute("PRAGMA user_version = {}".format(GPKG_USER_VERSION))
+        cursor.execute("CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, "
+                       "srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL, "
+                       "organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)")
+        cursor.executemany("INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)",
+                           [('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', None),
+                            ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', None),
+                            ('WGS 84 geodetic', 4326, 'EPSG', 4326, 'undefined', None)])
+        cursor.execute("CREATE TABLE IF NOT EXISTS gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, "
+                       "data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '', "
+                       "last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), "
+                       "min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER)")
+        cursor.execute("CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (table_name TEXT NOT NULL, "
+                       "column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, "
+                       "z TINYINT NOT NULL, m TINYINT NOT NULL, PRIMARY KEY (table_name, column_name))")
+        self.connection.commit()
+
+    def create_table(self, table, compiled, srs_id=None):
+        # Attribute table, or a feature table with a polygon geometry column when a coordinate system is given
+
+        print("Creating {} with appropriate field names and schema.".format(table))
+        columns = ['"OBJECTID" INTEGER PRIMARY KEY AUTOINCREMENT']
+        if srs_id is not None:
+            columns.append('"{}" {}'.format(geometry.GEOMETRY_FIELD, GPKG_GEOMETRY_TYPE))
+        for name, field_type in compiled['columns']:
+            columns.append('"{}" {}'.format(name, GPKG_TYPES.get(field_type, 'TEXT')))
+        cursor = self.connection.cursor()
+        self.drop_spatial_index(table)
+        cursor.execute('DROP TABLE IF EXISTS "{}"'.format(table))
+        cursor.execute('DELETE FROM gpkg_geometry_columns WHERE table_name = ?', (table,))
+        cursor.execute('CREATE TABLE "{}" ({})'.format(table, ', '.join(columns)))
+        cursor.execute("INSERT OR REPLACE INTO gpkg_contents (table_name, data_type, identifier, srs_id) "
+                       "VALUES (?, ?, ?, ?)", (table, 'attributes' if srs_id is None else 'features', table, srs_id))
+        if srs_id is not None:
+            cursor.execute("INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, 0, 0)",
+                           (table, geometry.GEOMETRY_FIELD, GPKG_GEOMETRY_TYPE, srs_id))
+        self.connection.commit()
+        print("Table created.")
+
+    def create_feature_class(self, table, compiled, template):
+        self.create_table(table, compiled, self.template_srs(template))
+
+    def template_srs(self, template):
+        # Coordinate system id of a feature source - a feature table in this GeoPackage, or a shapefile, a feature
+        # table in another GeoPackage or a layer GDAL can read, whose definition is registered in
+        # gpkg_spatial_ref_sys on first use
+
+        table = self.table_name(template)
+        if table is not None:
+            row = self.connection.execute("SELECT srs_id FROM gpkg_geometry_columns WHERE table_name = ?",
+                                          (table,)).fetchone()
+            return row[0] if row else -1
+        return self.register_srs(os.path.basename(template), source_srs_definition(template))
+
+    def register_srs(self, name, definition):
+        if definition is None:
+            return -1
+        cursor = self.connection.cursor()
+        row = cursor.execute("SELECT srs_id FROM gpkg_spatial_ref_sys WHERE definition = ?",
+                             (definition,)).fetchone()
+        if row:
+            return row[0]
+        srs_id = max(GPKG_CUSTOM_SRS_ID, cursor.execute("SELECT MAX(srs_id) + 1 FROM gpkg_spatial_ref_sys")
+                     .fetchone()[0])
+        cursor.execute("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)",
+                       (name, srs_id, 'NONE', srs_id, definition, None))
+        self.connection.commit()
+        return srs_id
+
+    def read_chunks(self, table, fields, chunksize=CHUNK_SIZE):
+        query = 'SELECT {} FROM "{}"'.format(', '.join('"{}"'.format(field) for field in fields), table)
+        for chunk in pd.read_sql_query(query, self.connection, chunksize=chunksize):
+            yield chunk
+
+    def read_features(self, source, fields, template=None, where_clause=None):
+        # Attribute fields and geometry of a feature source, all attribute fields when fields is None, keeping the
+        # features selected by where_clause. Features from outside this GeoPackage carry GeoPackage blobs in its
+        # registered coordinate system. Features are not reprojected, so when a template feature class is given a
+        # source in another coordinate system raises ValueError.
+
+        if template is not None:
+            self.check_srs(source, template)
+
+        table = self.table_name(source)
+        if table is not None:
+            columns = self.table_fields(table) if fields is None else list(fields) + [geometry.GEOMETRY_FIELD]
+            query = 'SELECT {} FROM "{}"'.format(', '.join('"{}"'.format(c) for c in columns), table)
+            if where_clause:
+                query += ' WHERE coalesce(({}), 0)'.format(where_clause)
+            return pd.read_sql_query(query, self.connection)
+        if is_shapefile(source) and not has_gdal():
+            select = None if not where_clause else functools.partial(where_mask, where_clause=where_clause)
+            return geometry.read_shapefile(source, fields, self.template_srs(source), select)
+
+        located = gpkg_table_path(source)
+        if located is not None:
+            reader = GeoPackageWriter(located[0])
+            try:
+                features = reader.read_features(located[1], fields, where_clause=where_clause)
+            finally:
+                reader.close()
+            return self.convert_srs(features, source)
+
+        frame, wkbs, definition = read_ogr(source, fields, where_clause)
+        srs_id = self.register_srs(os.path.basename(source), definition)
+        frame[geometry.GEOMETRY_FIELD] = wkb_blobs(wkbs, srs_id)
+        return frame
+
+    def srs_definition(self, srs_id):
+        row = self.connection.execute("SELECT definition FROM gpkg_spatial_ref_sys WHERE srs_id = ?",
+                                      (srs_id,)).fetchone()
+        return None if row is None or row[0] == 'undefined' else row[0]
+
+    def check_srs(self, source, template):
+        # Raise ValueError when source and template are in different coordinate systems. Sources or templates
+        # without a coordinate system are assumed to match, as are definitions GDAL reads as the same.
+
+        source_srs, template_srs = self.template_srs(source), self.template_srs(template)
+        if source_srs == template_srs:
+            return
+        source_definition, template_definition = self.srs_definition(source_srs), self.srs_definition(template_srs)
+        if source_definition is None or template_definition is None or \
+                same_srs(source_definition, template_definition):
+            return
+        raise ValueError("{} is not in the coordinate system of {}. Reproject it before the build, the GeoPackage "
+                         "backend does not reproject features.".format(source, template))
+
+    def convert_srs(self, features, source):
+        # Re-tag GeoPackage blobs read from another GeoPackage with this GeoPackage's id for their coordinate system
+
+        srs_id = self.template_srs(source)
+        features[geometry.GEOMETRY_FIELD] = wkb_blobs([geometry.wkb_bytes(value)
+                                                       for value in features[geometry.GEOMETRY_FIELD]], srs_id)
+        return features
+
+    def table_fields(self, table):
+        return [row[1] for row in self.connection.execute('PRAGMA table_info("{}")'.format(table))
+                if row[1] != 'OBJECTID']
+
+    def field_is_text(self, source, field):
+        table = self.table_name(source)
+        if table is not None:
+            return any(row[1].upper() == field.upper() and row[2].upper() == 'TEXT'
+                       for row in self.connection.execute('PRAGMA table_info("{}")'.format(table)))
+        if is_shapefile(source) and not has_gdal():
+            return geometry.dbf_field_type(os.path.splitext(source)[0] + '.dbf', field) == 'C'
+        located = gpkg_table_path(source)
+        if located is not None:
+            reader = GeoPackageWriter(located[0])
+            try:
+                return reader.field_is_text(located[1], field)
+            finally:
+                reader.close()
+        return ogr_field_is_text(source, field)
+
+    def copy_features(self, source, table, where_clause=None):
+        # Copy a feature source with all of its attribute fields into a new feature table, keeping the features
+        # selected by where_clause. Only the selected features are read into the table, so a borough shard writes
+        # its own lots. Numeric fields are stored as DOUBLE and everything else as TEXT.
+
+        features = self.read_features(source, None, where_clause=where_clause)
+        columns = [(name, 'DOUBLE' if pd.api.types.is_numeric_dtype(features[name]) else 'TEXT')
+                   for name in features.columns if name not in (geometry.GEOMETRY_FIELD, self.oid_field)]
+        self.create_table(table, {'columns': columns}, self.template_srs(source))
+        self.write(table, [features[[name for name, field_type in columns] + [geometry.GEOMETRY_FIELD]]])
+
+    def add_index(self, table, fields, index_name, unique=True):
+        # Attribute index on a field, or on several fields given as a list. Raises sqlite3.IntegrityError when a
+        # unique index meets duplicate values.
+
+        fields = [fields] if isinstance(fields, str) else list(fields)
+        cursor = self.connection.cursor()
+        cursor.execute('DROP INDEX IF EXISTS "{}"'.format(index_name))
+        cursor.execute('CREATE {}INDEX "{}" ON "{}" ({})'.format('UNIQUE ' if unique else '', index_name, table,
+                                                                 ', '.join('"{}"'.format(f) for f in fields)))
+        self.connection.commit()
+
+    def rtree_table(self, table):
+        return 'rtree_{}_{}'.format(table, geometry.GEOMETRY_FIELD)
+
+    def has_spatial_index(self, table):
+        return self.connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                       (self.rtree_table(table),)).fetchone() is not None
+
+    def rtree_triggers(self, table, create=True):
+        names = {'t': table, 'c': geometry.GEOMETRY_FIELD, 'i': self.oid_field, 'r': self.rtree_table(table)}
+        for event, body in GPKG_RTREE_TRIGGERS.items():
+            trigger = '{}_{}'.format(names['r'], event)
+            self.connection.execute('DROP TRIGGER IF EXISTS "{}"'.format(trigger))
+            if create:
+                self.connection.execute('CREATE TRIGGER "{}" {}'.format(trigger, body.format(**names)))
+
+    def add_spatial_index(self, table, grid_size=None):
+        # Build the GeoPackage R-tree spatial index from the envelope in each geometry blob and register it in
+        # gpkg_extensions. R-trees size themselves to the data, so grid_size does not apply. Returns None.
+
+        cursor = self.connection.cursor()
+        self.drop_spatial_index(table)
+        rtree = self.rtree_table(table)
+        cursor.execute('CREATE VIRTUAL TABLE "{}" USING rtree(id, minx, maxx, miny, maxy)'.format(rtree))
+        features = self.connection.execute('SELECT "{}", "{}" FROM "{}" WHERE "{}" NOT NULL'.format(
+            self.oid_field, geometry.GEOMETRY_FIELD, table, geometry.GEOMETRY_FIELD))
+        cursor.executemany('INSERT INTO "{}" VALUES (?, ?, ?, ?, ?)'.format(rtree),
+                           ((oid,) + tuple(geometry.gpkg_bounds(blob)) for oid, blob in features
+                            if not geometry.gpkg_is_empty(blob)))
+        self.rtree_triggers(table)
+        cursor.execute("CREATE TABLE IF NOT EXISTS gpkg_extensions (table_name TEXT, column_name TEXT, "
+                       "extension_name TEXT NOT NULL, definition TEXT NOT NULL, scope TEXT NOT NULL, "
+                       "CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))")
+        cursor.execute("INSERT OR REPLACE INTO gpkg_extensions VALUES (?, ?, ?, ?, ?)",
+                       (table, geometry.GEOMETRY_FIELD) + GPKG_RTREE_EXTENSION)
+        self.connection.commit()
+        return None
+
+    def drop_spatial_index(self, table):
+        # Drop a table's R-tree along with its triggers and registration, leaving the commit to the caller
+
+        if not self.has_spatial_index(table):
+            return
+        self.rtree_triggers(table, create=False)
+        self.connection.execute('DROP TABLE "{}"'.format(self.rtree_table(table)))
+        self.connection.execute("DELETE FROM gpkg_extensions WHERE table_name = ? AND extension_name = ?",
+                                (table, GPKG_RTREE_EXTENSION[0]))
+
+    def list_contents(self, data_type, wildcard=None):
+        names = [row[0] for row in self.connection.execute(
+            "SELECT table_name FROM gpkg_contents WHERE data_type = ? ORDER BY table_name", (data_type,))]
+        return [name for name in names if wildcard is None or fnmatch.fnmatch(name.lower(), wildcard.lower())]
+
+    def list_feature_classes(self, wildcard=None):
+        return self.list_contents('features', wildcard)
+
+    def list_tables(self, wildcard=None):
+        return self.list_contents('attributes', wildcard)
+
+    def rename(self, name, new_name):
+        # A spatial index is renamed with its table, as R-tree tables and triggers are named after it
+
+        cursor = self.connection.cursor()
+        spatial = self.has_spatial_index(name)
+        if spatial:
+            self.rtree_triggers(name, create=False)
+        cursor.execute('ALTER TABLE "{}" RENAME TO "{}"'.format(name, new_name))
+        cursor.execute("UPDATE gpkg_contents SET table_name = ?, identifier = ? WHERE table_name = ?",
+                       (new_name, new_name, name))
+        cursor.execute("UPDATE gpkg_geometry_columns SET table_name = ? WHERE table_name = ?", (new_name, name))
+        if spatial:
+            cursor.execute('ALTER TABLE "{}" RENAME TO "{}"'.format(self.rtree_table(name),
+                                                                    self.rtree_table(new_name)))
+            cursor.execute("UPDATE gpkg_extensions SET table_name = ? WHERE table_name = ?", (new_name, name))
+            self.rtree_triggers(new_name)
+        self.connection.commit()
+
+    def delete(self, name):
+        cursor = self.connection.cursor()
+        self.drop_spatial_index(name)
+        cursor.execute('DROP TABLE IF EXISTS "{}"'.format(name))
+        cursor.execute("DELETE FROM gpkg_geometry_columns WHERE table_name = ?", (name,))
+        cursor.execute("DELETE FROM gpkg_contents WHERE table_name = ?", (name,))
+        self.connection.commit()
+
+    def copy_workspace(self, destination):
+        # Replace destination with a consistent copy of the GeoPackage through the SQLite backup API
+
+        if os.path.isdir(destination):
+            shutil.rmtree(destination)
+        elif os.path.exists(destination):
+            os.remove(destination)
+        copy = sqlite3.connect(destination)
+        try:
+            self.connection.backup(copy)
+        finally:
+            copy.close()
+
+    def release(self):
+        self.close()
+
+    def write(self, table, frames):
+        first, frames = peek_frames(frames)
+        if first is None:
+            return 0
+
+        statement = 'INSERT INTO "{}" ({}) VALUES ({})'.format(table,
+                                                              ', '.join('"{}"'.format(c) for c in first.columns),
+                                                              ', '.join('?' for c in first.columns))
+        row_count = 0
+        cursor = self.connection.cursor()
+        for frame in frames:
+            # GeoPackage stores dates as ISO 8601 text
+
+            for column in frame.columns:
+                if pd.api.types.is_datetime64_any_dtype(frame[column]):
+                    frame = frame.assign(**{column: frame[column].dt.strftime('%Y-%m-%dT%H:%M:%S')})
+            cursor.executemany(statement, frame_rows(frame))
+            row_count += len(frame)
+        self.connection.commit()
+        print("{} rows inserted into {}".format(row_count, table))
+        return row_count
+
+    def update_geometries(self, table, geometries):
+        # Replace the geometry of features by object id with plain WKB stored as GeoPackage blobs in the table's
+        # coordinate system, deleting the features mapped to None
+
+        if not geometries:
+            return 0
+        import shapely
+        srs_id = self.template_srs(table)
+        cursor = self.connection.cursor()
+        for oid, wkb in geometries.items():
+            if wkb is None:
+                cursor.execute('DELETE FROM "{}" WHERE "OBJECTID" = ?'.format(table), (oid,))
+                continue
+            minx, miny, maxx, maxy = shapely.bounds(shapely.from_wkb(wkb))
+            cursor.execute('UPDATE "{}" SET "{}" = ? WHERE "OBJECTID" = ?'.format(table, geometry.GEOMETRY_FIELD),
+                           (geometry.gpkg_blob(bytes(wkb), (minx, maxx, miny, maxy), srs_id), oid))
+        self.connection.commit()
+        print("{} geometries updated in {}".format(len(geometries), table))
+        return len(geometries)
+
+    def read_table(self, table):
+        return pd.read_sql_query('SELECT * FROM "{}"'.format(table), self.connection)
+
+    def close(self):
+        self.connection.close()
+
+
+def source_srs_definition(source):
+    # Coordinate system definition of a feature source outside the GeoPackage being written - a feature table's
+    # entry in another GeoPackage, or the WKT GDAL reads from any other layer such as a shapefile. Without GDAL a
+    # shapefile's is read from its .prj.
+
+    if is_shapefile(source) and not has_gdal():
+        return geometry.read_prj(source)
+    located = gpkg_table_path(source)
+    if located is None:
+        ogr = import_ogr()
+        workspace, name = ogr_source(source)
+        dataset = ogr.Open(workspace)
+        layer = None if dataset is None else dataset.GetLayerByName(name)
+        srs = None if layer is None else layer.GetSpatialRef()
+        return None if srs is None else srs.ExportToWkt()
+    connection = sqlite3.connect(located[0])
+    try:
+        row = connection.execute("SELECT s.definition FROM gpkg_geometry_columns g JOIN gpkg_spatial_ref_sys s "
+                                 "ON s.srs_id = g.srs_id WHERE g.table_name = ?", (located[1],)).fetchone()
+    finally:
+        connection.close()
+    return None if row is None or row[0] == 'undefined' else row[0]
+
+
+def same_srs(first, second):
+    # Whether two coordinate system definitions describe the same system, compared by GDAL when it is installed
+    # and as text otherwise
+
+    try:
+        from osgeo import osr
+    except ImportError:
+        return first == second
+    first_srs, second_srs = osr.SpatialReference(), osr.SpatialReference()
+    first_srs.ImportFromWkt(first)
+    second_srs.ImportFromWkt(second)
+    return bool(first_srs.IsSame(second_srs))
+
+
+def wkb_blobs(wkbs, srs_id):
+    # GeoPackage blobs of plain WKB geometries, None for null geometries
+
+    import shapely
+    blobs = []
+    for wkb in wkbs:
+        if wkb is None:
+            blobs.append(None)
+            continue
+        minx, miny, maxx, maxy = shapely.bounds(shapely.from_wkb(wkb))
+        blobs.append(geometry.gpkg_blob(bytes(wkb), (minx, maxx, miny, maxy), srs_id))
+    return blobs
+
+
+# Geoprocessing backends selectable under [PIPELINE] in the configuration file, and the file extension of each
+# backend's workspaces
+
+BACKENDS = {'arcpy': ArcPyWriter, 'geopackage': GeoPackageWriter}
+
+WORKSPACE_EXTENSIONS = {'arcpy': '.gdb', 'geopackage': '.gpkg'}
+
+
+def backend_class(backend):
+    if backend not in BACKENDS:
+        raise ValueError("Unknown geoprocessing backend {}. Available: {}".format(backend, ', '.join(BACKENDS)))
+    return BACKENDS[backend]
+
+
+def open_workspace(backend, workspace, geometry_token='SHAPE@'):
+    # Writer for a workspace of the named backend. geometry_token only applies to ArcPy; GeoPackage geometry is
+    # always read and written as GeoPackage blobs, which every geometry stage accepts as well as WKB.
+
+    if backend_class(backend) is ArcPyWriter:
+        return ArcPyWriter(workspace, geometry_token)
+    return GeoPackageWriter(workspace)
+
+
+def dataset_exists(backend, path):
+    return backend_class(backend).exists(path)
+
+
+def workspace_path(backend, path):
+    # Workspace path with the backend's file extension in place of the configured one
+
+    return os.path.splitext(path)[0] + WORKSPACE_EXTENSIONS[backend]
+
+
+def list_layers(backend, path, wildcard='*'):
+    # Feature classes in a workspace or feature dataset the pipeline reads but never writes, such as a DOF tax map
+    # export's DCP dataset. GeoPackage builds read these through GDAL.
+
+    if backend_class(backend) is ArcPyWriter:
+        import arcpy
+        arcpy.env.workspace = path
+        return arcpy.ListFeatureClasses(wildcard) or []
+    return [name for name in ogr_layers(path) if fnmatch.fnmatch(name.lower(), wildcard.lower())]
+
+
+def geoprocessing_messages():
+    # Messages of the last ArcPy tool run, for the error log. Empty when ArcPy is not installed.
+
+    try:
+        import arcpy
+    except ImportError:
+        return ''
+    return arcpy.GetMessages()
@@ -0,0 +1,971 @@
+import os
+import sys
+import json
+import struct
+import datetime
+import timeit
+import argparse
+import tempfile
+import shutil
+import pathlib
+import subprocess
+import numpy as np
+import pandas as pd
+import mappluto_ingest as ingest
+import mappluto_backends as backends
+import mappluto_schema as schema
+import mappluto_join as join
+import mappluto_erase as erase
+import mappluto_geometry as geometry
+import mappluto_publish as publish
+import mappluto_columnar as columnar
+import mappluto_validate as validate
+import mappluto_shard as shard
+import mappluto_stages as stages
+import mappluto_pipeline as pipeline
+import mappluto_instrument as instrument
+import mappluto_index as indexing
+from mappluto_instrument import peak_rss_mb
+
+# Synthetic MapPLUTO field definitions used to generate benchmark inputs - csv name, output name, type, length
+
+SYNTHETIC_FIELDS = [
+    ('borough', 'Borough', 'TEXT', 2), ('block', 'Block', 'LONG', None), ('lot', 'Lot', 'SHORT', None),
+    ('cd', 'CD', 'SHORT', None), ('ct2010', 'CT2010', 'TEXT', 7), ('cb2010', 'CB2010', 'TEXT', 5),
+    ('schooldist', 'SchoolDist', 'TEXT', 3), ('council', 'Council', 'SHORT', None),
+    ('zipcode', 'ZipCode', 'LONG', None), ('firecomp', 'FireComp', 'TEXT', 4),
+    ('policeprct', 'PolicePrct', 'SHORT', None), ('healthcenterdistrict', 'HealthCenterDistrict', 'SHORT', None),
+    ('healtharea', 'HealthArea', 'SHORT', None), ('sanitboro', 'Sanitboro', 'TEXT', 1),
+    ('sanitdistrict', 'SanitDistrict', 'TEXT', 2), ('sanitsub', 'SanitSub', 'TEXT', 2),
+    ('address', 'Address', 'TEXT', 28), ('zonedist1', 'ZoneDist1', 'TEXT', 9), ('zonedist2', 'ZoneDist2', 'TEXT', 9),
+    ('zonedist3', 'ZoneDist3', 'TEXT', 9), ('zonedist4', 'ZoneDist4', 'TEXT', 9), ('overlay1', 'Overlay1', 'TEXT', 4),
+    ('overlay2', 'Overlay2', 'TEXT', 4), ('spdist1', 'SPDist1', 'TEXT', 6), ('spdist2', 'SPDist2', 'TEXT', 6),
+    ('spdist3', 'SPDist3', 'TEXT', 6), ('ltdheight', 'LtdHeight', 'TEXT', 5), ('splitzone', 'SplitZone', 'TEXT', 1),
+    ('bldgclass', 'BldgClass', 'TEXT', 2), ('landuse', 'LandUse', 'TEXT', 2), ('easements', 'Easements', 'SHORT', None),
+    ('ownertype', 'OwnerType', 'TEXT', 1), ('ownername', 'OwnerName', 'TEXT', 85), ('lotarea', 'LotArea', 'LONG', None),
+    ('bldgarea', 'BldgArea', 'LONG', None), ('comarea', 'ComArea', 'LONG', None), ('resarea', 'ResArea', 'LONG', None),
+    ('officearea', 'OfficeArea', 'LONG', None), ('retailarea', 'RetailArea', 'LONG', None),
+    ('garagearea', 'GarageArea', 'LONG', None), ('strgearea', 'StrgeArea', 'LONG', None),
+    ('factryarea', 'FactryArea', 'LONG', None), ('otherarea', 'OtherArea', 'LONG', None),
+    ('areasource', 'AreaSource', 'TEXT', 1), ('numbldgs', 'NumBldgs', 'LONG', None),
+    ('numfloors', 'NumFloors', 'DOUBLE', None), ('unitsres', 'UnitsRes', 'LONG', None),
+    ('unitstotal', 'UnitsTotal', 'LONG', None), ('lotfront', 'LotFront', 'DOUBLE', None),
+    ('lotdepth', 'LotDepth', 'DOUBLE', None), ('bldgfront', 'BldgFront', 'DOUBLE', None),
+    ('bldgdepth', 'BldgDepth', 'DOUBLE', None), ('ext', 'Ext', 'TEXT', 2), ('proxcode', 'ProxCode', 'TEXT', 1),
+    ('irrlotcode', 'IrrLotCode', 'TEXT', 1), ('lottype', 'LotType', 'TEXT', 1), ('bsmtcode', 'BsmtCode', 'TEXT', 1),
+    ('assessland', 'AssessLand', 'DOUBLE', None), ('assesstot', 'AssessTot', 'DOUBLE', None),
+    ('exempttot', 'ExemptTot', 'DOUBLE', None), ('yearbuilt', 'YearBuilt', 'SHORT', None),
+    ('yearalter1', 'YearAlter1', 'SHORT', None), ('yearalter2', 'YearAlter2', 'SHORT', None),
+    ('histdist', 'HistDist', 'TEXT', 40), ('landmark', 'Landmark', 'TEXT', 35), ('builtfar', 'BuiltFAR', 'DOUBLE', None),
+    ('residfar', 'ResidFAR', 'DOUBLE', None), ('commfar', 'CommFAR', 'DOUBLE', None),
+    ('facilfar', 'FacilFAR', 'DOUBLE', None), ('borocode', 'BoroCode', 'SHORT', None), ('bbl', 'BBL', 'DOUBLE', None),
+    ('condono', 'CondoNo', 'SHORT', None), ('tract2010', 'Tract2010', 'TEXT', 6), ('xcoord', 'XCoord', 'LONG', None),
+    ('ycoord', 'YCoord', 'LONG', None), ('zonemap', 'ZoneMap', 'TEXT', 3), ('zmcode', 'ZMCode', 'TEXT', 1),
+    ('sanborn', 'Sanborn', 'TEXT', 8), ('taxmap', 'TaxMap', 'TEXT', 5), ('edesignum', 'EDesigNum', 'TEXT', 5),
+    ('appbbl', 'APPBBL', 'DOUBLE', None), ('appdate', 'APPDate', 'TEXT', 10),
+    ('plutomapid', 'PLUTOMapID', 'TEXT', 1), ('firm07_flag', 'FIRM07_FLAG', 'TEXT', 1),
+    ('pfirm15_flag', 'PFIRM15_FLAG', 'TEXT', 1), ('version', 'Version', 'TEXT', 10),
+    ('dcpedit', 'DCPEdit', 'TEXT', 30), ('latitude', 'Latitude', 'DOUBLE', None),
+    ('longitude', 'Longitude', 'DOUBLE', None), ('notes', 'Notes', 'TEXT', 20)
+]
+
+# Fields present in the Data Engineering csv output that are dropped during conversion
+
+SYNTHETIC_DROP_FIELDS = ['geom', 'mappluto_f', 'rpaddate', 'dcasdate', 'zoningdate', 'landmkdate', 'basempdate',
+                         'masdate', 'polidate', 'edesigdate', 'exemptland']
+
+BORO_CODES = {1: 'MN', 2: 'BX', 3: 'BK', 4: 'QN', 5: 'SI'}
+
+# Synthetic tax lots are square polygons laid out on a grid in state plane feet
+
+LOT_SIZE = 100.0
+LOT_GRID_WIDTH = 1000
+
+# Lot counts of the pipeline benchmark's scale presets - about one large borough, the whole city and twice the city
+
+SCALES = {'borough': 280000, 'city': 860000, '2x_city': 1720000}
+
+# A stage or step is flagged as a regression when it takes this fraction longer, or peaks this fraction higher, than
+# the last comparable run in the history, and by more than the minimum change so small steps do not flag on noise
+
+REGRESSION_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 1.0
+MIN_REGRESSION_MB = 50.0
+
+# Every n-th csv row has no tax lot polygon, so the join and QA always have unmatched BBLs to report
+
+MISSING_LOT_INTERVAL = 50
+
+# Queries timed by the index case on each pass, and the smaller number timed before an index exists, when every
+# query scans the table
+
+INDEXED_QUERIES = 2000
+UNINDEXED_QUERIES = 20
+
+# Side of the bbox queries in lots
+
+BBOX_LOTS = 5
+
+
+def synthetic_frame(rows, start=0, seed=0):
+    # Generate a block of synthetic MapPLUTO attribute rows with realistic value widths
+
+    rng = np.random.default_rng(seed + start)
+    row_id = np.arange(start, start + rows)
+    borocode = rng.integers(1, 6, rows)
+    block = 1 + (row_id // 50) % 99999
+    lot = 1 + row_id % 50
+    frame = {}
+
+    for csv_name, out_name, field_type, length in SYNTHETIC_FIELDS:
+        if csv_name == 'borough':
+            frame[csv_name] = pd.Series(borocode).map(BORO_CODES).values
+        elif csv_name == 'borocode':
+            frame[csv_name] = borocode
+        elif csv_name == 'block':
+            frame[csv_name] = block
+        elif csv_name == 'lot':
+            frame[csv_name] = lot
+        elif csv_name in ('bbl', 'appbbl'):
+            frame[csv_name] = (borocode * 1000000000 + block * 10000 + lot).astype(float)
+        elif csv_name == 'plutomapid':
+            frame[csv_name] = rng.choice(['1', '1', '1', '1', '1', '1', '2', '3', '4'], rows)
+        elif field_type == 'TEXT':
+            values = pd.Series(rng.choice(['A', 'R6', 'C4-4A', 'M1-1', 'SPECIAL DISTRICT', None], rows))
+            frame[csv_name] = values.str.slice(0, length).values
+        elif field_type == 'DOUBLE':
+            frame[csv_name] = np.round(rng.random(rows) * 1000, 2)
+        else:
+            frame[csv_name] = rng.integers(0, 30000, rows)
+
+    for field in SYNTHETIC_DROP_FIELDS:
+        frame[field] = rng.choice(['2019-06-01', None], rows)
+
+    return pd.DataFrame(frame)
+
+
+def synthetic_schema():
+    # Schema dictionary in the corrections/originals json layout - name, type, precision, scale, length,
+    # alias, nullable
+
+    return {csv_name: [out_name, field_type, '', '', length if length else '', out_name, 'NULLABLE']
+            for csv_name, out_name, field_type, length in SYNTHETIC_FIELDS}
+
+
+def write_synthetic_schema(path):
+    with open(path, "w") as schema:
+        json.dump(synthetic_schema(), schema, indent=4)
+    return path
+
+
+def write_synthetic_csv(path, rows, chunksize=ingest.CHUNK_SIZE):
+    # Write a synthetic MapPLUTO csv to disk in chunks so generation itself stays memory flat
+
+    header = True
+    with open(path, "w", newline="") as out:
+        for start in range(0, rows, chunksize):
+            synthetic_frame(min(chunksize, rows - start), start).to_csv(out, header=header, index=False)
+            header = False
+    return path
+
+
+def synthetic_bbls(rows, chunksize=ingest.CHUNK_SIZE):
+    # BBLs of the synthetic csv rows, in csv order
+
+    return np.concatenate([synthetic_frame(min(chunksize, rows - start), start)['bbl'].values
+                           for start in range(0, rows, chunksize)]).astype('int64')
+
+
+def write_synthetic_shapefile(path, bbls):
+    # Write a polygon shapefile of one square lot per BBL with BBL stored as a double, as in the Data Engineering
+    # shapefile that Join_File is copied from
+
+    positions = np.arange(len(bbls))
+    x0 = (positions % LOT_GRID_WIDTH) * LOT_SIZE
+    y0 = (positions // LOT_GRID_WIDTH) * LOT_SIZE
+    x1, y1 = x0 + LOT_SIZE * 0.9, y0 + LOT_SIZE * 0.9
+    bbox = (x0.min(), y0.min(), x1.max(), y1.max()) if len(bbls) else (0.0, 0.0, 0.0, 0.0)
+
+    content_length = 4 + 32 + 8 + 4 + 16 * 5
+    file_length = 100 + len(bbls) * (8 + content_length)
+
+    def header(length):
+        return struct.pack('>7i', 9994, 0, 0, 0, 0, 0, length // 2) + struct.pack('<2i8d', 1000, 5, *(bbox + (0,) * 4))
+
+    base = os.path.splitext(path)[0]
+    with open(base + '.shp', "wb") as shp, open(base + '.shx', "wb") as shx:
+        shp.write(header(file_length))
+        shx.write(header(100 + 8 * len(bbls)))
+        for record in range(len(bbls)):
+            ring = [(x0[record], y0[record]), (x0[record], y1[record]), (x1[record], y1[record]),
+                    (x1[record], y0[record]), (x0[record], y0[record])]
+            shx.write(struct.pack('>2i', (100 + record * (8 + content_length)) // 2, content_length // 2))
+            shp.write(struct.pack('>2i', record + 1, content_length // 2))
+            shp.write(struct.pack('<i4d3i', 5, x0[record], y0[record], x1[record], y1[record], 1, 5, 0))
+            shp.write(struct.pack('<10d', *[value for point in ring for value in point]))
+
+    field_length = 20
+    with open(base + '.dbf', "wb") as dbf:
+        dbf.write(struct.pack('<4BIHH20x', 3, 120, 1, 1, len(bbls), 32 + 32 + 1, 1 + field_length))
+        dbf.write(struct.pack('<11sc4xBB14x', b'BBL', b'N', field_length, 1))
+        dbf.write(b'\x0d')
+        for bbl in bbls:
+            dbf.write(b' ' + '{:.1f}'.format(bbl).rjust(field_length).encode('ascii'))
+        dbf.write(b'\x1a')
+    return base + '.shp'
+
+
+def legacy_ingest(input_csv, output_csv, input_field_drop):
+    # Previous whole-file export - full read for field list, per-field drop, full re-read with python engine
+
+    mappluto_initial = pd.read_csv(input_csv)
+    fields = [field for field in mappluto_initial.columns.values]
+    for field in fields[:]:
+        if field in input_field_drop:
+            mappluto_initial = mappluto_initial.drop(labels=[field], axis=1)
+            fields.remove(field)
+    mappluto_allboro_df = pd.read_csv(input_csv, engine="python", dtype=object)
+    mappluto_allboro_df = mappluto_allboro_df[fields]
+    mappluto_allboro_df.to_csv(output_csv)
+
+
+def streaming_ingest(input_csv, output_csv, input_field_drop):
+    # Header-only read and single chunked pass over kept columns
+
+    fields = ingest.project_fields(ingest.read_csv_header(input_csv), input_field_drop)
+    ingest.stream_csv(input_csv, output_csv, fields)
+
+
+INGEST_PATHS = {'legacy': legacy_ingest, 'streaming': streaming_ingest}
+
+
+def bench_load(rows, workdir):
+    # Typed bulk load of the synthetic csv into a local GeoPackage table through the writer interface
+
+    input_csv = os.path.join(workdir, 'synthetic_mappluto.csv')
+    if not os.path.isfile(input_csv):
+        write_synthetic_csv(input_csv, rows)
+    compiled = schema.compile_schema(synthetic_schema())
+    fields = ingest.project_fields(ingest.read_csv_header(input_csv), SYNTHETIC_DROP_FIELDS)
+    schema.validate_fields(compiled, fields)
+
+    gpkg_path = os.path.join(workdir, 'synthetic_mappluto.gpkg')
+    if os.path.isfile(gpkg_path):
+        os.remove(gpkg_path)
+    writer = backends.GeoPackageWriter(gpkg_path)
+    writer.create_table('MapPLUTO_final', compiled)
+
+    start = timeit.default_timer()
+    row_count, report = ingest.load_typed_table(ingest.read_chunks(input_csv, fields), compiled, writer,
+                                                'MapPLUTO_final')
+    elapsed = timeit.default_timer() - start
+    writer.close()
+    print("load: {} rows in {:.2f} s ({:.0f} rows/s), {} fields with cast failures".format(
+        row_count, elapsed, row_count / elapsed if elapsed else 0, len(report)))
+
+
+def bench_columnar(rows, workdir):
+    # Size and load time of the typed Arrow intermediate against the text output csv it replaces. Loading the csv
+    # means parsing and casting it again; the Arrow file is memory-mapped, for all columns and for the BBL column
+    # the join reads.
+
+    input_csv = os.path.join(workdir, 'synthetic_mappluto.csv')
+    if not os.path.isfile(input_csv):
+        write_synthetic_csv(input_csv, rows)
+    compiled = schema.compile_schema(synthetic_schema())
+    fields = ingest.project_fields(ingest.read_csv_header(input_csv), SYNTHETIC_DROP_FIELDS)
+    output_csv = os.path.join(workdir, 'output_columnar.csv')
+    arrow_path = os.path.join(workdir, 'typed_columnar.arrow')
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    chunks = ingest.export_chunks(ingest.read_chunks(input_csv, fields), output_csv)
+    for chunk in columnar.export_batches((ingest.cast_frame(chunk, compiled)[0] for chunk in chunks), arrow_path,
+                                         compiled):
+        pass
+    sys.stdout = stdout
+
+    names = [name for name, field_type in compiled['columns']]
+    timings = {}
+
+    start = timeit.default_timer()
+    from_csv = pd.concat([ingest.cast_frame(chunk, compiled)[0] for chunk in ingest.read_chunks(output_csv, fields)])
+    timings['csv'] = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    from_arrow = pd.concat(list(columnar.read_chunks(arrow_path, names)))
+    timings['arrow'] = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    for chunk in ingest.read_chunks(output_csv, ['bbl']):
+        ingest.cast_frame(chunk, compiled)
+    timings['csv_bbl'] = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    for chunk in columnar.read_chunks(arrow_path, ['BBL']):
+        pass
+    timings['arrow_bbl'] = timeit.default_timer() - start
+
+    try:
+        pd.testing.assert_frame_equal(from_csv.reset_index(drop=True), from_arrow.reset_index(drop=True),
+                                      check_dtype=False)
+        identical = True
+    except AssertionError:
+        identical = False
+
+    print("columnar: csv {:.1f} MB, arrow {:.1f} MB; full load csv {csv:.2f} s, arrow {arrow:.2f} s; "
+          "BBL column csv {csv_bbl:.2f} s, arrow {arrow_bbl:.2f} s; identical values: {}".format(
+              os.path.getsize(output_csv) / 1024.0 / 1024.0, os.path.getsize(arrow_path) / 1024.0 / 1024.0,
+              identical, **timings))
+
+
+def bench_join(rows, workdir):
+    # Hash join of synthetic tax lot polygons read from a shapefile onto the typed table in a local GeoPackage.
+    # Every 50th attribute row has no lot and every 40th lot has no attribute row, so both sides report unmatched.
+
+    input_csv = os.path.join(workdir, 'synthetic_mappluto.csv')
+    if not os.path.isfile(input_csv):
+        write_synthetic_csv(input_csv, rows)
+    compiled = schema.compile_schema(synthetic_schema())
+    fields = ingest.project_fields(ingest.read_csv_header(input_csv), SYNTHETIC_DROP_FIELDS)
+
+    bbls = synthetic_bbls(rows)
+    lot_bbls = np.concatenate([np.delete(bbls, np.arange(0, rows, 50)), 6000000000 + np.arange(rows // 40)])
+    shp_path = write_synthetic_shapefile(os.path.join(workdir, 'synthetic_join_file.shp'), lot_bbls)
+
+    gpkg_path = os.path.join(workdir, 'synthetic_mappluto_join.gpkg')
+    if os.path.isfile(gpkg_path):
+        os.remove(gpkg_path)
+    writer = backends.GeoPackageWriter(gpkg_path)
+    writer.create_table('MapPLUTO_final', compiled)
+    ingest.load_typed_table(ingest.read_chunks(input_csv, fields), compiled, writer, 'MapPLUTO_final')
+
+    start = timeit.default_timer()
+    features = writer.read_features(shp_path, ['BBL'])
+    read_elapsed = timeit.default_timer() - start
+    writer.create_feature_class('MapPLUTO_Water_Included', compiled, shp_path)
+    attribute_fields = [name for name, field_type in compiled['columns']]
+    row_count, unmatched = join.join_table(features, writer.read_chunks('MapPLUTO_final', attribute_fields), writer,
+                                           'MapPLUTO_Water_Included')
+    elapsed = timeit.default_timer() - start
+    writer.close()
+
+    expected = rows - len(range(0, rows, 50))
+    print("join: {} rows in {:.2f} s ({:.2f} s reading shapefile), {} unmatched BBLs, expected {} rows: {}".format(
+        row_count, elapsed, read_elapsed, len(unmatched), expected, row_count == expected))
+
+
+def synthetic_lots(rows):
+    # One square lot per row on the lot grid, as GeoPackage blobs keyed by a running BBL
+
+    positions = np.arange(rows)
+    x0 = (positions % LOT_GRID_WIDTH) * LOT_SIZE
+    y0 = (positions // LOT_GRID_WIDTH) * LOT_SIZE
+    x1, y1 = x0 + LOT_SIZE * 0.9, y0 + LOT_SIZE * 0.9
+    blobs = [geometry.polygon_blob([[[(a, b), (a, d), (c, d), (c, b), (a, b)]]], -1)
+             for a, b, c, d in zip(x0, y0, x1, y1)]
+    return pd.DataFrame({'BBL': 1000000000.0 + positions, geometry.GEOMETRY_FIELD: blobs})
+
+
+def synthetic_shoreline(rows):
+    # Water polygons crossing the lot grid - a meandering river band and a few round inlets
+
+    import shapely
+    width = LOT_GRID_WIDTH * LOT_SIZE
+    height = max(rows // LOT_GRID_WIDTH, 1) * LOT_SIZE
+    x = np.linspace(-LOT_SIZE, width + LOT_SIZE, 400)
+    river = shapely.LineString(np.column_stack([x, height / 2 + height / 4 * np.sin(x / width * 6 * np.pi)]))
+    inlets = [shapely.Point(width * fraction, height * 0.15).buffer(height * 0.08) for fraction in (0.2, 0.5, 0.8)]
+    polygons = [river.buffer(max(height * 0.03, LOT_SIZE * 2))] + inlets
+    template = geometry.gpkg_blob(b'', (0.0, 0.0, 0.0, 0.0), -1)
+    return pd.DataFrame({geometry.GEOMETRY_FIELD: geometry.to_values(np.array(polygons), template)})
+
+
+def bench_erase(rows, workdir, max_workers=None):
+    # Validation and timing harness for the tiled erase. Synthetic lots are erased by the tiled engine into a local
+    # GeoPackage and compared lot by lot with a single overlay of every lot against the whole shoreline.
+
+    import shapely
+    lots = synthetic_lots(rows)
+    shoreline = synthetic_shoreline(rows)
+    compiled = schema.compile_schema({'bbl': ['BBL', 'DOUBLE', '', '', '', 'BBL', 'NULLABLE']})
+
+    gpkg_path = os.path.join(workdir, 'synthetic_erase.gpkg')
+    if os.path.isfile(gpkg_path):
+        os.remove(gpkg_path)
+    writer = backends.GeoPackageWriter(gpkg_path)
+    writer.create_table('Water_Included', compiled, -1)
+    writer.write('Water_Included', [lots])
+    writer.create_table('Shoreline_Clipped', compiled, -1)
+
+    start = timeit.default_timer()
+    erase.erase_table(writer.read_chunks('Water_Included', ['BBL', geometry.GEOMETRY_FIELD]), shoreline, writer,
+                      'Shoreline_Clipped', max_workers=max_workers)
+    tiled_elapsed = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    reference = shapely.difference(geometry.from_values(lots[geometry.GEOMETRY_FIELD]),
+                                   shapely.union_all(geometry.from_values(shoreline[geometry.GEOMETRY_FIELD])))
+    reference = pd.Series([geometry.as_multipolygon(geom) for geom in reference], index=lots['BBL'])
+    reference = reference[reference.notna()]
+    full_elapsed = timeit.default_timer() - start
+
+    output = writer.read_features('Shoreline_Clipped', ['BBL']).set_index('BBL')[geometry.GEOMETRY_FIELD]
+    writer.close()
+    output = pd.Series(geometry.from_values(output), index=output.index).reindex(reference.index)
+    same_lots = len(output) == len(reference) and output.notna().all()
+    difference = shapely.area(shapely.symmetric_difference(output.values, reference.values))
+    equivalent = same_lots and bool((difference <= 1e-9 * np.maximum(shapely.area(reference.values), 1)).all())
+
+    print("erase: tiled {:.2f} s, full overlay {:.2f} s, {} of {} lots kept, equivalent to full overlay: {}".format(
+        tiled_elapsed, full_elapsed, len(reference), rows, equivalent))
+
+
+def bench_validate(rows, workdir, max_workers=None):
+    # Geometry validation and repair of synthetic lots in a local GeoPackage, where every 100th lot is a self
+    # intersecting bow tie and every 1000th has no geometry. Checks that only those lots are reported and that every
+    # geometry left is valid, then times applying the cached repairs to a fresh copy.
+
+    import shapely
+    lots = synthetic_lots(rows)
+    bow_ties = np.arange(0, rows, 100)
+    template = lots[geometry.GEOMETRY_FIELD].iloc[0]
+    lots.loc[bow_ties, geometry.GEOMETRY_FIELD] = geometry.to_values(
+        shapely.polygons([[(x, 0), (x + 90, 90), (x + 90, 0), (x, 90), (x, 0)] for x in bow_ties * 1.0]), template)
+    lots.loc[np.arange(0, rows, 1000) + 1, geometry.GEOMETRY_FIELD] = None
+    compiled = schema.compile_schema({'bbl': ['BBL', 'DOUBLE', '', '', '', 'BBL', 'NULLABLE']})
+
+    gpkg_path = os.path.join(workdir, 'synthetic_validate.gpkg')
+    if os.path.isfile(gpkg_path):
+        os.remove(gpkg_path)
+    writer = backends.GeoPackageWriter(gpkg_path)
+    writer.create_table('Join_File', compiled, -1)
+    writer.write('Join_File', [lots])
+
+    start = timeit.default_timer()
+    features = writer.read_features('Join_File', ['OBJECTID', 'BBL'])
+    report, repaired = validate.validate_features(features, 'BBL', 'OBJECTID', max_workers=max_workers)
+    writer.update_geometries('Join_File', dict(zip(report['OID'].tolist(), repaired)))
+    elapsed = timeit.default_timer() - start
+
+    cache_path = os.path.join(workdir, 'geometry_cache', 'validation_synthetic.json')
+    validate.save_repairs(cache_path, report, repaired)
+    writer.create_table('Join_File_Copy', compiled, -1)
+    writer.write('Join_File_Copy', [lots])
+    start = timeit.default_timer()
+    cached_report, cached_repaired = validate.load_repairs(cache_path)
+    writer.update_geometries('Join_File_Copy', dict(zip(cached_report['OID'].tolist(), cached_repaired)))
+    cached_elapsed = timeit.default_timer() - start
+
+    left = writer.read_features('Join_File', ['BBL'])
+    writer.close()
+    expected = set(1000000000.0 + bow_ties) | set(1000000001.0 + np.arange(0, rows, 1000))
+    all_valid = bool(shapely.is_valid(geometry.from_values(left[geometry.GEOMETRY_FIELD])).all())
+    print("validate: {} lots checked and repaired in {:.2f} s, cached repairs applied in {:.2f} s, {} reported, "
+          "expected lots reported: {}, all geometries valid: {}".format(
+              rows, elapsed, cached_elapsed, len(report), set(report['BBL']) == expected, all_valid))
+
+
+def write_synthetic_gdb(path, rows, files=20):
+    # Directory standing in for a file geodatabase - a few large table files and many small index and system files,
+    # about 200 bytes a row in total
+
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.default_rng(0)
+    sizes = [rows * 200 // (files // 4)] * (files // 4) + [4096] * (files - files // 4)
+    for number, size in enumerate(sizes):
+        with open(os.path.join(path, 'a{:08x}.gdbtable'.format(number + 1)), "wb") as f:
+            f.write(rng.bytes(size))
+    return path
+
+
+def bench_publish(rows, workdir, max_workers=None):
+    # Publish a synthetic gdb to a file:// destination standing in for the X: drive - a full copy against
+    # shutil.copytree, then an unchanged republish and a republish with one file changed and one removed
+
+    source = write_synthetic_gdb(os.path.join(workdir, 'synthetic_publish.gdb'), rows)
+    target = os.path.join(workdir, 'published', 'synthetic_publish.gdb')
+    for path in (target, os.path.join(workdir, 'copytree.gdb')):
+        shutil.rmtree(path, ignore_errors=True)
+    if os.path.isfile(target + publish.MANIFEST_SUFFIX):
+        os.remove(target + publish.MANIFEST_SUFFIX)
+    destination = pathlib.Path(os.path.abspath(target)).as_uri()
+    workers = max_workers or publish.PUBLISH_WORKERS
+
+    start = timeit.default_timer()
+    shutil.copytree(source, os.path.join(workdir, 'copytree.gdb'))
+    copytree_elapsed = timeit.default_timer() - start
+
+    timings = []
+    for change in (None, None, 'delta'):
+        if change:
+            with open(os.path.join(source, 'a00000001.gdbtable'), "ab") as f:
+                f.write(b'changed')
+            os.remove(os.path.join(source, 'a{:08x}.gdbtable'.format(20)))
+        start = timeit.default_timer()
+        summary = publish.publish_tree(source, destination, workers)
+        timings.append((timeit.default_timer() - start, summary))
+
+    identical = all(publish.stream_hash(os.path.join(source, name)) == publish.stream_hash(os.path.join(target, name))
+                    for name in publish.tree_files(source)) and \
+        publish.tree_files(source) == publish.tree_files(target)
+    print("publish: copytree {:.2f} s, full {:.2f} s, unchanged {:.2f} s ({skipped} skipped), "
+          "delta {:.2f} s ({copied} copied, {removed} removed), destination identical: {}".format(
+              copytree_elapsed, timings[0][0], timings[1][0], timings[2][0], identical,
+              skipped=timings[1][1]['skipped'], copied=timings[2][1]['copied'], removed=timings[2][1]['removed']))
+
+
+def remove_workspace(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.isfile(path):
+        os.remove(path)
+
+
+def bench_backend(rows, workdir, backend='geopackage'):
+    # The workspace operations the stages use, run against one geoprocessing backend on synthetic lots - a borough
+    # shard's Join file copy, feature reads, geometry updates, unique and spatial indexes, the typed table load,
+    # join and erase writes, listing, renames, deletes and a workspace copy. Run with --backend arcpy on an ArcGIS
+    # machine; both backends must pass every check, and the case exits with status 1 when any check fails.
+
+    bbls = synthetic_bbls(rows)
+    shapefile = write_synthetic_shapefile(os.path.join(workdir, 'synthetic_lots.shp'), bbls)
+    workspace = backends.workspace_path(backend, os.path.join(workdir, 'backend_check.gdb'))
+    copy_path = backends.workspace_path(backend, os.path.join(workdir, 'backend_check_copy.gdb'))
+    for path in (workspace, copy_path):
+        remove_workspace(path)
+
+    start = timeit.default_timer()
+    checks = {}
+    writer = backends.open_workspace(backend, workspace, geometry_token='SHAPE@WKB')
+    writer.create_workspace()
+    checks['create_workspace'] = backends.dataset_exists(backend, workspace)
+
+    codes = sorted(shard.BOROUGHS)
+    text = writer.field_is_text(shapefile, 'BBL')
+    checks['field_is_text'] = not text
+    writer.copy_features(shapefile, 'Join_File', shard.borough_where('"BBL"', 3, codes, text))
+    join_path = os.path.join(workspace, 'Join_File')
+    features = writer.read_features(join_path, [writer.oid_field, 'BBL'])
+    checks['copy_features'] = backends.dataset_exists(backend, join_path) and \
+        len(features) == int((shard.borough_codes(bbls, codes) == 3).sum()) and \
+        bool((shard.borough_codes(features['BBL'], codes) == 3).all())
+    areas = geometry.from_values(features[geometry.GEOMETRY_FIELD])
+    checks['read_features'] = bool(np.allclose([area.area for area in areas], (LOT_SIZE * 0.9) ** 2))
+
+    bbl_compiled = {'columns': [('BBL', 'DOUBLE')], 'add_fields': [['BBL', 'DOUBLE', '', '', '', '']],
+                    'add_field': []}
+    writer.create_feature_class('Lots', bbl_compiled, join_path)
+    lots = features[['BBL', geometry.GEOMETRY_FIELD]]
+    checks['write'] = writer.write('Lots', [lots, lots]) == 2 * len(lots)
+    writer.add_index('Join_File', 'BBL', 'BBL_Join')
+    try:
+        writer.add_index('Lots', 'BBL', 'BBL_Lots')
+        checks['add_index'] = False
+    except Exception:
+        checks['add_index'] = True
+
+    grid_size = writer.add_spatial_index('Join_File')
+    checks['add_spatial_index'] = grid_size is None if backend == 'geopackage' else grid_size > 0
+
+    deleted = features[writer.oid_field].iloc[:1].tolist()
+    writer.update_geometries('Join_File', {oid: None for oid in deleted})
+    checks['update_geometries'] = sum(len(chunk) for chunk in writer.read_chunks('Join_File', ['BBL'])) == \
+        len(features) - len(deleted)
+
+    # The typed load, join and erase writes of the stages, through the backend
+
+    compiled = schema.compile_schema(synthetic_schema())
+    frame = synthetic_frame(rows)
+    typed = ingest.cast_frame(frame[[field for field in frame.columns if field in compiled['fields']]], compiled)[0]
+    writer.create_table('MapPLUTO_final', compiled)
+    loaded = writer.write('MapPLUTO_final', [typed])
+    read_back = pd.concat(writer.read_chunks('MapPLUTO_final', ['BBL', 'Block']))
+    checks['typed_write'] = loaded == rows and len(read_back) == rows and \
+        bool((read_back['BBL'].values == typed['BBL'].values).all()) and \
+        bool((read_back['Block'].values == typed['Block'].values).all())
+
+    water_path = os.path.join(workspace, 'Water_Included')
+    writer.create_feature_class('Water_Included', compiled, join_path)
+    join_features = writer.read_features(join_path, ['BBL'])
+    joined = join.join_table(join_features, [typed], writer, 'Water_Included')[0]
+    checks['join_write'] = joined == len(join_features) and \
+        sum(len(chunk) for chunk in writer.read_chunks('Water_Included', ['BBL'])) == joined
+
+    import shapely
+    shoreline = synthetic_shoreline(rows)
+    writer.create_feature_class('Shoreline_Clipped', compiled, water_path)
+    fields = [name for name, field_type in compiled['columns']] + [geometry.GEOMETRY_FIELD]
+    erased, summary = erase.erase_table(writer.read_chunks('Water_Included', fields), shoreline, writer,
+                                        'Shoreline_Clipped', max_workers=1)
+    clipped = geometry.from_values(writer.read_features(os.path.join(workspace, 'Shoreline_Clipped'),
+                                                        ['BBL'])[geometry.GEOMETRY_FIELD])
+    water = shapely.union_all(geometry.from_values(shoreline[geometry.GEOMETRY_FIELD]))
+    checks['erase_write'] = summary['clipped'] > 0 and erased == joined - summary['erased'] and \
+        len(clipped) == erased and float(shapely.area(shapely.intersection(clipped, water)).max()) < 1e-6
+
+    writer.create_table('UNMAPPABLES', compiled)
+    checks['list'] = sorted(writer.list_feature_classes()) == ['Join_File', 'Lots', 'Shoreline_Clipped',
+                                                               'Water_Included'] and \
+        sorted(writer.list_tables()) == ['MapPLUTO_final', 'UNMAPPABLES']
+    writer.rename('UNMAPPABLES', 'NOT_MAPPED_LOTS')
+    for name in ('Lots', 'Shoreline_Clipped', 'Water_Included', 'MapPLUTO_final'):
+        writer.delete(name)
+    checks['rename_delete'] = writer.list_feature_classes() == ['Join_File'] and \
+        writer.list_tables() == ['NOT_MAPPED_LOTS']
+
+    writer.copy_workspace(copy_path)
+    writer.release()
+    copy = backends.open_workspace(backend, copy_path)
+    checks['copy_workspace'] = copy.list_feature_classes() == ['Join_File'] and \
+        sum(len(chunk) for chunk in copy.read_chunks('Join_File', ['BBL'])) == len(features) - len(deleted)
+    copy.release()
+    elapsed = timeit.default_timer() - start
+
+    failed = [name for name, passed in checks.items() if not passed]
+    print("backend {}: {} lots copied in {:.2f} s, {} of {} checks passed{}".format(
+        backend, len(features), elapsed, len(checks) - len(failed), len(checks),
+        ", failed: {}".format(', '.join(failed)) if failed else ''))
+    return checks
+
+
+def index_queries(rows, seed=0):
+    # Random lookups on the synthetic lots - BBLs, borough and block pairs, zoning districts and bboxes BBOX_LOTS
+    # lots across
+
+    rng = np.random.default_rng(seed)
+    lots = synthetic_frame(rows)
+    picks = rng.integers(0, rows, INDEXED_QUERIES)
+    x = (picks % LOT_GRID_WIDTH) * LOT_SIZE
+    y = (picks // LOT_GRID_WIDTH) * LOT_SIZE
+    zones = lots['zonedist1'].dropna().unique()
+    return {'BBL': [(float(bbl),) for bbl in lots['bbl'].values[picks]],
+            'Borough_Block': list(zip(lots['borough'].values[picks], lots['block'].values[picks].tolist())),
+            'ZoneDist1': [(zones[pick % len(zones)],) for pick in picks],
+            'bbox': [(x0, x0 + BBOX_LOTS * LOT_SIZE, y0, y0 + BBOX_LOTS * LOT_SIZE) for x0, y0 in zip(x, y)]}
+
+
+def time_queries(connection, query, parameters):
+    start = timeit.default_timer()
+    results = [sorted(row[0] for row in connection.execute(query, values)) for values in parameters]
+    return (timeit.default_timer() - start) / len(parameters) * 1000, results
+
+
+def bench_index(rows, workdir):
+    # Query micro-benchmark for the output indexes on a GeoPackage of synthetic lots - BBL lookups, borough and
+    # block lookups, zoning district selections and bbox queries, timed before and after each index is built.
+    # Indexed queries must return the same lots as the table scans.
+
+    path = os.path.join(workdir, 'index_check.gpkg')
+    remove_workspace(path)
+    lots = synthetic_frame(rows)
+    features = pd.DataFrame({'BBL': lots['bbl'].values, 'Borough': lots['borough'].values,
+                             'Block': lots['block'].values, 'ZoneDist1': lots['zonedist1'].values,
+                             geometry.GEOMETRY_FIELD: synthetic_lots(rows)[geometry.GEOMETRY_FIELD].values})
+    writer = backends.GeoPackageWriter(path)
+    writer.create_table('Lots', {'columns': [('BBL', 'DOUBLE'), ('Borough', 'TEXT'), ('Block', 'LONG'),
+                                             ('ZoneDist1', 'TEXT')]}, -1)
+    writer.write('Lots', [features])
+    connection = writer.connection
+
+    queries = index_queries(rows)
+    rtree = writer.rtree_table('Lots')
+    statements = {'BBL': ('SELECT OBJECTID FROM Lots WHERE BBL = ?',) * 2,
+                  'Borough_Block': ('SELECT OBJECTID FROM Lots WHERE Borough = ? AND Block = ?',) * 2,
+                  'ZoneDist1': ('SELECT OBJECTID FROM Lots WHERE ZoneDist1 = ?',) * 2,
+                  'bbox': ('SELECT OBJECTID FROM Lots WHERE ST_MaxX(SHAPE) >= ? AND ST_MinX(SHAPE) <= ? '
+                           'AND ST_MaxY(SHAPE) >= ? AND ST_MinY(SHAPE) <= ?',
+                           'SELECT OBJECTID FROM Lots JOIN "{}" ON OBJECTID = id '
+                           'WHERE maxx >= ? AND minx <= ? AND maxy >= ? AND miny <= ?'.format(rtree))}
+
+    # ZoneDist1 selections return a large share of the lots, so fewer are timed on both passes
+
+    counts = {'BBL': INDEXED_QUERIES, 'Borough_Block': INDEXED_QUERIES, 'ZoneDist1': UNINDEXED_QUERIES,
+              'bbox': INDEXED_QUERIES}
+    import shapely
+    print("index: {} synthetic lots, ArcPy spatial grid size {}".format(
+        rows, indexing.grid_size(shapely.bounds(geometry.from_values(features[geometry.GEOMETRY_FIELD])))))
+
+    results = {}
+    for name, (scan, indexed) in statements.items():
+        before, scanned = time_queries(connection, scan, queries[name][:UNINDEXED_QUERIES])
+        start = timeit.default_timer()
+        if name == 'bbox':
+            writer.add_spatial_index('Lots')
+        else:
+            writer.add_index('Lots', name.split('_'), indexing.index_name(name.split('_'), 'Lots'),
+                             unique=indexing.is_unique(name.split('_')))
+        build = timeit.default_timer() - start
+        after, found = time_queries(connection, indexed, queries[name][:counts[name]])
+        identical = found[:UNINDEXED_QUERIES] == scanned
+        results[name] = {'build_seconds': round(build, 3), 'scan_ms': round(before, 3),
+                         'indexed_ms': round(after, 3), 'speedup': round(before / after, 1) if after else None,
+                         'identical': identical}
+        print("{}: index built in {:.2f} s, {:.3f} ms per query scanning, {:.3f} ms indexed ({}x), "
+              "results identical: {}".format(name, build, before, after, results[name]['speedup'], identical))
+    writer.close()
+    return results
+
+
+def write_pipeline_inputs(rows, workdir):
+    # Synthetic release inputs laid out as the conversion script finds them - MapPLUTO csv and schema json, the
+    # dcp_mappluto tax lot shapefile in the data path and a DOF export holding the shoreline layer
+
+    data_path = os.path.join(workdir, 'data')
+    dof_path = os.path.join(workdir, 'dof', 'dof_export_20260101.gpkg')
+    for path in (data_path, os.path.dirname(dof_path)):
+        os.makedirs(path, exist_ok=True)
+
+    print("Generating {} row synthetic MapPLUTO inputs".format(rows))
+    input_csv = write_synthetic_csv(os.path.join(workdir, 'synthetic_mappluto.csv'), rows)
+    schema_path = write_synthetic_schema(os.path.join(workdir, 'synthetic_schema.json'))
+    bbls = synthetic_bbls(rows)
+    join_shapefile = write_synthetic_shapefile(os.path.join(data_path, 'dcp_mappluto.shp'),
+                                               bbls[np.arange(rows) % MISSING_LOT_INTERVAL != 0])
+
+    remove_workspace(dof_path)
+    dof = backends.GeoPackageWriter(dof_path)
+    dof.create_table('Shoreline_Polygon', {'columns': []}, -1)
+    dof.write('Shoreline_Polygon', [synthetic_shoreline(rows)])
+    dof.close()
+
+    return {'input_csv': input_csv, 'schema_path': schema_path, 'data_path': data_path,
+            'join_shapefile': join_shapefile, 'shoreline_workspace': dof_path,
+            'shoreline_fc': os.path.join(dof_path, 'Shoreline_Polygon')}
+
+
+def pipeline_run(inputs, workdir, max_workers=None, shard_codes=()):
+    # Run dictionary for the corrections export with the keys export_run in MapPLUTOCSV2FC_Conversion.py builds, on
+    # the GeoPackage backend with a local directory standing in for the X: drive
+
+    work_path = os.path.join(inputs['data_path'], 'corrections')
+    gdb_path_water_area = os.path.join(workdir, 'fgdb', 'corrections', 'MapPLUTO_WaterArea.gpkg')
+    return {'version': 'bench',
+            'today': datetime.date.today().strftime('%m_%d_%Y'),
+            'outpath': 'corrections',
+            'outname': 'Corrected',
+            'input_csv': inputs['input_csv'],
+            'schema_path': inputs['schema_path'],
+            'schema_cache': os.path.join(inputs['data_path'], 'schema_cache'),
+            'data_path': inputs['data_path'],
+            'work_path': work_path,
+            'output_csv': os.path.join(work_path, 'synthetic_mappluto_output.csv'),
+            'gdb_path_water_area': gdb_path_water_area,
+            'gdb_path_shoreline_clip': os.path.join(workdir, 'fgdb', 'corrections', 'MapPLUTO_ShorelineClip.gpkg'),
+            'tax_lot_in': os.path.join(gdb_path_water_area, 'Join_File'),
+            'out_fc': "MapPLUTO_{}_Water_Included".format(datetime.date.today().strftime('%m_%d_%Y')),
+            'join_shapefile': inputs['join_shapefile'],
+            'shoreline_workspace': inputs['shoreline_workspace'],
+            'shoreline_fc': inputs['shoreline_fc'],
+            'x_path': os.path.join(workdir, 'x'),
+            'max_workers': max_workers,
+            'export_csv': False,
+            'backend': 'geopackage',
+            'shard': None,
+            'shard_codes': list(shard_codes)}
+
+
+def stage_metrics(records):
+    # Wall time, throughput and peak memory of each stage that ran, and of each step within it, keyed as
+    # stage or stage.step without the export name. Throughput is rows/s for table steps and features/s for
+    # geometry steps - whichever the step counts.
+
+    metrics = {}
+    for record in records:
+        if record.get('status') != 'ran':
+            continue
+        name = record['stage'].split(':', 1)[-1]
+        if record['step'] != 'stage':
+            name = '{}.{}'.format(name, record['step'])
+        seconds, rows = record['wall_seconds'], record.get('rows')
+        metrics[name] = {'seconds': seconds,
+                         'rows': rows,
+                         'per_second': round(rows / seconds, 1) if rows and seconds else None,
+                         'peak_rss_mb': record['peak_rss_mb']}
+    return metrics
+
+
+def git_commit():
+    # Commit the benchmark ran against, marked dirty when tracked files have uncommitted changes. None outside git.
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                        stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + '-dirty' if dirty else commit
+
+
+def load_history(history_path):
+    if not os.path.isfile(history_path):
+        return []
+    with open(history_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_regressions(result, baseline, tolerance=REGRESSION_TOLERANCE):
+    # Stages and steps slower or peaking higher than in the baseline run beyond the tolerance
+
+    regressions = []
+    for name, metric in sorted(result['stages'].items()):
+        previous = baseline['stages'].get(name)
+        if previous is None:
+            continue
+        for key, minimum in (('seconds', MIN_REGRESSION_SECONDS), ('peak_rss_mb', MIN_REGRESSION_MB)):
+            if metric[key] is None or previous[key] is None:
+                continue
+            if metric[key] > previous[key] * (1 + tolerance) and metric[key] - previous[key] > minimum:
+                regressions.append({'name': name, 'metric': key, 'baseline': previous[key], 'value': metric[key]})
+    return regressions
+
+
+def bench_pipeline(rows, workdir, max_workers=None, history_path=None, shard_boroughs=False):
+    # End-to-end build of the corrections export from synthetic inputs through the same stage DAG as a release run,
+    # on the GeoPackage backend. Times every stage and step with its throughput and peak memory, appends the result
+    # to the history file and flags regressions against the last run there at the same scale and settings.
+
+    inputs = write_pipeline_inputs(rows, workdir)
+    run = pipeline_run(inputs, workdir, max_workers, sorted(shard.BOROUGHS) if shard_boroughs else ())
+    records = []
+
+    start = timeit.default_timer()
+    pipeline.run_stages(stages.export_stages(run), max_workers, os.path.join(inputs['data_path'],
+                                                                             'build_manifest.json'),
+                        True, records)
+    elapsed = timeit.default_timer() - start
+    instrument.write_report(os.path.join(workdir, 'pipeline_run_report'), records,
+                            {'rows': rows, 'max_workers': max_workers, 'minutes': round(elapsed / 60, 2)})
+
+    published = backends.GeoPackageWriter(stages.published_gdb_path(run, stages.WATER_GDB))
+    published_rows = sum(len(chunk) for chunk in published.read_chunks(run['out_fc'] + '_Corrected', ['BBL']))
+    published.close()
+    expected = rows - len(range(0, rows, MISSING_LOT_INTERVAL))
+
+    result = {'commit': git_commit(),
+              'recorded': datetime.datetime.now().isoformat(timespec='seconds'),
+              'rows': rows,
+              'max_workers': max_workers,
+              'shard_boroughs': shard_boroughs,
+              'cpu_count': os.cpu_count(),
+              'seconds': round(elapsed, 2),
+              'rows_per_second': round(rows / elapsed, 1),
+              'peak_rss_mb': max(record.get('peak_rss_mb') or 0 for record in records),
+              'published_rows': published_rows,
+              'stages': stage_metrics(records)}
+
+    print("pipeline: {} rows in {:.2f} s ({:.0f} rows/s), peak RSS {} MB, {} lots published, expected {}: {}"
+          .format(rows, elapsed, result['rows_per_second'], result['peak_rss_mb'], published_rows, expected,
+                  published_rows == expected))
+    for name, metric in sorted(result['stages'].items(), key=lambda item: -item[1]['seconds'])[:15]:
+        print("  {}: {seconds} s{}, peak {peak_rss_mb} MB".format(
+            name, ", {:.0f}/s".format(metric['per_second']) if metric['per_second'] else '', **metric))
+
+    if history_path is None:
+        return result, []
+
+    settings = ('rows', 'max_workers', 'shard_boroughs', 'cpu_count')
+    comparable = [entry for entry in load_history(history_path)
+                  if all(entry.get(key) == result[key] for key in settings)]
+    regressions = find_regressions(result, comparable[-1]) if comparable else []
+    if comparable:
+        print("Compared with {} recorded {}: {} regressions".format(comparable[-1]['commit'],
+                                                                   comparable[-1]['recorded'], len(regressions)))
+    for regression in regressions:
+        print("  REGRESSION {name} {metric}: {baseline} -> {value}".format(**regression))
+
+    with open(history_path, "a") as f:
+        f.write(json.dumps(result) + '\n')
+    print("Result appended to {}".format(history_path))
+    return result, regressions
+
+
+def run_isolated(args):
+    # Run a single benchmark case in a fresh interpreter so peak RSS reflects that case alone
+
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '_case'] + args)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def run_case(name, input_csv, output_csv):
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    start = timeit.default_timer()
+    INGEST_PATHS[name](input_csv, output_csv, SYNTHETIC_DROP_FIELDS)
+    elapsed = timeit.default_timer() - start
+    sys.stdout = stdout
+    peak = peak_rss_mb()
+    print(json.dumps({'case': name, 'seconds': round(elapsed, 2),
+                      'peak_rss_mb': None if peak is None else round(peak, 1)}))
+
+
+def bench_ingest(rows, workdir):
+    input_csv = os.path.join(workdir, 'synthetic_mappluto.csv')
+    print("Generating {} row synthetic csv".format(rows))
+    write_synthetic_csv(input_csv, rows)
+    print("Input csv size: {:.1f} MB".format(os.path.getsize(input_csv) / 1024.0 / 1024.0))
+
+    results = []
+    for name in INGEST_PATHS:
+        output_csv = os.path.join(workdir, 'output_{}.csv'.format(name))
+        result = run_isolated([name, input_csv, output_csv])
+        print("{case}: {seconds} s, peak RSS {peak_rss_mb} MB".format(**result))
+        results.append(result)
+
+    # Both paths must emit identical output tables
+
+    legacy_out = os.path.join(workdir, 'output_legacy.csv')
+    streaming_out = os.path.join(workdir, 'output_streaming.csv')
+    with open(legacy_out, "rb") as legacy, open(streaming_out, "rb") as streaming:
+        print("Outputs identical: {}".format(legacy.read() == streaming.read()))
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '_case':
+        run_case(*sys.argv[2:5])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Benchmarks for the MapPLUTO conversion pipeline")
+    parser.add_argument('benchmark', choices=['ingest', 'load', 'columnar', 'join', 'validate', 'erase',
+                                                       'publish', 'backend', 'pipeline', 'index'])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--scale', choices=sorted(SCALES), default=None,
+                        help="Lot count preset overriding --rows")
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--backend', choices=sorted(backends.BACKENDS), default='geopackage')
+    parser.add_argument('--history', default='mappluto_benchmark_history.jsonl',
+                        help="Pipeline results are appended to this file and compared with the last comparable run")
+    parser.add_argument('--shard-boroughs', action='store_true')
+    args = parser.parse_args()
+    rows = SCALES[args.scale] if args.scale else args.rows
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='mappluto_bench_')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+
+    if args.benchmark == 'ingest':
+        bench_ingest(rows, workdir)
+    elif args.benchmark == 'load':
+        bench_load(rows, workdir)
+    elif args.benchmark == 'columnar':
+        bench_columnar(rows, workdir)
+    elif args.benchmark == 'join':
+        bench_join(rows, workdir)
+    elif args.benchmark == 'validate':
+        bench_validate(rows, workdir, args.workers)
+    elif args.benchmark == 'erase':
+        bench_erase(rows, workdir, args.workers)
+    elif args.benchmark == 'publish':
+        bench_publish(rows, workdir, args.workers)
+    elif args.benchmark == 'backend':
+        if not all(bench_backend(rows, workdir, args.backend).values()):
+            sys.exit(1)
+    elif args.benchmark == 'index':
+        bench_index(rows, workdir)
+    elif args.benchmark == 'pipeline':
+        if bench_pipeline(rows, workdir, args.workers, args.history, args.shard_boroughs)[1]:
+            sys.exit(1)
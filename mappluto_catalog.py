@@ -0,0 +1,131 @@
+import os
+import re
+import json
+import datetime
+
+# Catalog of DOF tax map exports - one file geodatabase per export, named with its export date - cached locally so
+# the network share is only crawled when the set of exports changes
+
+CATALOG_VERSION = 1
+
+EXPORT_DATE = re.compile(r'(?<!\d)(\d{8})(?!\d)')
+
+SHORELINE_DATASET = 'DCP'
+
+SHORELINE_LAYER = 'Shoreline_Polygon'
+
+
+def export_date(name):
+    # Export date of a DOF workspace as YYYYMMDD, taken from the last eight digit date in its name. None when the
+    # name carries no valid date.
+
+    for candidate in reversed(EXPORT_DATE.findall(os.path.splitext(name)[0])):
+        try:
+            datetime.datetime.strptime(candidate, '%Y%m%d')
+        except ValueError:
+            continue
+        return candidate
+    return None
+
+
+def list_exports(dof_path):
+    # File geodatabases directly under the DOF directory, in name order
+
+    return sorted(name for name in os.listdir(dof_path)
+                  if name.lower().endswith('.gdb') and os.path.isdir(os.path.join(dof_path, name)))
+
+
+def workspace_mtime(workspace):
+    try:
+        return os.stat(workspace).st_mtime
+    except OSError:
+        return None
+
+
+def is_current(entry):
+    # Whether a cached entry still holds - always for an export with a shoreline layer, and for one without while
+    # the export is unchanged since it was probed, as one still being written gains the layer later
+
+    return entry['shoreline_fc'] is not None or \
+        (entry.get('mtime') is not None and entry['mtime'] == workspace_mtime(entry['workspace']))
+
+
+def build_catalog(dof_path, listing, find_shoreline, previous=None):
+    # Catalog entries keyed by export date. Shoreline layers are resolved with find_shoreline(dataset_path) only for
+    # exports without a current entry in the previous catalog.
+
+    known = {entry['name']: entry for entry in (previous or {}).values() if is_current(entry)}
+    exports = {}
+
+    for name in listing:
+        date = export_date(name)
+        if date is None:
+            print("Skipping DOF workspace {} with no export date in its name".format(name))
+            continue
+        if name in known:
+            entry = known[name]
+        else:
+            workspace = os.path.join(dof_path, name)
+            entry = {'name': name,
+                     'date': date,
+                     'workspace': workspace,
+                     'mtime': workspace_mtime(workspace),
+                     'shoreline_fc': find_shoreline(os.path.join(workspace, SHORELINE_DATASET))}
+        if date in exports:
+            print("DOF workspaces {} and {} share export date {}, using {}".format(exports[date]['name'], name,
+                                                                                  date, name))
+        exports[date] = entry
+
+    return exports
+
+
+def load_catalog(dof_path, cache_path, find_shoreline):
+    # Catalog of DOF exports, read from the cache while the DOF directory is unchanged. The directory's mtime is
+    # checked first; when it moved, the listing is compared and only a changed listing rebuilds the catalog.
+    # find_shoreline(dataset_path) returns the path of the shoreline layer in an export's DCP dataset, or None.
+
+    cached = None
+    if os.path.isfile(cache_path):
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached.get('version') != CATALOG_VERSION or cached.get('dof_path') != dof_path:
+            cached = None
+
+    # Exports cataloged without a shoreline layer are only looked at again once they change, perhaps because they
+    # were still being written - a stat of each rather than a crawl of the share
+
+    current = cached is not None and all(is_current(entry) for entry in cached['exports'].values())
+    mtime = os.stat(dof_path).st_mtime
+    if current and cached['mtime'] == mtime:
+        return cached['exports']
+
+    listing = list_exports(dof_path)
+    if current and cached['listing'] == listing:
+        exports = cached['exports']
+    else:
+        print("Cataloging DOF tax map exports in {}".format(dof_path))
+        exports = build_catalog(dof_path, listing, find_shoreline, cached['exports'] if cached else None)
+
+    # Write to a temporary file first so an interrupted run never leaves a partial catalog
+
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, "w") as f:
+        json.dump({'version': CATALOG_VERSION, 'dof_path': dof_path, 'mtime': mtime, 'listing': listing,
+                   'exports': exports}, f, indent=4)
+    os.replace(temp_path, cache_path)
+
+    return exports
+
+
+def select_export(exports, pinned='newest'):
+    # Catalog entry for the newest export or a pinned YYYYMMDD date. Raises ValueError when there is no such export
+    # or it has no shoreline layer.
+
+    if not exports:
+        raise ValueError("No DOF tax map exports found")
+    date = max(exports) if pinned in (None, '', 'newest') else pinned
+    if date not in exports:
+        raise ValueError("No DOF tax map export dated {}. Available: {}".format(date, ', '.join(sorted(exports))))
+    if exports[date]['shoreline_fc'] is None:
+        raise ValueError("DOF tax map export {} has no {} layer".format(exports[date]['name'], SHORELINE_LAYER))
+    return exports[date]
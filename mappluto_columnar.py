@@ -0,0 +1,103 @@
+import os
+import pandas as pd
+import pyarrow as pa
+
+# Typed columnar intermediate exchanged between stages - an Arrow IPC file of record batches carrying the compiled
+# schema's output field names and types. Stages memory-map the file and read only the columns they need instead of
+# re-parsing the text csv. Low-cardinality text columns such as borough, zoning districts and land use are
+# dictionary encoded, so the file is smaller than the csv it replaces, and are decoded back to text on read.
+
+ARROW_TYPES = {'SHORT': pa.int16(), 'LONG': pa.int32(), 'FLOAT': pa.float32(), 'DOUBLE': pa.float64(),
+               'DATE': pa.timestamp('ms')}
+
+# pandas nullable dtypes for Arrow integer columns, matching the typed frames produced by the type cast
+
+PANDAS_TYPES = {pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype()}
+
+# Text columns with at most this share of distinct values in the first chunk are dictionary encoded
+
+DICTIONARY_RATIO = 0.1
+
+DICTIONARY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+
+def arrow_schema(compiled):
+    # Arrow schema for the typed table of a compiled schema, recording the schema hash it was built from
+
+    return pa.schema([pa.field(name, ARROW_TYPES.get(field_type, pa.string()))
+                      for name, field_type in compiled['columns']],
+                     metadata={'schema_hash': str(compiled['schema_hash'])})
+
+
+def dictionary_schema(schema, chunk):
+    # Arrow schema with the text columns of schema that repeat enough in a chunk dictionary encoded
+
+    fields = []
+    for field in schema:
+        if pa.types.is_string(field.type) and chunk[field.name].nunique() <= DICTIONARY_RATIO * len(chunk):
+            field = field.with_type(DICTIONARY_TYPE)
+        fields.append(field)
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+def dictionary_array(values, vocabulary):
+    # Dictionary array of text values over a vocabulary shared by every batch of a column, extending it with the
+    # values it has not seen. The writer emits only the new entries for each batch as a dictionary delta.
+
+    for value in values.dropna().unique():
+        if value not in vocabulary:
+            vocabulary[value] = len(vocabulary)
+    codes = pd.Index(list(vocabulary), dtype=object).get_indexer(values.astype(object))
+    return pa.DictionaryArray.from_arrays(pa.array(codes, type=pa.int32(), mask=codes < 0),
+                                          pa.array(list(vocabulary), type=pa.string()))
+
+
+def record_batch(chunk, schema, vocabularies):
+    plain = [field for field in schema if not pa.types.is_dictionary(field.type)]
+    table = pa.Table.from_pandas(chunk[[field.name for field in plain]], schema=pa.schema(plain),
+                                 preserve_index=False)
+    arrays = [dictionary_array(chunk[field.name], vocabularies.setdefault(field.name, {}))
+              if pa.types.is_dictionary(field.type) else table.column(field.name).combine_chunks()
+              for field in schema]
+    return pa.record_batch(arrays, schema=schema)
+
+
+def export_batches(chunks, path, compiled):
+    # Write each typed chunk to an Arrow IPC file as a record batch as it passes through, yielding it on to the next
+    # consumer. Columns the chunk does not carry are written as nulls. Which text columns are dictionary encoded is
+    # decided on the first chunk. The file only replaces path once every chunk has been written.
+
+    schema = arrow_schema(compiled)
+    temp_path = path + '.tmp'
+    vocabularies = {}
+    writer = None
+
+    with pa.OSFile(temp_path, "wb") as sink:
+        for chunk in chunks:
+            frame = chunk.reindex(columns=schema.names)
+            if writer is None:
+                schema = dictionary_schema(schema, frame)
+                writer = pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+            writer.write_batch(record_batch(frame, schema, vocabularies))
+            yield chunk
+        if writer is None:
+            writer = pa.ipc.new_file(sink, schema)
+        writer.close()
+
+    os.replace(temp_path, path)
+
+
+def decode_batch(batch):
+    # Record batch with its dictionary encoded columns decoded back to plain text
+
+    return pa.RecordBatch.from_arrays([column.dictionary_decode() if pa.types.is_dictionary(column.type) else column
+                                       for column in batch.columns], names=batch.schema.names)
+
+
+def read_chunks(path, fields):
+    # Memory-map an Arrow IPC file and yield one frame per record batch holding only the requested fields
+
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for index in range(reader.num_record_batches):
+            yield decode_batch(reader.get_batch(index).select(fields)).to_pandas(types_mapper=PANDAS_TYPES.get)
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+from mappluto_join import bbl_key, NO_KEY
+
+# Field flagging the lots Data Engineering edited in the corrections table
+
+CORRECTION_FLAG_FIELD = 'DCPEdit'
+
+DIFF_COLUMNS = ['BBL', 'change', 'flagged']
+
+
+def row_hashes(chunks, fields, key_field='BBL', flag_field=None):
+    # Hash of the given fields of every row with a valid BBL, indexed by its int64 BBL key, and the keys of the rows
+    # with flag_field set. Rows repeating a BBL keep their first occurrence, as in the join.
+
+    keys = []
+    hashes = []
+    flagged = []
+    for chunk in chunks:
+        chunk_keys = bbl_key(chunk[key_field])
+        keys.append(chunk_keys)
+        hashes.append(pd.util.hash_pandas_object(chunk[fields], index=False).values)
+        if flag_field is not None:
+            flag = chunk[flag_field].astype('string').str.strip()
+            flagged.append(chunk_keys[(flag.notna() & (flag != '')).values])
+
+    index = np.concatenate(keys) if keys else np.empty(0, dtype='int64')
+    series = pd.Series(np.concatenate(hashes) if hashes else np.empty(0, dtype='uint64'), index=index)
+    series = series[(series.index != NO_KEY) & ~series.index.duplicated()]
+    return series, np.unique(np.concatenate(flagged)) if flagged else np.empty(0, dtype='int64')
+
+
+def diff_tables(original_chunks, corrected_chunks, fields, key_field='BBL', flag_field=None):
+    # Compare two typed tables on BBL over the given fields in one pass over each. Returns a frame of the BBLs added
+    # to, removed from or changed in the corrected table, with whether the corrected row carries the correction
+    # flag, and a summary of the counts.
+
+    original = row_hashes(original_chunks, fields, key_field)[0]
+    corrected, flagged = row_hashes(corrected_chunks, fields, key_field, flag_field)
+
+    added = corrected.index.difference(original.index)
+    removed = original.index.difference(corrected.index)
+    shared = corrected.index.intersection(original.index)
+    changed = shared[corrected[shared].values != original[shared].values]
+
+    diff = pd.DataFrame({'BBL': np.concatenate([added.values, removed.values, changed.values]).astype('int64'),
+                         'change': ['added'] * len(added) + ['removed'] * len(removed) + ['changed'] * len(changed)},
+                        columns=DIFF_COLUMNS[:2])
+    diff['flagged'] = np.isin(diff['BBL'].values, flagged)
+
+    summary = {'original_rows': len(original), 'corrected_rows': len(corrected), 'added': len(added),
+               'removed': len(removed), 'changed': len(changed), 'flagged': len(flagged)}
+    print("Corrections differ from originals in {changed} changed, {added} added and {removed} removed BBLs; "
+          "{flagged} lots flagged as edited.".format(**summary))
+    return diff, summary
@@ -0,0 +1,93 @@
+import concurrent.futures as futures
+import numpy as np
+import pandas as pd
+import mappluto_geometry as geometry
+from mappluto_geometry import GEOMETRY_FIELD
+
+# Grid tile size in coordinate units (state plane feet) used to split shoreline lots across worker processes
+
+TILE_SIZE = 10000.0
+
+
+def erase_tile(lot_wkbs, shoreline_wkb):
+    # Erase the shoreline from one tile of lots. Runs in a worker process, so geometries travel as WKB. Returns
+    # WKB per lot, None where no area is left.
+
+    import shapely
+    lots = shapely.from_wkb(lot_wkbs)
+    shoreline = shapely.from_wkb(shoreline_wkb)
+    shapely.prepare(shoreline)
+    erased = [geometry.as_multipolygon(geom) for geom in shapely.difference(lots, shoreline)]
+    return [None if geom is None else shapely.to_wkb(geom, byte_order=1) for geom in erased]
+
+
+def tile_positions(lots, tile_size):
+    # Positions of the lots in each grid tile, keyed by the tile of each lot's lower left corner
+
+    import shapely
+    corners = np.floor(shapely.bounds(lots)[:, :2] / tile_size).astype('int64')
+    tiles = np.unique(corners, axis=0, return_inverse=True)[1].reshape(-1)
+    return pd.Series(tiles).groupby(tiles).indices.values()
+
+
+def map_tiles(tasks, max_workers):
+    if max_workers == 1:
+        return [erase_tile(*task) for task in tasks]
+    with futures.ProcessPoolExecutor(max_workers) as pool:
+        return list(pool.map(erase_tile, *zip(*tasks)))
+
+
+def erase_table(chunks, shoreline, writer, table, tile_size=TILE_SIZE, max_workers=None):
+    # Erase shoreline polygons from streamed lot chunks and bulk insert the result into the target feature class,
+    # matching Erase_analysis. An STRtree over the shoreline parts finds the lots that intersect the shoreline; all
+    # other lots pass straight through with their geometry untouched. Intersecting lots are grouped into grid tiles
+    # and clipped across a process pool against the union of the shoreline parts they touch. Lots left without area
+    # are dropped. Lots and shoreline must share a coordinate system - stages read the shoreline with the lots'
+    # feature class as template (see mappluto_backends). Returns the inserted row count and a summary.
+
+    import shapely
+    parts = shapely.get_parts(geometry.from_values(shoreline[GEOMETRY_FIELD]))
+    tree = shapely.STRtree(parts)
+    held = []
+    summary = {'passed': 0, 'clipped': 0, 'erased': 0, 'tiles': 0}
+
+    def erased_chunks():
+        for chunk in chunks:
+            lots = geometry.from_values(chunk[GEOMETRY_FIELD])
+            hits = np.zeros(len(chunk), dtype=bool)
+            hits[tree.query(lots, predicate='intersects')[0]] = True
+            summary['passed'] += int((~hits).sum())
+            held.append(chunk[hits])
+            yield chunk[~hits]
+
+        clip = pd.concat(held) if held else pd.DataFrame()
+        if not len(clip):
+            return
+
+        lots = geometry.from_values(clip[GEOMETRY_FIELD])
+        tasks = []
+        order = []
+        for positions in tile_positions(lots, tile_size):
+            tile_parts = np.unique(tree.query(lots[positions], predicate='intersects')[1])
+            tasks.append((shapely.to_wkb(lots[positions]).tolist(),
+                          shapely.to_wkb(shapely.union_all(parts[tile_parts]))))
+            order.append(positions)
+        summary['tiles'] = len(tasks)
+
+        erased = np.empty(len(clip), dtype=object)
+        for positions, wkbs in zip(order, map_tiles(tasks, max_workers)):
+            erased[positions] = shapely.from_wkb(wkbs)
+
+        kept = pd.notna(erased)
+        summary['clipped'] += int(kept.sum())
+        summary['erased'] += int((~kept).sum())
+        if kept.any():
+            clipped = clip[kept].copy()
+            clipped[GEOMETRY_FIELD] = geometry.to_values(erased[kept], clip[GEOMETRY_FIELD].iloc[0])
+            yield clipped
+
+    row_count = writer.write(table, erased_chunks())
+
+    print("Erase of {} complete: {passed} lots passed through, {clipped} clipped across {tiles} tiles, "
+          "{erased} fully erased.".format(table, **summary))
+    return row_count, summary
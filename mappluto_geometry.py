@@ -0,0 +1,311 @@
+import os
+import struct
+import pandas as pd
+
+# Geometry encoding helpers for the local backend. Geometries travel through the pipeline as GeoPackage geometry
+# blobs (GP header + little-endian WKB) so they can be written to a GeoPackage without any conversion.
+
+GEOMETRY_FIELD = 'SHAPE'
+
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+
+# Shapefile shape types carrying polygon rings - plain, Z and M variants share the same 2D layout
+
+SHP_NULL = 0
+SHP_POLYGON_TYPES = (5, 15, 25)
+
+SHP_HEADER_SIZE = 100
+DBF_TERMINATOR = b'\x0d'
+DBF_DELETED = b'*'
+
+
+def ring_area(ring):
+    # Signed shoelace area of a ring - positive for counter-clockwise, negative for clockwise
+
+    area = 0.0
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        area += x1 * y2 - x2 * y1
+    return area / 2.0
+
+
+def ring_contains(ring, point):
+    # Even-odd ray cast test of a point against a closed ring
+
+    x, y = point
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+    return inside
+
+
+def group_rings(rings):
+    # Group shapefile rings into polygons. Shapefile outer rings are clockwise and holes counter-clockwise, but
+    # ring order is not guaranteed, so each hole is assigned to the outer ring that contains it.
+
+    if len(rings) == 1:
+        return [rings]
+
+    polygons = []
+    holes = []
+    for ring in rings:
+        if ring_area(ring) <= 0:
+            polygons.append([ring])
+        else:
+            holes.append(ring)
+
+    if not polygons:
+        return [[ring] for ring in holes]
+
+    for hole in holes:
+        owner = polygons[-1]
+        for polygon in polygons:
+            if ring_contains(polygon[0], hole[0]):
+                owner = polygon
+                break
+        owner.append(hole)
+
+    return polygons
+
+
+def polygon_wkb(rings):
+    parts = [struct.pack('<BII', 1, WKB_POLYGON, len(rings))]
+    for ring in rings:
+        parts.append(struct.pack('<I', len(ring)))
+        parts.append(struct.pack('<{}d'.format(2 * len(ring)), *[value for point in ring for value in point]))
+    return b''.join(parts)
+
+
+def multipolygon_wkb(polygons):
+    # Little-endian WKB MultiPolygon from a list of polygons, each a list of rings of (x, y) tuples
+
+    return struct.pack('<BII', 1, WKB_MULTIPOLYGON, len(polygons)) + b''.join(polygon_wkb(p) for p in polygons)
+
+
+def gpkg_blob(wkb, envelope, srs_id):
+    # Wrap WKB in a GeoPackage geometry header - little-endian flag with an xy envelope (minx, maxx, miny, maxy)
+
+    return b'GP' + struct.pack('<BBi4d', 0, 0x03, srs_id, *envelope) + wkb
+
+
+def gpkg_envelope(blob):
+    # Read the xy envelope back out of a GeoPackage geometry blob, or None when the blob carries no envelope
+
+    flags = blob[3]
+    if (flags >> 1) & 0x07 == 0:
+        return None
+    return struct.unpack('<4d' if flags & 1 else '>4d', blob[8:40])
+
+
+def gpkg_bounds(blob):
+    # xy envelope (minx, maxx, miny, maxy) of a GeoPackage geometry blob, computed from its geometry when the blob
+    # carries no envelope
+
+    envelope = gpkg_envelope(blob)
+    if envelope is None:
+        import shapely
+        minx, miny, maxx, maxy = shapely.bounds(shapely.from_wkb(bytes(blob[gpkg_header_length(blob):])))
+        envelope = (minx, maxx, miny, maxy)
+    return envelope
+
+
+def gpkg_is_empty(blob):
+    return bool(blob[3] & 0x10)
+
+
+def gpkg_header_length(blob):
+    # Length of a GeoPackage geometry header, which depends on the envelope type in the flags byte
+
+    return 8 + {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}[(blob[3] >> 1) & 0x07]
+
+
+def gpkg_srs_id(blob):
+    return struct.unpack('<i' if blob[3] & 1 else '>i', bytes(blob[4:8]))[0]
+
+
+def is_gpkg_blob(value):
+    return value is not None and bytes(value[:2]) == b'GP'
+
+
+def wkb_bytes(value):
+    # Plain WKB of a geometry value held either as a GeoPackage blob or as WKB (the SHAPE@WKB cursor token)
+
+    if value is None:
+        return None
+    value = bytes(value)
+    return value[gpkg_header_length(value):] if value[:2] == b'GP' else value
+
+
+def from_values(values):
+    # Decode a column of geometry values into a shapely geometry array. shapely is only needed by the geometry
+    # operations that use it, so it is imported here rather than at module level.
+
+    import shapely
+    return shapely.from_wkb([wkb_bytes(value) for value in values])
+
+
+def as_multipolygon(geom):
+    # Keep the polygonal parts of an overlay result as a MultiPolygon, or None when no area is left
+
+    import shapely
+    parts = [part for part in shapely.get_parts(geom)
+             if shapely.get_type_id(part) == shapely.GeometryType.POLYGON and not shapely.is_empty(part)]
+    return shapely.MultiPolygon(parts) if parts else None
+
+
+def to_values(geoms, template):
+    # Encode shapely geometries in the same form as the template value - a GeoPackage blob with the template's
+    # coordinate system, or plain WKB
+
+    import shapely
+    wkbs = shapely.to_wkb(geoms, byte_order=1)
+    if not is_gpkg_blob(template):
+        return list(wkbs)
+    srs_id = gpkg_srs_id(template)
+    bounds = shapely.bounds(geoms)
+    return [None if wkb is None else gpkg_blob(wkb, (minx, maxx, miny, maxy), srs_id)
+            for wkb, (minx, miny, maxx, maxy) in zip(wkbs, bounds)]
+
+
+def polygon_blob(polygons, srs_id):
+    xs = [x for polygon in polygons for ring in polygon for x, y in ring]
+    ys = [y for polygon in polygons for ring in polygon for x, y in ring]
+    return gpkg_blob(multipolygon_wkb(polygons), (min(xs), max(xs), min(ys), max(ys)), srs_id)
+
+
+def read_shp_geometries(shp_path, srs_id, records=None):
+    # Read polygon records from a .shp file in file order as GeoPackage geometry blobs, None for null shapes. Only
+    # the record numbers in records are decoded when given, and the rest are returned as None.
+
+    geometries = []
+    with open(shp_path, "rb") as shp:
+        shp.seek(SHP_HEADER_SIZE)
+        while True:
+            header = shp.read(8)
+            if len(header) < 8:
+                break
+            content_length = struct.unpack('>2i', header)[1] * 2
+            content = shp.read(content_length)
+            if records is not None and len(geometries) not in records:
+                geometries.append(None)
+                continue
+            shape_type = struct.unpack('<i', content[:4])[0]
+            if shape_type == SHP_NULL:
+                geometries.append(None)
+                continue
+            if shape_type not in SHP_POLYGON_TYPES:
+                raise ValueError("{} contains non-polygon shape type {}".format(shp_path, shape_type))
+            num_parts, num_points = struct.unpack('<2i', content[36:44])
+            parts = struct.unpack('<{}i'.format(num_parts), content[44:44 + 4 * num_parts]) + (num_points,)
+            offset = 44 + 4 * num_parts
+            coords = struct.unpack('<{}d'.format(2 * num_points), content[offset:offset + 16 * num_points])
+            points = list(zip(coords[0::2], coords[1::2]))
+            rings = [points[start:end] for start, end in zip(parts, parts[1:])]
+            geometries.append(polygon_blob(group_rings(rings), srs_id))
+    return geometries
+
+
+def dbf_encoding(path):
+    # Shapefile text encoding from the .cpg sidecar, defaulting to latin-1 for files written without one
+
+    cpg_path = os.path.splitext(path)[0] + '.cpg'
+    if os.path.isfile(cpg_path):
+        with open(cpg_path) as cpg:
+            return cpg.read().strip() or 'latin-1'
+    return 'latin-1'
+
+
+def read_dbf_header(dbf, encoding):
+    # Record count, header and record lengths and the (name, type, offset, length) of each column of an open .dbf
+
+    record_count, header_length, record_length = struct.unpack('<xxxxIHH', dbf.read(12))
+    dbf.seek(32)
+    columns = []
+    offset = 1
+    while True:
+        descriptor = dbf.read(32)
+        if descriptor[:1] == DBF_TERMINATOR or len(descriptor) < 32:
+            break
+        name = descriptor[:11].split(b'\x00')[0].decode(encoding)
+        field_type = descriptor[11:12].decode('ascii')
+        length = descriptor[16]
+        columns.append((name, field_type, offset, length))
+        offset += length
+    return record_count, header_length, record_length, columns
+
+
+def dbf_field_type(dbf_path, field):
+    # dBASE type code of a .dbf column - C for text, N or F for numbers - or None when there is no such column
+
+    with open(dbf_path, "rb") as dbf:
+        columns = read_dbf_header(dbf, dbf_encoding(dbf_path))[3]
+    return next((field_type for name, field_type, start, length in columns if name.upper() == field.upper()), None)
+
+
+def read_dbf(dbf_path, fields=None):
+    # Read the requested columns of a .dbf attribute table into a data frame indexed by record number. Records
+    # flagged as deleted are skipped. Numeric columns are parsed to numbers; everything else is returned as
+    # stripped text with blanks as null.
+
+    encoding = dbf_encoding(dbf_path)
+    with open(dbf_path, "rb") as dbf:
+        record_count, header_length, record_length, columns = read_dbf_header(dbf, encoding)
+
+        if fields is not None:
+            lookup = {name.upper(): (name, field_type, start, length) for name, field_type, start, length in columns}
+            missing = [field for field in fields if field.upper() not in lookup]
+            if missing:
+                raise KeyError("{} lacks fields {}".format(os.path.basename(dbf_path), missing))
+            columns = [lookup[field.upper()] for field in fields]
+
+        dbf.seek(header_length)
+        values = {name: [] for name, field_type, start, length in columns}
+        live = []
+        for number in range(record_count):
+            record = dbf.read(record_length)
+            if record[:1] == DBF_DELETED:
+                continue
+            live.append(number)
+            for name, field_type, start, length in columns:
+                values[name].append(record[start:start + length])
+
+    index = pd.Index(live, dtype='int64')
+    frame = {}
+    for name, field_type, start, length in columns:
+        text = pd.Series([value.decode(encoding, 'replace').strip() for value in values[name]], index=index,
+                         dtype=object)
+        text = text.where(text != '')
+        frame[name] = pd.to_numeric(text, errors='coerce') if field_type in ('N', 'F') else text
+    return pd.DataFrame(frame, index=index)
+
+
+def read_prj(shp_path):
+    # Coordinate system WKT from the .prj sidecar, or None when the shapefile has none
+
+    prj_path = os.path.splitext(shp_path)[0] + '.prj'
+    if not os.path.isfile(prj_path):
+        return None
+    with open(prj_path) as prj:
+        return prj.read().strip() or None
+
+
+def read_shapefile(shp_path, fields, srs_id=-1, select=None):
+    # Read attribute fields and polygon geometry from a shapefile into a data frame, with geometries as
+    # GeoPackage blobs in the GEOMETRY_FIELD column. Shapes whose attribute record is deleted are skipped. When
+    # given, select(attributes) returns a boolean mask of the records to keep from a frame of every attribute
+    # field, and only their shapes are decoded.
+
+    dbf_path = os.path.splitext(shp_path)[0] + '.dbf'
+    with open(dbf_path, "rb") as dbf:
+        record_count = read_dbf_header(dbf, dbf_encoding(dbf_path))[0]
+    frame = read_dbf(dbf_path, fields)
+    records = None
+    if select is not None:
+        frame = frame[select(read_dbf(dbf_path))]
+        records = set(frame.index)
+    geometries = read_shp_geometries(shp_path, srs_id, records)
+    if len(geometries) != record_count:
+        raise ValueError("{} has {} shapes but {} attribute records".format(shp_path, len(geometries), record_count))
+    frame[GEOMETRY_FIELD] = [geometries[number] for number in frame.index]
+    return frame.reset_index(drop=True)
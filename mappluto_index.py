@@ -0,0 +1,45 @@
+import numpy as np
+
+# Attribute indexes built on both outputs, each a tuple of the fields it covers - downstream consumers look lots up
+# by BBL, by borough and block, and by zoning district. The BBL index is unique.
+
+ATTRIBUTE_INDEXES = [('BBL',), ('Borough', 'Block'), ('ZoneDist1',)]
+
+UNIQUE_INDEXES = [('BBL',)]
+
+# Spatial index grid size as a multiple of the mean feature extent, so most lots fall in a single grid cell
+
+GRID_FACTOR = 3.0
+
+
+def parse_indexes(text):
+    # Attribute indexes configured as field groups separated by semicolons, with the fields of a composite index
+    # separated by commas, e.g. "BBL; Borough, Block; ZoneDist1"
+
+    return [tuple(field.strip() for field in group.split(',') if field.strip())
+            for group in text.split(';') if group.strip()]
+
+
+def index_name(fields, suffix):
+    # Name of an output's index on fields, e.g. BBL_Water or Borough_Block_Shore
+
+    return '_'.join(list(fields) + [suffix])
+
+
+def is_unique(fields):
+    return tuple(fields) in UNIQUE_INDEXES
+
+
+def grid_size(bounds, factor=GRID_FACTOR):
+    # Spatial index grid size for features with the given bounds, one (xmin, ymin, xmax, ymax) row per feature -
+    # factor times the mean of each feature's larger side, rounded to two significant digits. None when there are
+    # no features with bounds.
+
+    bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+    bounds = bounds[np.isfinite(bounds).all(axis=1)]
+    if not len(bounds):
+        return None
+    size = np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1]).mean() * factor
+    if size <= 0:
+        return None
+    return float(np.round(size, 1 - int(np.floor(np.log10(size)))))
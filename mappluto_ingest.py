@@ -0,0 +1,161 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Number of csv rows held in memory at any one time while streaming the input table
+
+CHUNK_SIZE = 100000
+
+
+def read_csv_header(input_csv):
+    # Read only the header row of the input csv to obtain the field list without parsing any records
+
+    return [field for field in pd.read_csv(input_csv, nrows=0).columns.values]
+
+
+def project_fields(fields, input_field_drop):
+    # Remove fields we expect in the static input table that we do not desire in output, preserving input order
+
+    for field in fields:
+        if field in input_field_drop:
+            print("Dropping {} field from input csv.".format(field))
+
+    return [field for field in fields if field not in input_field_drop]
+
+
+def read_chunks(input_csv, fields, chunksize=CHUNK_SIZE):
+    # Read only the kept columns of the input csv as text, one chunk at a time, in input field order
+
+    for chunk in pd.read_csv(input_csv, usecols=fields, dtype=str, chunksize=chunksize):
+        yield chunk[fields]
+
+
+def export_chunks(chunks, output_csv):
+    # Write each chunk to the output csv as it passes through, yielding it on to the next consumer.
+    # The running row index is written as the first column so that schema.ini column numbering
+    # (Col2 onward for fields) matches the output of the previous whole-file export.
+
+    row_count = 0
+    header = True
+
+    with open(output_csv, "w", newline="") as out:
+        for chunk in chunks:
+            chunk.to_csv(out, header=header)
+            header = False
+            row_count += len(chunk)
+            print("{} rows written to {}".format(row_count, os.path.basename(output_csv)))
+            yield chunk
+
+
+def stream_csv(input_csv, output_csv, fields, chunksize=CHUNK_SIZE):
+    # Stream the input csv to the output csv in a single pass, reading only the kept columns as text
+
+    row_count = 0
+    for chunk in export_chunks(read_chunks(input_csv, fields, chunksize), output_csv):
+        row_count += len(chunk)
+
+    # An empty input table still produces a header row for the downstream append
+
+    if row_count == 0:
+        pd.DataFrame(columns=fields).to_csv(output_csv)
+
+    return row_count
+
+
+# Value ranges for ESRI integer field types
+
+INTEGER_RANGES = {'SHORT': (-32768, 32767), 'LONG': (-2147483648, 2147483647)}
+
+# Largest magnitude of ESRI floating point field types - larger values would be stored as infinity
+
+FLOAT_LIMITS = {'FLOAT': float(np.finfo(np.float32).max), 'DOUBLE': float(np.finfo(np.float64).max)}
+
+# Number of failing values kept per field in the type-cast report
+
+REPORT_SAMPLE_SIZE = 5
+
+
+def cast_frame(frame, compiled):
+    # Cast a chunk of text fields to the types and pandas dtypes of the compiled schema. Values that cannot be
+    # represented in the target type are set to null and flagged, rather than failing the whole load. Returns the
+    # typed frame renamed to output field names and a boolean frame marking the failed values.
+
+    typed = {}
+    failed = {}
+
+    for field in frame.columns:
+        spec, dtype = compiled['fields'][field], compiled['dtypes'][field]
+        raw = frame[field]
+        present = raw.notna()
+
+        if spec['type'] in INTEGER_RANGES:
+            low, high = INTEGER_RANGES[spec['type']]
+            numeric = pd.to_numeric(raw, errors='coerce')
+            bad = present & (numeric.isna() | (numeric % 1 != 0) | (numeric < low) | (numeric > high))
+            values = numeric.where(~bad).astype(dtype)
+        elif spec['type'] in FLOAT_LIMITS:
+            numeric = pd.to_numeric(raw, errors='coerce')
+            bad = present & (numeric.isna() | (numeric.abs() > FLOAT_LIMITS[spec['type']]))
+            values = numeric.where(~bad).astype(dtype)
+        elif spec['type'] == 'DATE':
+            values = pd.to_datetime(raw, errors='coerce')
+            bad = present & values.isna()
+        else:
+            max_length = spec['length']
+            bad = present & (raw.str.len() > max_length) if max_length else present & False
+            values = raw.where(~bad)
+
+        if spec['required']:
+            bad = bad | values.isna()
+
+        typed[spec['name']] = values
+        failed[field] = bad
+
+    return pd.DataFrame(typed, index=frame.index), pd.DataFrame(failed, index=frame.index)
+
+
+def cast_report(frame, failed, compiled, report=None):
+    # Accumulate per-field failure counts and sample values for a chunk into the running report
+
+    if report is None:
+        report = {}
+
+    counts = failed.sum()
+
+    for field in counts[counts > 0].index:
+        entry = report.setdefault(field, {'field': field, 'type': compiled['fields'][field]['type'],
+                                          'failed': 0, 'samples': []})
+        entry['failed'] += int(counts[field])
+        room = REPORT_SAMPLE_SIZE - len(entry['samples'])
+        if room > 0:
+            entry['samples'] += frame.loc[failed[field], field].head(room).tolist()
+
+    return report
+
+
+def load_typed_table(chunks, compiled, writer, table, tee=None):
+    # Cast each text chunk to its schema types and bulk insert all chunks into the target table in one
+    # writer session. tee optionally wraps the typed chunks on their way to the writer, e.g. to export them as
+    # they pass. Returns the row count and a per-field report of values that failed to cast.
+
+    report = {}
+    state = {'rows': 0}
+
+    def typed_chunks():
+        for chunk in chunks:
+            typed, failed = cast_frame(chunk, compiled)
+            cast_report(chunk, failed, compiled, report)
+            state['rows'] += len(typed)
+            yield typed
+
+    writer.write(table, typed_chunks() if tee is None else tee(typed_chunks()))
+
+    report = pd.DataFrame(list(report.values()), columns=['field', 'type', 'failed', 'samples'])
+
+    if len(report):
+        print("Type-cast failures were set to null in {}:".format(table))
+        print(report.to_string(index=False))
+    else:
+        print("All values cast to schema types for {}.".format(table))
+
+    return state['rows'], report
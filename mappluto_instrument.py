@@ -0,0 +1,177 @@
+import os
+import sys
+import csv
+import json
+import time
+import datetime
+import traceback
+import contextlib
+
+# Step records collected in this process. Stages run in worker processes, so the pipeline collects each stage's
+# records in the worker and returns them with the stage result.
+
+STEP_RECORDS = []
+
+# Peak RSS in megabytes of each open step, innermost last, and of this process before the high-water mark was last
+# reset. On Linux the kernel's high-water mark is reset as each step starts, so a step's peak is its own rather than
+# that of an earlier step of the same stage. Elsewhere a step reports the peak of its stage so far; the pipeline runs
+# each stage in a fresh worker, so it never reports the peak of another stage.
+
+STEP_PEAKS = []
+PROCESS_PEAK = {'mb': 0.0}
+
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+PEAK_RESETS = os.path.exists(PROC_CLEAR_REFS)
+
+REPORT_COLUMNS = ['stage', 'step', 'status', 'started', 'wall_seconds', 'cpu_seconds', 'peak_rss_mb', 'rows', 'pid',
+                  'failed_values', 'error']
+
+
+def high_water_mb():
+    # Peak resident set size in megabytes since the high-water mark was last reset, or since the process started
+    # where it cannot be reset. From psutil on Windows, and None on Windows when psutil is not installed, so timings
+    # are still recorded without it.
+
+    if PEAK_RESETS:
+        with open(PROC_STATUS) as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024.0 / 1024.0 if sys.platform == 'darwin' else peak / 1024.0
+    except ImportError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().peak_wset / 1024.0 / 1024.0
+
+
+def reset_high_water():
+    # Fold the high-water mark into the open steps and the process peak, then reset it where the kernel allows
+
+    peak = high_water_mb()
+    if peak is None:
+        return
+    if STEP_PEAKS:
+        STEP_PEAKS[-1] = max(STEP_PEAKS[-1], peak)
+    PROCESS_PEAK['mb'] = max(PROCESS_PEAK['mb'], peak)
+    if PEAK_RESETS:
+        try:
+            with open(PROC_CLEAR_REFS, "w") as clear_refs:
+                clear_refs.write('5')
+        except (IOError, OSError):
+            pass
+
+
+def peak_rss_mb():
+    # Peak resident set size of the current process in megabytes over its lifetime, or None without psutil on
+    # Windows
+
+    peak = high_water_mb()
+    return None if peak is None else max(peak, PROCESS_PEAK['mb'])
+
+
+@contextlib.contextmanager
+def step(name):
+    # Record wall time, CPU time of this process, peak RSS of this process while the step ran and, when the caller
+    # sets record['rows'], a row count for a block of work
+
+    record = {'step': name, 'status': 'ran', 'rows': None, 'pid': os.getpid(),
+              'started': datetime.datetime.now().isoformat(timespec='seconds')}
+    reset_high_water()
+    STEP_PEAKS.append(0.0)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    except BaseException:
+        record['status'] = 'failed'
+        raise
+    finally:
+        record['wall_seconds'] = round(time.perf_counter() - wall_start, 3)
+        record['cpu_seconds'] = round(time.process_time() - cpu_start, 3)
+        own_peak = STEP_PEAKS.pop()
+        peak = high_water_mb()
+        if peak is not None:
+            peak = max(peak, own_peak)
+            if STEP_PEAKS:
+                STEP_PEAKS[-1] = max(STEP_PEAKS[-1], peak)
+        record['peak_rss_mb'] = None if peak is None else round(peak, 1)
+        STEP_RECORDS.append(record)
+
+
+def collect():
+    # Return and clear the step records collected in this process
+
+    records = list(STEP_RECORDS)
+    del STEP_RECORDS[:]
+    return records
+
+
+class StageFailure(Exception):
+    # Raised in place of a stage's exception, carrying its full traceback text and the step records collected up to
+    # the failure, which would otherwise be lost on the way back from a worker process. The pipeline sets stage to
+    # the failed stage's name.
+
+    def __init__(self, error, trace, records):
+        super(StageFailure, self).__init__(error, trace, records)
+        self.error = error
+        self.trace = trace
+        self.records = records
+        self.stage = None
+
+    def __str__(self):
+        return self.error
+
+    def failed_step(self):
+        # Record of the innermost step that failed - steps are recorded as they exit, innermost first
+
+        return next((record for record in self.records if record['status'] == 'failed'), None)
+
+    def describe(self):
+        failed = self.failed_step() or {}
+        return "Stage {} failed in step {} after {} s: {}\n{}".format(self.stage, failed.get('step'),
+                                                                   failed.get('wall_seconds'), self.error, self.trace)
+
+
+def run_instrumented(func, args):
+    # Run a stage function as one 'stage' step, returning its result along with every step recorded while it ran.
+    # Failures are raised as StageFailure.
+
+    collect()
+    try:
+        with step('stage') as record:
+            result = func(*args)
+            if isinstance(result, int):
+                record['rows'] = result
+    except Exception as error:
+        records = collect()
+        message = '{}: {}'.format(type(error).__name__, error)
+        for failed in records:
+            if failed['status'] == 'failed':
+                failed['error'] = message
+        raise StageFailure(message, traceback.format_exc(), records)
+    return result, collect()
+
+
+def write_report(report_path, records, run_info):
+    # Write step records to report_path.json, with the run details, and report_path.csv for spreadsheet comparison
+    # between releases. Prints the slowest steps.
+
+    with open(report_path + '.json', "w") as f:
+        json.dump({'run': run_info, 'steps': records}, f, indent=4, default=str)
+
+    with open(report_path + '.csv', "w", newline="") as f:
+        writer = csv.DictWriter(f, REPORT_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(records)
+
+    print("Run report written to {}.json and .csv. Slowest steps:".format(report_path))
+    timed = [record for record in records if record['step'] != 'stage' and record.get('wall_seconds')]
+    for record in sorted(timed, key=lambda record: -record['wall_seconds'])[:10]:
+        print("  {stage} {step}: {wall_seconds} s wall, {cpu_seconds} s cpu, {peak_rss_mb} MB peak".format(**record))
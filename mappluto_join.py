@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+from mappluto_geometry import GEOMETRY_FIELD
+
+# Sentinel join key for missing or invalid BBLs - never a valid borough/block/lot
+
+NO_KEY = -1
+
+UNMATCHED_COLUMNS = ['side', 'BBL', 'reason']
+
+
+def bbl_key(values):
+    # Normalise BBLs held as text, double or integer to int64 join keys. Missing values and values that are not
+    # a whole number are returned as NO_KEY.
+
+    numeric = pd.to_numeric(pd.Series(values), errors='coerce')
+    valid = numeric.notna() & (numeric % 1 == 0) & (numeric > 0)
+    return np.where(valid, numeric.fillna(0), NO_KEY).astype('int64')
+
+
+def unmatched_rows(side, values, reason):
+    return pd.DataFrame({'side': side, 'BBL': pd.Series(values, dtype=object).values, 'reason': reason},
+                        columns=UNMATCHED_COLUMNS)
+
+
+def join_table(features, chunks, writer, table, feature_key='BBL', attribute_key='BBL'):
+    # Hash join tax lot geometries onto typed attribute rows on an int64 BBL key and bulk insert the joined rows
+    # into the target feature class in one writer session. Only BBLs present on both sides are kept, matching the
+    # KEEP_COMMON join. The feature side is built into a hash index once; attribute chunks stream through and
+    # probe it. Returns the joined row count and a report of BBLs left unmatched on either side.
+
+    keys = bbl_key(features[feature_key])
+    duplicate = pd.Series(keys).duplicated().values & (keys != NO_KEY)
+    indexed = (keys != NO_KEY) & ~duplicate
+
+    index = pd.Index(keys[indexed])
+    geometry = features[GEOMETRY_FIELD].values[indexed]
+    matched = np.zeros(len(index), dtype=bool)
+
+    unmatched = [unmatched_rows('features', features[feature_key].values[keys == NO_KEY], 'invalid BBL'),
+                 unmatched_rows('features', features[feature_key].values[duplicate], 'duplicate BBL')]
+    state = {'rows': 0}
+
+    def joined_chunks():
+        for chunk in chunks:
+            chunk_keys = bbl_key(chunk[attribute_key])
+            positions = index.get_indexer(chunk_keys)
+            positions[chunk_keys == NO_KEY] = -1
+            hit = positions >= 0
+
+            # A BBL already joined in this or an earlier chunk keeps its first attribute row only
+
+            repeat = hit & pd.Series(positions).duplicated().values
+            repeat[hit] |= matched[positions[hit]]
+            keep = hit & ~repeat
+            matched[positions[keep]] = True
+
+            raw = chunk[attribute_key].values
+            unmatched.append(unmatched_rows('attributes', raw[chunk_keys == NO_KEY], 'invalid BBL'))
+            unmatched.append(unmatched_rows('attributes', raw[~hit & (chunk_keys != NO_KEY)], 'no tax lot geometry'))
+            unmatched.append(unmatched_rows('attributes', raw[repeat], 'duplicate BBL'))
+
+            joined = chunk[keep].copy()
+            joined[GEOMETRY_FIELD] = geometry[positions[keep]]
+            state['rows'] += len(joined)
+            yield joined
+
+    writer.write(table, joined_chunks())
+
+    unmatched.append(unmatched_rows('features', index[~matched].values, 'no attribute row'))
+    report = pd.concat(unmatched, ignore_index=True)
+
+    if len(report):
+        print("BBLs left unmatched by the join into {}:".format(table))
+        print(report.groupby(['side', 'reason']).size().rename('count').reset_index().to_string(index=False))
+    else:
+        print("All BBLs matched in the join into {}.".format(table))
+
+    return state['rows'], report
@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import hashlib
+import datetime
+import concurrent.futures as futures
+from mappluto_schema import file_hash
+from mappluto_instrument import run_instrumented, StageFailure
+
+# Stages form a small DAG - each stage names the stages it requires and is started on a process pool as soon as all
+# of them have finished, so independent branches run at the same time. Stage functions must be module level
+# functions with picklable arguments so they can be sent to worker processes.
+#
+# Builds are incremental. Each stage's key is a hash of its input files, its settings and the keys of the stages it
+# requires, and the build manifest records the key of every stage that completed. A stage whose key is unchanged and
+# whose outputs still exist is skipped and its recorded result reused.
+
+MANIFEST_VERSION = 1
+
+
+class Stage(object):
+    # A unit of pipeline work - func(*args) run once every stage named in requires has finished. inputs maps labels
+    # to the files or directories the stage reads, outputs lists the datasets it writes and exists checks whether
+    # an output is still present. settings holds configuration the outputs depend on, as a json serializable dict.
+    # stat_inputs maps labels to inputs fingerprinted by their files' names, sizes and modification times instead
+    # of their contents - large datasets on a network share that are replaced rather than edited in place.
+
+    def __init__(self, name, func, args=(), requires=(), inputs=None, outputs=(), exists=os.path.exists,
+                 settings=None, stat_inputs=None):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.requires = tuple(requires)
+        self.inputs = dict(inputs or {})
+        self.outputs = tuple(outputs)
+        self.exists = exists
+        self.settings = dict(settings or {})
+        self.stat_inputs = dict(stat_inputs or {})
+
+
+def stage_order(stages):
+    # Stages in an order that respects their requirements, raising ValueError for duplicate names, unknown
+    # requirements or cycles
+
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError("Duplicate stage name {}".format(stage.name))
+        by_name[stage.name] = stage
+
+    for stage in stages:
+        unknown = [name for name in stage.requires if name not in by_name]
+        if unknown:
+            raise ValueError("Stage {} requires unknown stages {}".format(stage.name, unknown))
+
+    ordered = []
+    done = set()
+    pending = list(stages)
+    while pending:
+        ready = [stage for stage in pending if all(name in done for name in stage.requires)]
+        if not ready:
+            raise ValueError("Stages {} have cyclic requirements".format([stage.name for stage in pending]))
+        for stage in ready:
+            ordered.append(stage)
+            done.add(stage.name)
+        pending = [stage for stage in pending if stage.name not in done]
+
+    return ordered
+
+
+def path_hash(path):
+    # SHA-256 of a file's contents, or of every file under a directory along with its relative path. None when
+    # the path does not exist.
+
+    if path is None or not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        return file_hash(path)
+
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.lock'):
+                continue
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).replace(os.sep, '/').encode())
+            digest.update(file_hash(file_path).encode())
+    return digest.hexdigest()
+
+
+def stat_hash(path):
+    # Fingerprint of a file, or of every file under a directory, from relative paths, sizes and modification
+    # times, without reading any contents. None when the path does not exist.
+
+    if path is None or not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        stats = [('', os.stat(path))]
+    else:
+        stats = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.endswith('.lock'):
+                    file_path = os.path.join(root, name)
+                    stats.append((os.path.relpath(file_path, path).replace(os.sep, '/'), os.stat(file_path)))
+
+    digest = hashlib.sha256()
+    for name, stat in stats:
+        digest.update('{}:{}:{}\n'.format(name, stat.st_size, stat.st_mtime_ns).encode())
+    return digest.hexdigest()
+
+
+def load_manifest(path):
+    if path is None or not os.path.isfile(path):
+        return {'version': MANIFEST_VERSION, 'stages': {}}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {'version': MANIFEST_VERSION, 'stages': {}}
+    return manifest
+
+
+def write_manifest(path, manifest):
+    if path is None:
+        return
+    manifest['updated'] = datetime.datetime.now().isoformat(timespec='seconds')
+
+    # Write to a temporary file first so an interrupted run never leaves a partial manifest
+
+    temp_path = path + '.tmp'
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=4, default=str)
+    os.replace(temp_path, path)
+
+
+def plan_stages(stages, manifest, force=False):
+    # Decide which stages run. Returns each stage's manifest entry - key, input hashes, outputs, whether it runs
+    # and why.
+
+    previous = manifest.get('stages', {})
+    hashes = {}
+    plan = {}
+
+    for stage in stage_order(stages):
+        inputs = {}
+        for label, path in sorted(stage.inputs.items()):
+            if path not in hashes:
+                hashes[path] = path_hash(path)
+            inputs[label] = hashes[path]
+        for label, path in sorted(stage.stat_inputs.items()):
+            inputs[label] = stat_hash(path)
+
+        requires = {name: plan[name]['key'] for name in stage.requires}
+
+        # Settings only enter the key of stages that have them, so keys of other stages are unchanged from builds
+        # before stages had settings
+
+        keyed = {'inputs': inputs, 'requires': requires}
+        if stage.settings:
+            keyed['settings'] = stage.settings
+        key = hashlib.sha256(json.dumps(keyed, sort_keys=True).encode()).hexdigest()
+
+        entry = previous.get(stage.name)
+        if force:
+            reason = 'forced rebuild'
+        elif entry is None:
+            reason = 'not in previous build'
+        elif entry.get('status') == 'failed':
+            reason = 'failed in previous build: {}'.format(entry.get('error'))
+        elif entry.get('status') not in ('ran', 'skipped'):
+            reason = 'did not complete in previous build'
+        elif entry['key'] != key:
+            changed = [label for label in inputs if entry.get('inputs', {}).get(label) != inputs[label]]
+            upstream = [name for name in stage.requires if plan[name]['key'] != previous.get(name, {}).get('key')]
+            reasons = []
+            if changed:
+                reasons.append('inputs changed: ' + ', '.join(changed))
+            if upstream:
+                reasons.append('upstream changed: ' + ', '.join(upstream))
+            if entry.get('settings', {}) != stage.settings:
+                reasons.append('settings changed')
+            reason = '; '.join(reasons) or 'stage changed'
+        elif not all(stage.exists(output) for output in stage.outputs):
+            reason = 'outputs missing'
+        else:
+            reason = None
+
+        plan[stage.name] = {'key': key,
+                            'inputs': inputs,
+                            'outputs': list(stage.outputs),
+                            'settings': stage.settings,
+                            'status': 'skipped' if reason is None else 'pending',
+                            'reason': reason or 'unchanged',
+                            'result': entry.get('result') if reason is None else None}
+
+    return plan
+
+
+def run_serial(stages, finish, fail):
+    for stage in stages:
+        print("Starting stage {}".format(stage.name))
+        try:
+            outcome = run_instrumented(stage.func, stage.args)
+        except StageFailure as failure:
+            raise fail(stage.name, failure)
+        finish(stage.name, outcome)
+
+
+def pool_options():
+    # Each stage runs in a fresh worker, so its steps do not report memory left resident by a stage that ran before
+    # it in the same worker. Python before 3.11 reuses workers.
+
+    if sys.version_info < (3, 11):
+        return {}
+    return {'max_tasks_per_child': 1}
+
+
+def run_stages(stages, max_workers=None, manifest_path=None, force=False, records=None):
+    # Run a DAG of stages on a process pool of max_workers processes (one per core by default), or in this process
+    # when max_workers is 1. Stages left unchanged since the build recorded in the manifest are skipped unless force
+    # is set. Returns each stage's return value by stage name. Timing records for every stage and the steps within
+    # it are appended to records as stages finish. If a stage fails, no further stages are started, running stages
+    # are allowed to finish and the first failure is raised as a StageFailure carrying the stage name and its full
+    # traceback. The manifest is checkpointed as each stage finishes or fails, so a rerun resumes from the stages
+    # that did not complete.
+
+    if records is None:
+        records = []
+
+    manifest = load_manifest(manifest_path)
+    plan = plan_stages(stages, manifest, force)
+    manifest['stages'].update(plan)
+    manifest['force'] = force
+
+    for name, entry in plan.items():
+        print("Stage {} will {}: {}".format(name, 'be skipped' if entry['status'] == 'skipped' else 'run',
+                                              entry['reason']))
+    complete = sum(entry['status'] == 'skipped' for entry in plan.values())
+    if complete and not force:
+        print("Resuming build: {} of {} stages already complete".format(complete, len(plan)))
+
+    results = {name: entry['result'] for name, entry in plan.items() if entry['status'] == 'skipped'}
+    records += [{'stage': name, 'step': 'stage', 'status': 'skipped',
+                 'rows': entry['result'] if isinstance(entry['result'], int) else None}
+                for name, entry in plan.items() if entry['status'] == 'skipped']
+    pending = [stage for stage in stage_order(stages) if plan[stage.name]['status'] == 'pending']
+    write_manifest(manifest_path, manifest)
+
+    def finish(name, outcome):
+        result, steps = outcome
+        records.extend(dict(record, stage=name) for record in steps)
+        results[name] = result
+        plan[name].update({'status': 'ran', 'result': result,
+                           'finished': datetime.datetime.now().isoformat(timespec='seconds')})
+        write_manifest(manifest_path, manifest)
+        print("Finished stage {}".format(name))
+
+    def fail(name, failure):
+        # Checkpoint a failed stage with its error, and keep the records of the steps it ran up to the failure.
+        # Failures other than StageFailure, such as a worker process dying, have no step records.
+
+        if not isinstance(failure, StageFailure):
+            message = '{}: {}'.format(type(failure).__name__, failure)
+            failure = StageFailure(message, message, [{'step': 'stage', 'status': 'failed', 'error': message}])
+        failure.stage = name
+        records.extend(dict(record, stage=name) for record in failure.records)
+        plan[name].update({'status': 'failed', 'error': failure.error,
+                           'failed': datetime.datetime.now().isoformat(timespec='seconds')})
+        write_manifest(manifest_path, manifest)
+        failed = failure.failed_step() or {}
+        print("Stage {} failed in step {} after {} s: {}".format(name, failed.get('step'), failed.get('wall_seconds'),
+                                                                failure.error))
+        return failure
+
+    if max_workers == 1:
+        run_serial(pending, finish, fail)
+        return results
+
+    running = {}
+
+    with futures.ProcessPoolExecutor(max_workers, **pool_options()) as pool:
+        while pending or running:
+            for stage in [stage for stage in pending if all(name in results for name in stage.requires)]:
+                print("Starting stage {}".format(stage.name))
+                running[pool.submit(run_instrumented, stage.func, stage.args)] = stage.name
+                pending.remove(stage)
+
+            finished, unfinished = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                if future.exception() is not None:
+                    failure = fail(name, future.exception())
+                    print("Waiting for {} running stages to finish.".format(len(running)))
+                    futures.wait(running)
+                    for other, other_name in running.items():
+                        if other.exception() is None:
+                            finish(other_name, other.result())
+                        else:
+                            fail(other_name, other.exception())
+                    raise failure
+                finish(name, future.result())
+
+    return results
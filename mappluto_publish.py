@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+import urllib.parse
+import urllib.request
+import concurrent.futures as futures
+
+# Block size for streamed copies and the number of files copied at once. Copies to a network share are bound by
+# the network rather than the CPU, so they run on threads.
+
+COPY_BLOCK_SIZE = 8 * 1024 * 1024
+
+PUBLISH_WORKERS = 8
+
+# Written next to each published directory, recording the hash of every file copied into it
+
+MANIFEST_SUFFIX = '.publish.json'
+
+
+def destination_path(destination):
+    # Local path for a destination given as a path or a file:// url
+
+    if destination.startswith('file:'):
+        return urllib.request.url2pathname(urllib.parse.urlparse(destination).path)
+    return destination
+
+
+def stream_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(COPY_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def copy_file(source, target):
+    # Copy a file in blocks, hashing it as it is read, then re-read the copy to check it arrived intact before it
+    # replaces the target. Raises IOError when the copy does not match. Returns the file's SHA-256.
+
+    partial = target + '.partial'
+    digest = hashlib.sha256()
+    with open(source, "rb") as src, open(partial, "wb") as dst:
+        for block in iter(lambda: src.read(COPY_BLOCK_SIZE), b''):
+            digest.update(block)
+            dst.write(block)
+
+    if stream_hash(partial) != digest.hexdigest():
+        os.remove(partial)
+        raise IOError("Copy of {} to {} does not match its source".format(source, target))
+    os.replace(partial, target)
+    return digest.hexdigest()
+
+
+def write_manifest(manifest_path, digests):
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, "w") as f:
+        json.dump(digests, f, indent=4)
+    os.replace(temp_path, manifest_path)
+
+
+def tree_files(path):
+    # Relative paths of the files under a directory, leaving out lock files
+
+    files = []
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            if not name.endswith('.lock'):
+                files.append(os.path.relpath(os.path.join(root, name), path))
+    return sorted(files)
+
+
+def publish_tree(source, destination, max_workers=PUBLISH_WORKERS):
+    # Copy a directory such as a file geodatabase to the destination, copying files in parallel and skipping any
+    # file whose hash matches the one recorded when it was last published there. Files at the destination that
+    # are no longer in the source are removed. A single file workspace such as a GeoPackage is published the same
+    # way as a tree of one file. Returns counts of copied, skipped and removed files and bytes copied. If a copy
+    # fails, the files published before it are recorded so a rerun skips them.
+
+    destination = destination_path(destination)
+    manifest_path = destination.rstrip('\\/') + MANIFEST_SUFFIX
+    previous = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f)
+
+    # Source and target path of each file, keyed by its path relative to the published directory
+
+    single = os.path.isfile(source)
+    if single:
+        paths = {os.path.basename(destination): (source, destination)}
+    else:
+        paths = {name: (os.path.join(source, name), os.path.join(destination, name)) for name in tree_files(source)}
+    files = sorted(paths)
+    for folder in sorted({os.path.dirname(target) for source_file, target in paths.values()} |
+                         (set() if single else {destination})):
+        os.makedirs(folder, exist_ok=True)
+
+    def publish_file(name):
+        source_file, target = paths[name]
+        size = os.path.getsize(source_file)
+        if name in previous and os.path.isfile(target) and os.path.getsize(target) == size:
+            digest = stream_hash(source_file)
+            if digest == previous[name]:
+                return digest, None
+        return copy_file(source_file, target), size
+
+    results = {}
+    try:
+        with futures.ThreadPoolExecutor(max_workers) as pool:
+            for name, result in zip(files, pool.map(publish_file, files)):
+                results[name] = result
+    except Exception:
+        write_manifest(manifest_path, dict(previous, **{name: digest for name, (digest, size) in results.items()}))
+        raise
+
+    removed = [] if single else [name for name in tree_files(destination) if name not in results]
+    for name in removed:
+        os.remove(os.path.join(destination, name))
+
+    write_manifest(manifest_path, {name: digest for name, (digest, size) in results.items()})
+
+    copied = [size for digest, size in results.values() if size is not None]
+    summary = {'copied': len(copied), 'skipped': len(results) - len(copied), 'removed': len(removed),
+               'bytes': sum(copied)}
+    print("Published {} to {}: {copied} files copied ({bytes} bytes), {skipped} unchanged, {removed} removed."
+          .format(os.path.basename(source), destination, **summary))
+    return summary
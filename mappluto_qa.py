@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+from mappluto_join import bbl_key, NO_KEY
+
+# PLUTOMapID values of the lots published in each output's UNMAPPABLES table - lots without a tax lot geometry (2)
+# in both, and lots mapped only to water (4) in the water included output as they have no area once clipped
+
+UNMAPPABLE = {'water': ['2', '4'], 'shoreline': ['2']}
+
+# Number of BBLs listed per problem in the printed summary; the json summary lists all of them
+
+PRINT_SAMPLE_SIZE = 10
+
+
+def key_list(keys):
+    return [int(key) for key in np.sort(keys)]
+
+
+def chunk_keys(chunks, key_field='BBL'):
+    # int64 BBL keys of every chunk, e.g. of the Join file's BBL column
+
+    keys = [bbl_key(chunk[key_field]) for chunk in chunks]
+    return np.concatenate(keys) if keys else np.empty(0, dtype='int64')
+
+
+def qa_table(chunks, join_keys, map_field='PLUTOMapID', borough_field='Borough', key_field='BBL',
+             unmappable=UNMAPPABLE):
+    # One pass over the typed attribute table. Returns the unmappable lots for each output, keyed as in unmappable,
+    # and a QA summary: counts by PLUTOMapID and borough, invalid and duplicate BBLs, and BBLs in the table but not
+    # in join_keys (the Join file's int64 BBL keys) and the reverse.
+
+    selected = {output: [] for output in unmappable}
+    counts = []
+    keys = []
+    rows = 0
+
+    for chunk in chunks:
+        map_ids = chunk[map_field].astype('string')
+        for output, map_values in unmappable.items():
+            selected[output].append(chunk[map_ids.isin(map_values).fillna(False).values])
+        counts.append(pd.DataFrame({'borough': chunk[borough_field].astype('string').fillna(''),
+                                    'map_id': map_ids.fillna('')}).value_counts())
+        keys.append(bbl_key(chunk[key_field]))
+        rows += len(chunk)
+
+    counts = pd.concat(counts).groupby(level=[0, 1]).sum() if counts else pd.Series(dtype='int64')
+    keys = np.concatenate(keys) if keys else np.empty(0, dtype='int64')
+    valid = keys[keys != NO_KEY]
+    unique, occurrences = np.unique(valid, return_counts=True)
+    join_keys = np.unique(join_keys[join_keys != NO_KEY])
+
+    frames = {output: pd.concat(parts, ignore_index=True) if parts else None for output, parts in selected.items()}
+    summary = {'rows': rows,
+               'by_plutomapid': {key: int(value) for key, value in counts.groupby(level=1).sum().items()},
+               'by_borough': {key: int(value) for key, value in counts.groupby(level=0).sum().items()},
+               'by_borough_plutomapid': {borough: {map_id: int(value) for (b, map_id), value in group.items()}
+                                         for borough, group in counts.groupby(level=0)},
+               'unmappable': {output: 0 if frame is None else len(frame) for output, frame in frames.items()},
+               'invalid_bbls': int((keys == NO_KEY).sum()),
+               'duplicate_bbls': key_list(unique[occurrences > 1]),
+               'missing_from_join_file': key_list(np.setdiff1d(unique, join_keys, assume_unique=True)),
+               'missing_from_table': key_list(np.setdiff1d(join_keys, unique, assume_unique=True))}
+    return frames, summary
+
+
+def print_summary(summary):
+    print("QA: {rows} rows, {invalid_bbls} invalid BBLs".format(**summary))
+    print("QA: unmappable lots {}".format(summary['unmappable']))
+    print("QA: lots by PLUTOMapID {}".format(summary['by_plutomapid']))
+    print("QA: lots by borough {}".format(summary['by_borough']))
+    for problem in ('duplicate_bbls', 'missing_from_join_file', 'missing_from_table'):
+        print("QA: {} {}{}".format(len(summary[problem]), problem.replace('_', ' '),
+                                    ", e.g. {}".format(summary[problem][:PRINT_SAMPLE_SIZE])
+                                    if summary[problem] else ''))
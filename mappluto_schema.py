@@ -0,0 +1,134 @@
+import os
+import json
+import hashlib
+import tempfile
+
+# Bump when the layout of the compiled table definition changes so stale cache files are ignored
+
+COMPILED_SCHEMA_VERSION = 2
+
+# pandas dtypes holding each ESRI field type once cast. Text fields stay as python strings.
+
+PANDAS_DTYPES = {'SHORT': 'Int16', 'LONG': 'Int32', 'FLOAT': 'float32', 'DOUBLE': 'float64', 'DATE': 'datetime64[ns]'}
+
+TEXT_DTYPE = 'object'
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_hash(path):
+    # SHA-256 of a file's contents, read in blocks so large inputs are not held in memory
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def blank(value):
+    # Schema json stores unused precision/scale/length entries as blanks
+
+    return '' if value in (None, '#') else value
+
+
+def schema_length(value):
+    # Text length as an integer, None where the schema leaves it blank
+
+    if value in (None, '', '#'):
+        return None
+    return int(value)
+
+
+def compile_schema(schema_dict, schema_hash=None):
+    # Turn the corrections/originals schema dictionary (name, type, precision, scale, length, alias, nullable)
+    # into a table definition that can be applied in a single operation. Nullable fields go into one AddFields
+    # batch; file geodatabases cannot set nullability through AddFields so non-nullable fields keep the full
+    # AddField argument list. Each input csv field also gets its output name, type, length, nullability, schema.ini
+    # type and pandas dtype so later stages never go back to the schema dictionary.
+
+    add_fields = []
+    add_field = []
+    columns = []
+    fields = {}
+    dtypes = {}
+
+    for item in schema_dict:
+        name, schema_type, precision, scale, length, alias, nullable = schema_dict[item][:7]
+        field_type = str(schema_type).upper()
+        columns.append([name, field_type])
+        dtypes[item] = PANDAS_DTYPES.get(field_type, TEXT_DTYPE)
+        fields[item] = {'name': name,
+                        'type': field_type,
+                        'schema_ini_type': str(schema_type),
+                        'length': schema_length(length),
+                        'required': str(nullable).upper() == 'NON_NULLABLE'}
+        if str(nullable).upper() == 'NON_NULLABLE':
+            add_field.append([name, field_type, blank(precision), blank(scale), blank(length), blank(alias),
+                              nullable])
+        else:
+            add_fields.append([name, field_type, blank(alias), blank(length), '', ''])
+
+    return {'version': COMPILED_SCHEMA_VERSION,
+            'schema_hash': schema_hash,
+            'schema_dict': schema_dict,
+            'columns': columns,
+            'fields': fields,
+            'dtypes': dtypes,
+            'add_fields': add_fields,
+            'add_field': add_field}
+
+
+def validate_fields(compiled, fields):
+    # Check the csv header against the schema before any rows are read, raising ValueError listing the schema
+    # fields missing from the csv and the csv fields the schema does not define
+
+    missing = set(compiled['fields']) - set(fields)
+    extra = set(fields) - set(compiled['fields'])
+    if missing or extra:
+        raise ValueError("Input csv header does not match the schema. Missing from csv: {}. Not in schema: {}."
+                         .format(sorted(missing) or 'none', sorted(extra) or 'none'))
+
+
+def schema_ini(compiled, fields, csv_name):
+    # schema.ini text describing the output csv columns, numbered from Col2 after the index column pandas writes
+
+    return ''.join(["[{}]\n".format(csv_name)] +
+                   ["Col{}={} {}\n".format(index + 2, field, compiled['fields'][field]['schema_ini_type'])
+                    for index, field in enumerate(fields)])
+
+
+def load_compiled_schema(schema_path, cache_dir):
+    # Return the compiled table definition for a schema json file, compiling it only when no cached definition
+    # exists for the file's current contents
+
+    schema_hash = file_hash(schema_path)
+    cache_path = os.path.join(cache_dir, 'schema_{}.json'.format(schema_hash))
+
+    if os.path.isfile(cache_path):
+        with open(cache_path) as f:
+            compiled = json.load(f)
+        if compiled.get('version') == COMPILED_SCHEMA_VERSION:
+            print("Using cached table definition for {}.".format(os.path.basename(schema_path)))
+            return compiled
+
+    print("Compiling table definition for {}.".format(os.path.basename(schema_path)))
+    with open(schema_path) as f:
+        compiled = compile_schema(json.load(f), schema_hash)
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Write to a temporary file of this process first so an interrupted run never leaves a partial cache entry.
+    # Stages compiling the same schema at once each replace the entry with an identical definition.
+
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix='schema_', suffix='.tmp')
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(compiled, f)
+        os.replace(temp_path, cache_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return compiled
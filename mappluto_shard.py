@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+from mappluto_join import bbl_key, NO_KEY
+from mappluto_ingest import CHUNK_SIZE
+
+# Borough codes used as shard keys - the leading digit of a BBL - and the name of each shard
+
+BOROUGHS = {1: 'manhattan', 2: 'bronx', 3: 'brooklyn', 4: 'queens', 5: 'staten_island'}
+
+BOROUGH_DIVISOR = 1000000000
+
+
+def borough_codes(values, codes):
+    # Shard code of each BBL held as text, double or integer - its borough digit. BBLs that are missing, invalid or
+    # outside the shard codes go to the first shard so they still reach a join and are reported there.
+
+    keys = bbl_key(values)
+    boroughs = np.where(keys == NO_KEY, codes[0], keys // BOROUGH_DIVISOR)
+    return np.where(np.isin(boroughs, codes), boroughs, codes[0])
+
+
+def borough_where(field, code, codes, text=False):
+    # Where clause selecting the features of one shard on a BBL field, matching borough_codes. Text BBLs compare
+    # as strings, which orders ten digit BBLs the same way. None when there is only one shard.
+
+    def borough(other):
+        low, high = other * BOROUGH_DIVISOR, (other + 1) * BOROUGH_DIVISOR
+        if text:
+            return "({0} >= '{1}' AND {0} < '{2}')".format(field, low, high)
+        return "({0} >= {1} AND {0} < {2})".format(field, low, high)
+
+    if code != codes[0]:
+        return borough(code)
+    if len(codes) == 1:
+        return None
+    return "{} IS NULL OR NOT ({})".format(field, ' OR '.join(borough(other) for other in codes[1:]))
+
+
+def partition_csv(input_csv, shard_csvs, key_field, chunksize=CHUNK_SIZE):
+    # Split the input csv into one csv per shard in a single chunked pass, keeping every column as text in input
+    # order. shard_csvs maps shard codes to output paths. Returns the row count of each shard.
+
+    codes = list(shard_csvs)
+    counts = dict.fromkeys(codes, 0)
+    outs = {code: open(path, "w", newline="") for code, path in shard_csvs.items()}
+
+    try:
+        header = True
+        for chunk in pd.read_csv(input_csv, dtype=str, chunksize=chunksize):
+            shards = borough_codes(chunk[key_field], codes)
+            for code in codes:
+                part = chunk[shards == code]
+                part.to_csv(outs[code], header=header, index=False)
+                counts[code] += len(part)
+            header = False
+
+        # An empty input table still gives every shard a header row
+
+        if header:
+            for code in codes:
+                pd.read_csv(input_csv, nrows=0).to_csv(outs[code], index=False)
+    finally:
+        for out in outs.values():
+            out.close()
+
+    for code in codes:
+        print("{} rows partitioned to shard {}".format(counts[code], code))
+    return counts
+
+
+def merge_chunks(sources, writer, table, key_field=None):
+    # Bulk insert the chunks read from every shard into the city-wide table in one writer session. When key_field
+    # is given the merged BBLs must be unique: the join keeps one row per BBL within a shard, so this catches a
+    # BBL that reached more than one shard. Raises ValueError listing duplicates. Returns the merged row count.
+
+    keys = []
+
+    def merged_chunks():
+        for chunks in sources:
+            for chunk in chunks:
+                if key_field is not None:
+                    keys.append(bbl_key(chunk[key_field]))
+                yield chunk
+
+    row_count = writer.write(table, merged_chunks())
+
+    if key_field is not None:
+        keys = pd.Series(np.concatenate(keys) if keys else np.empty(0, dtype='int64'))
+        duplicated = np.sort(keys[keys.duplicated() & (keys != NO_KEY)].unique())
+        if len(duplicated):
+            raise ValueError("{} {} values are not unique in merged {}, e.g. {}".format(
+                len(duplicated), key_field, table, duplicated[:10].tolist()))
+        print("{} {} values unique across merged {}.".format(row_count, key_field, table))
+
+    return row_count
@@ -0,0 +1,707 @@
+import os
+import json
+import itertools
+import functools
+import pandas as pd
+import mappluto_ingest as ingest
+import mappluto_backends as backends
+import mappluto_schema as schema
+import mappluto_join as join
+import mappluto_erase as erase_engine
+import mappluto_shard as shard
+import mappluto_publish as publisher
+import mappluto_columnar as columnar
+import mappluto_validate as validate
+import mappluto_qa as quality
+import mappluto_diff as diff
+import mappluto_index as indexing
+from mappluto_instrument import step
+from mappluto_pipeline import Stage
+
+# Pipeline stages for one MapPLUTO export (originals or corrections). Each stage is a module level function taking
+# the export's run dictionary - see export_run in MapPLUTOCSV2FC_Conversion.py - so it can run in a worker process.
+# Stages reach their workspaces through the geoprocessing backend named in run['backend'] (see mappluto_backends),
+# so the same DAG builds file geodatabases with ArcPy or GeoPackages without ArcGIS.
+
+BLANK_TABLE = "MapPLUTO_final"
+
+# Working feature class names. They carry no date so an unchanged build can be reused on a later day; the dated
+# release names are applied to the published copies.
+
+WATER_FC = "MapPLUTO_Water_Included"
+SHORELINE_FC = "MapPLUTO_Shoreline_Clipped"
+
+# Define list of fields we expect in static input table that we do not desire in output
+
+INPUT_FIELD_DROP = ['geom', 'mappluto_f', 'rpaddate', 'dcasdate', 'zoningdate', 'landmkdate', 'basempdate',
+                    'masdate', 'polidate', 'edesigdate', 'exemptland']
+
+
+def shoreline_fc_name(run):
+    return run['out_fc'].replace("Water_Included", "Shoreline_Clipped")
+
+
+def compiled_schema(run):
+    # Load in compiled table definition for the external json schema file. Compilation is cached on disk keyed
+    # by the schema file's hash so repeat runs with an unchanged schema skip it entirely
+
+    return schema.load_compiled_schema(run['schema_path'], run['schema_cache'])
+
+
+def open_workspace(run, path, geometry_token='SHAPE@'):
+    return backends.open_workspace(run['backend'], path, geometry_token)
+
+
+def workspace(run):
+    # Create the working directory and geodatabases for this export if they do not exist yet
+
+    for path in (run['work_path'], os.path.dirname(run['gdb_path_water_area'])):
+        os.makedirs(path, exist_ok=True)
+    for path in (run['gdb_path_water_area'], run['gdb_path_shoreline_clip']):
+        open_workspace(run, path).create_workspace()
+
+
+def write_schema_ini(run, fields, compiled):
+    # Write schema.ini used to properly import output csv into ESRI format with correct data types
+
+    print("Writing schema.ini used to properly import output csv into ESRI format with correct data types.")
+    with open(os.path.join(run['work_path'], "schema.ini"), "w") as f:
+        f.write(schema.schema_ini(compiled, fields, str(run['output_csv'].split("\\")[-1])))
+    print("Schema ini complete with {} columns.".format(len(fields)))
+
+
+def typed_path(run):
+    # Typed Arrow copy of the target table that later stages read instead of the gdb table
+
+    return os.path.join(run['work_path'], 'typed_{}.arrow'.format(run['outpath']))
+
+
+def cast_report_path(run):
+    # Fields with values that failed to cast to their schema types and were loaded as null, with sample values
+
+    return os.path.join(run['work_path'], 'cast_report_{}.csv'.format(run['outpath']))
+
+
+def typed_outputs(run):
+    return [os.path.join(run['gdb_path_water_area'], BLANK_TABLE), typed_path(run), cast_report_path(run)] + \
+        csv_outputs(run)
+
+
+def csv_outputs(run):
+    # Text csv and schema.ini written alongside the typed table when the csv export is enabled
+
+    if not run['export_csv']:
+        return []
+    return [run['output_csv'], os.path.join(run['work_path'], 'schema.ini')]
+
+
+def typed_table(run):
+    # Reads only the header of the static csv file for field analysis, then streams kept columns of the static csv
+    # file in a single chunked pass, casting each chunk to the schema types before bulk inserting it into the target
+    # table and writing it to the typed Arrow intermediate. The text output csv and schema.ini are only exported
+    # when export_csv is set.
+
+    print("Reading input csv header to obtain field list.")
+    with step('read_csv_header'):
+        fields = ingest.project_fields(ingest.read_csv_header(run['input_csv']), INPUT_FIELD_DROP)
+    print("Completed reading input csv header.")
+
+    # Fail before any rows are read if the header and schema disagree
+
+    with step('schema_ini'):
+        compiled = compiled_schema(run)
+        schema.validate_fields(compiled, fields)
+        if run['export_csv']:
+            write_schema_ini(run, fields, compiled)
+
+    # Create target table with pre-defined schema
+
+    with step('create_table'):
+        writer = open_workspace(run, run['gdb_path_water_area'])
+        writer.create_table(BLANK_TABLE, compiled)
+
+    print("Loading typed rows into {} and {}.".format(BLANK_TABLE, os.path.basename(typed_path(run))))
+    with step('export_and_load') as record:
+        chunks = ingest.read_chunks(run['input_csv'], fields)
+        if run['export_csv']:
+            chunks = ingest.export_chunks(chunks, run['output_csv'])
+        row_count, cast_report = ingest.load_typed_table(
+            chunks, compiled, writer, BLANK_TABLE,
+            tee=lambda typed: columnar.export_batches(typed, typed_path(run), compiled))
+        record['rows'] = row_count
+        record['failed_values'] = int(cast_report['failed'].sum())
+    cast_report.to_csv(cast_report_path(run), index=False)
+    print("Export and load complete. {} rows loaded, {} values failed to cast - see {}".format(
+        row_count, record['failed_values'], cast_report_path(run)))
+    return row_count
+
+
+def join_file(run):
+    # Copy the dcp_mappluto shapefile into the gdb as the Join file and repair its invalid geometries. Runs only when
+    # the shapefile changed or the Join file is missing; an existing Join file is kept when no shapefile is present.
+
+    if run['join_shapefile'] is None and backends.dataset_exists(run['backend'], run['tax_lot_in']):
+        print("No dcp_mappluto shapefile found. Keeping existing Join file.")
+        return 0
+    print("Copying Join file to GDB")
+    with step('copy_join_file'):
+        open_workspace(run, run['gdb_path_water_area']).copy_features(run['join_shapefile'], "Join_File",
+                                                                      join_where(run))
+
+    # Repair geometry of join shapefile to eliminate the need to repair across network drives in the future
+    return repair_join_file(run)
+
+
+def repair_join_file(run):
+    # Check Join file geometries in batches across a process pool and repair only the invalid ones, writing a report
+    # of the BBLs fixed. The result is cached by the shapefile's hash, so a copy of an unchanged shapefile has its
+    # known repairs applied without checking every geometry again.
+
+    where_clause = join_where(run)
+    key = validate.validation_key(list(shapefile_inputs(run['join_shapefile']).values()), where_clause)
+    cache_path = os.path.join(run['data_path'], 'geometry_cache', 'validation_{}.json'.format(key))
+    writer = open_workspace(run, run['gdb_path_water_area'], geometry_token='SHAPE@WKB')
+
+    cached = validate.load_repairs(cache_path)
+    if cached is None:
+        print("Validating geometry for input.")
+        with step('read_features') as record:
+            features = writer.read_features(run['tax_lot_in'], [writer.oid_field, 'BBL'])
+            record['rows'] = len(features)
+        with step('validate_geometry'):
+            report, repaired = validate.validate_features(features, 'BBL', writer.oid_field,
+                                                          max_workers=run['max_workers'])
+        validate.save_repairs(cache_path, report, repaired)
+    else:
+        print("Join file geometry already validated for this shapefile. Applying cached repairs.")
+        report, repaired = cached
+
+    with step('repair_geometry') as record:
+        record['rows'] = writer.update_geometries('Join_File', dict(zip(report['OID'].tolist(), repaired)))
+    report.to_csv(os.path.join(run['work_path'], 'geometry_repairs_{}.csv'.format(run['outpath'])), index=False)
+    return len(report)
+
+
+def join_where(run):
+    # Where clause selecting a borough shard's lots from the join shapefile, None for a city-wide build
+
+    if run.get('shard') is None:
+        return None
+    text = open_workspace(run, run['gdb_path_water_area']).field_is_text(run['join_shapefile'], 'BBL')
+    return shard.borough_where('"BBL"', run['shard'], run['shard_codes'], text)
+
+
+def unmatched_csv(run):
+    return os.path.join(run['work_path'], 'unmatched_bbls_{}.csv'.format(run['outpath']))
+
+
+def join_features(run):
+    # Hash join tax lot geometries to the typed table on an int64 BBL, keeping matching rows only, and write
+    # the result to a new FeatureClass with final field names -- ShorelineNotClipped. BBLs are normalised to
+    # int64 whether the join file stores them as text or double.
+
+    print("Joining tax lot geometries to {} on BBL.".format(BLANK_TABLE))
+    compiled = compiled_schema(run)
+    writer = open_workspace(run, run['gdb_path_water_area'])
+    with step('read_features') as record:
+        features = writer.read_features(run['tax_lot_in'], ['BBL'])
+        record['rows'] = len(features)
+    with step('create_feature_class'):
+        writer.create_feature_class(WATER_FC, compiled, run['tax_lot_in'])
+    attribute_fields = [name for name, field_type in compiled['columns']]
+    with step('join') as record:
+        joined_count, unmatched = join.join_table(features, columnar.read_chunks(typed_path(run), attribute_fields),
+                                                  writer, WATER_FC)
+        record['rows'] = joined_count
+    unmatched.to_csv(unmatched_csv(run), index=False)
+    print("Export of new FeatureClass complete. {} rows joined.".format(joined_count))
+    return joined_count
+
+
+def qa_path(run):
+    # QA summary written alongside the export's geodatabases
+
+    return os.path.join(os.path.dirname(run['gdb_path_water_area']), 'qa_summary_{}.json'.format(run['outpath']))
+
+
+def qa(run):
+    # One pass over the typed table - of every shard in a sharded build - producing the UNMAPPABLES table of both
+    # gdbs and a QA summary of lots by PLUTOMapID and borough and of BBLs missing from either side of the join.
+    # Duplicate BBLs raise ValueError here, before the join, rather than when the unique index is built.
+
+    compiled = compiled_schema(run)
+    parts = [shard_run(run, code) for code in run['shard_codes']] or [run]
+    fields = [name for name, field_type in compiled['columns']]
+
+    with step('read_join_bbls') as record:
+        join_keys = quality.chunk_keys(itertools.chain.from_iterable(
+            open_workspace(run, os.path.dirname(part['tax_lot_in'])).read_chunks(os.path.basename(part['tax_lot_in']),
+                                                                                ['BBL']) for part in parts))
+        record['rows'] = len(join_keys)
+    with step('qa') as record:
+        frames, summary = quality.qa_table(itertools.chain.from_iterable(
+            columnar.read_chunks(typed_path(part), fields) for part in parts), join_keys)
+        record['rows'] = summary['rows']
+
+    print("Generating UNMAPPABLES tables.")
+    with step('write_unmappables'):
+        for output, gdb_path in (('water', run['gdb_path_water_area']), ('shoreline', run['gdb_path_shoreline_clip'])):
+            writer = open_workspace(run, gdb_path)
+            writer.create_table('UNMAPPABLES', compiled)
+            writer.write('UNMAPPABLES', [] if frames[output] is None else [frames[output]])
+
+    with open(qa_path(run), "w") as f:
+        json.dump(summary, f, indent=4)
+    quality.print_summary(summary)
+
+    if summary['duplicate_bbls']:
+        raise ValueError("{} BBLs appear more than once in {}. See {}".format(
+            len(summary['duplicate_bbls']), run['input_csv'], qa_path(run)))
+    return summary['rows']
+
+
+def erase(run):
+    # Create shoreline clipped version of FC. Only lots that intersect the shoreline are clipped, in grid tiles across
+    # a process pool; geometries are read and written as WKB so the clip can run outside ArcGIS.
+
+    print("Generating shoreline clipped feature class via tiled erase")
+    compiled = compiled_schema(run)
+    water = open_workspace(run, run['gdb_path_water_area'], geometry_token='SHAPE@WKB')
+    shore = open_workspace(run, run['gdb_path_shoreline_clip'], geometry_token='SHAPE@WKB')
+    with step('read_shoreline') as record:
+        shoreline = water.read_features(run['shoreline_fc'], [], os.path.join(run['gdb_path_water_area'], WATER_FC))
+        record['rows'] = len(shoreline)
+    with step('create_feature_class'):
+        shore.create_feature_class(SHORELINE_FC, compiled, os.path.join(run['gdb_path_water_area'], WATER_FC))
+    fields = [name for name, field_type in compiled['columns']] + [erase_engine.GEOMETRY_FIELD]
+    with step('erase') as record:
+        row_count, summary = erase_engine.erase_table(water.read_chunks(WATER_FC, fields), shoreline, shore,
+                                                      SHORELINE_FC, max_workers=run['max_workers'])
+        record['rows'] = row_count
+    print("Erase complete. Shoreline clipped feature generated")
+    return row_count
+
+
+def diff_path(run):
+    return os.path.join(run['work_path'], 'corrections_diff_{}.csv'.format(run['outpath']))
+
+
+def diff_corrections(run):
+    # Compare the corrections typed table with the originals' on BBL over the fields both share, writing the BBLs
+    # added, removed and changed by the corrections and whether each is flagged as edited
+
+    base = run['base']
+    compiled = compiled_schema(run)
+    fields = [name for name, field_type in compiled['columns']]
+    base_fields = [name for name, field_type in compiled_schema(base)['columns']]
+    shared = [name for name in fields if name in base_fields]
+    flag_field = diff.CORRECTION_FLAG_FIELD if diff.CORRECTION_FLAG_FIELD in fields else None
+
+    print("Comparing {} with {}".format(os.path.basename(typed_path(run)), os.path.basename(typed_path(base))))
+    with step('diff') as record:
+        changes, summary = diff.diff_tables(
+            columnar.read_chunks(typed_path(base), shared),
+            columnar.read_chunks(typed_path(run), shared + [flag_field] if flag_field and flag_field not in shared
+                                 else shared), shared, flag_field=flag_field)
+        record['rows'] = summary['corrected_rows']
+    changes.to_csv(diff_path(run), index=False)
+    return len(changes)
+
+
+def derive_shoreline(run):
+    # Shoreline clipped feature class of a corrections export built on the originals'. Lots share their geometry
+    # between the two, so the originals' clipped geometry is joined to the corrected attributes and only the BBLs
+    # the corrections add are erased.
+
+    base = run['base']
+    print("Deriving shoreline clipped feature class from the {} export".format(base['outpath']))
+    compiled = compiled_schema(run)
+    water = open_workspace(run, run['gdb_path_water_area'], geometry_token='SHAPE@WKB')
+    shore = open_workspace(run, run['gdb_path_shoreline_clip'], geometry_token='SHAPE@WKB')
+    with step('read_clipped') as record:
+        clipped = shore.read_features(os.path.join(base['gdb_path_shoreline_clip'], SHORELINE_FC), ['BBL'])
+        record['rows'] = len(clipped)
+    with step('create_feature_class'):
+        shore.create_feature_class(SHORELINE_FC, compiled, os.path.join(run['gdb_path_water_area'], WATER_FC))
+    fields = [name for name, field_type in compiled['columns']]
+    with step('join_clipped') as record:
+        row_count = join.join_table(clipped, columnar.read_chunks(typed_path(run), fields), shore, SHORELINE_FC)[0]
+        record['rows'] = row_count
+
+    changes = pd.read_csv(diff_path(run))
+    added = changes.loc[changes['change'] == 'added', 'BBL'].values
+    if len(added):
+        with step('read_shoreline') as record:
+            shoreline = water.read_features(run['shoreline_fc'], [],
+                                            os.path.join(run['gdb_path_water_area'], WATER_FC))
+            record['rows'] = len(shoreline)
+        with step('erase') as record:
+            chunks = (chunk[pd.Series(join.bbl_key(chunk['BBL'])).isin(added).values]
+                      for chunk in water.read_chunks(WATER_FC, fields + [erase_engine.GEOMETRY_FIELD]))
+            record['rows'] = erase_engine.erase_table(chunks, shoreline, shore, SHORELINE_FC,
+                                                      max_workers=run['max_workers'])[0]
+        row_count += record['rows']
+    print("Shoreline clipped feature derived. {} rows, {} erased for added BBLs".format(row_count, len(added)))
+    return row_count
+
+
+def index_settings(run):
+    # Attribute indexes and spatial index grid size of an export - see mappluto_index. Index stages are keyed on
+    # these so changing them rebuilds the indexes.
+
+    return {'indexes': [list(fields) for fields in run.get('indexes', indexing.ATTRIBUTE_INDEXES)],
+            'spatial_grid': run.get('spatial_grid')}
+
+
+def build_indexes(run, gdb_path, table, suffix):
+    # Post-processing index build for one output - the configured attribute indexes, then the spatial index, each
+    # timed as its own step. The two outputs are indexed by their own stages at the same time; indexes on one
+    # feature class are built one after another, as each needs an exclusive lock on it.
+
+    writer = open_workspace(run, gdb_path)
+    fields = {field.upper() for field in writer.table_fields(table)}
+    for index_fields in index_settings(run)['indexes']:
+        name = indexing.index_name(index_fields, suffix)
+        missing = [field for field in index_fields if field.upper() not in fields]
+        if missing:
+            print("Skipping index {}: {} has no field {}".format(name, table, ', '.join(missing)))
+            continue
+        print("Adding index {} to {}".format(name, table))
+        with step('index_{}'.format(name)):
+            writer.add_index(table, index_fields, name, unique=indexing.is_unique(index_fields))
+
+    print("Adding spatial index to {}".format(table))
+    with step('spatial_index'):
+        grid_size = writer.add_spatial_index(table, run.get('spatial_grid'))
+    print("Spatial index built{}".format('' if grid_size is None else ' with grid size {}'.format(grid_size)))
+
+
+def index_water(run):
+    print("Indexing Water Included")
+    build_indexes(run, run['gdb_path_water_area'], WATER_FC, 'Water')
+
+
+def index_shoreline(run):
+    print("Indexing Shoreline Clipped")
+    build_indexes(run, run['gdb_path_shoreline_clip'], SHORELINE_FC, 'Shore')
+
+
+# Name of the input csv bbl field used to partition rows into borough shards
+
+CSV_BBL_FIELD = 'bbl'
+
+
+def shard_run(run, code):
+    # Paths and names used by the stages of one borough shard, all under the export's work path. Shards share the
+    # tile pool's cores between them.
+
+    name = shard.BOROUGHS[code]
+    work_path = os.path.join(run['work_path'], 'shards', name)
+    gdb_path_water_area = os.path.join(work_path, os.path.basename(run['gdb_path_water_area']))
+
+    return dict(run,
+                outpath='{}_{}'.format(run['outpath'], name),
+                shard=code,
+                work_path=work_path,
+                input_csv=os.path.join(work_path, 'input_{}.csv'.format(name)),
+                output_csv=os.path.join(work_path, os.path.basename(run['output_csv'])),
+                gdb_path_water_area=gdb_path_water_area,
+                gdb_path_shoreline_clip=os.path.join(work_path, os.path.basename(run['gdb_path_shoreline_clip'])),
+                tax_lot_in=os.path.join(gdb_path_water_area, 'Join_File'),
+                max_workers=max(1, (run['max_workers'] or os.cpu_count()) // len(run['shard_codes'])))
+
+
+def partition_input(run):
+    # Split the input csv into one csv per borough shard on the leading digit of bbl
+
+    print("Partitioning input csv into {} borough shards".format(len(run['shard_codes'])))
+    shard_csvs = {code: shard_run(run, code)['input_csv'] for code in run['shard_codes']}
+    for path in shard_csvs.values():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with step('partition_csv') as record:
+        counts = shard.partition_csv(run['input_csv'], shard_csvs, CSV_BBL_FIELD)
+        record['rows'] = sum(counts.values())
+    return record['rows']
+
+
+def merge_water(run):
+    # Merge the typed tables and water included feature classes of every borough shard into the city-wide gdb,
+    # checking that BBLs are unique across the merged feature class, and combine the shards' unmatched BBL reports
+
+    print("Merging borough shards into {}".format(WATER_FC))
+    compiled = compiled_schema(run)
+    shards = [shard_run(run, code) for code in run['shard_codes']]
+    readers = [open_workspace(run, item['gdb_path_water_area'], geometry_token='SHAPE@WKB') for item in shards]
+    writer = open_workspace(run, run['gdb_path_water_area'], geometry_token='SHAPE@WKB')
+    attribute_fields = [name for name, field_type in compiled['columns']]
+
+    with step('merge_table') as record:
+        writer.create_table(BLANK_TABLE, compiled)
+        record['rows'] = shard.merge_chunks([columnar.read_chunks(typed_path(item), attribute_fields)
+                                             for item in shards], writer, BLANK_TABLE)
+    with step('merge_water') as record:
+        writer.create_feature_class(WATER_FC, compiled, os.path.join(shards[0]['gdb_path_water_area'], WATER_FC))
+        fields = attribute_fields + [erase_engine.GEOMETRY_FIELD]
+        record['rows'] = shard.merge_chunks([reader.read_chunks(WATER_FC, fields) for reader in readers],
+                                            writer, WATER_FC, 'BBL')
+
+    unmatched = pd.concat([pd.read_csv(unmatched_csv(item), dtype=str) for item in shards])
+    unmatched.to_csv(unmatched_csv(run), index=False)
+    return record['rows']
+
+
+def merge_shoreline(run):
+    # Merge the shoreline clipped feature classes of every borough shard into the city-wide gdb, checking that BBLs
+    # are unique across the merged feature class
+
+    print("Merging borough shards into {}".format(SHORELINE_FC))
+    compiled = compiled_schema(run)
+    shards = [shard_run(run, code) for code in run['shard_codes']]
+    writer = open_workspace(run, run['gdb_path_shoreline_clip'], geometry_token='SHAPE@WKB')
+    fields = [name for name, field_type in compiled['columns']] + [erase_engine.GEOMETRY_FIELD]
+
+    with step('merge_shoreline') as record:
+        writer.create_feature_class(SHORELINE_FC, compiled,
+                                    os.path.join(shards[0]['gdb_path_shoreline_clip'], SHORELINE_FC))
+        record['rows'] = shard.merge_chunks(
+            [open_workspace(run, item['gdb_path_shoreline_clip'], geometry_token='SHAPE@WKB')
+                .read_chunks(SHORELINE_FC, fields) for item in shards],
+            writer, SHORELINE_FC, 'BBL')
+    return record['rows']
+
+
+WATER_GDB = 'MapPLUTO_WaterArea_{}_{}.gdb'
+SHORELINE_GDB = 'MapPLUTO_ShorelineClip_{}_{}.gdb'
+
+
+def x_output_gdb_path(run):
+    return os.path.join(publisher.destination_path(run['x_path']), run['version'], 'output', run['outpath'])
+
+
+def published_gdb_path(run, out_name):
+    return backends.workspace_path(run['backend'], os.path.join(x_output_gdb_path(run),
+                                                                out_name.format(run['outname'], run['today'])))
+
+
+def staging_gdb_path(run, out_name):
+    return backends.workspace_path(run['backend'], os.path.join(run['work_path'], 'publish',
+                                                                out_name.format(run['outname'], run['today'])))
+
+
+def finalize_output(out_gdb_path, run, release_path=None):
+    # Modify published outputs to include only desired files. release_path is where the gdb is published, when it
+    # is finalized somewhere else first.
+
+    today, outname = run['today'], run['outname']
+    retain_files = ['MapPLUTO_{}_Shoreline_Clipped'.format(today), 'MapPLUTO_{}_Water_Included'.format(today),
+                    'UNMAPPABLES', 'MapPLUTO', 'MapPLUTO_UNCLIPPED', 'NOT_MAPPED_LOTS_UNCLIPPED', 'NOT_MAPPED_LOTS']
+
+    print("Modifying {} to include only desired files".format(os.path.basename(out_gdb_path)))
+    writer = open_workspace(run, out_gdb_path)
+    for work_fc, release_fc in ((WATER_FC, run['out_fc']), (SHORELINE_FC, shoreline_fc_name(run))):
+        if work_fc in writer.list_feature_classes():
+            print("Renaming {} to {}".format(work_fc, release_fc))
+            writer.rename(work_fc, release_fc)
+    output_fc_list = writer.list_feature_classes()
+    output_table_list = writer.list_tables()
+    for fc in output_fc_list:
+        if fc not in retain_files:
+            print("Deleting {}".format(fc))
+            writer.delete(fc)
+        if outname == 'Corrected' and 'MapPLUTO_{}'.format(today) in fc:
+            print("Renaming {} to {}".format(fc, fc.split('.')[0] + '_Corrected'))
+            writer.rename(fc, fc.split('.')[0] + '_Corrected')
+    output_fc_list = writer.list_feature_classes()
+    for tbl in output_table_list:
+        if 'unclipped' in (release_path or out_gdb_path) or 'UNCLIPPED' in output_fc_list[0]:
+            if tbl not in retain_files:
+                print("Deleting {}".format(tbl))
+                writer.delete(tbl)
+            else:
+                print("Renaming {} to {}".format(tbl, 'NOT_MAPPED_LOTS_UNCLIPPED.dbf'))
+                writer.rename(tbl, "NOT_MAPPED_LOTS_UNCLIPPED.dbf")
+        else:
+            if tbl not in retain_files:
+                print("Deleting {}".format(tbl))
+                writer.delete(tbl)
+            else:
+                print("Renaming {} to {}".format(tbl, 'NOT_MAPPED_LOTS.dbf'))
+                writer.rename(tbl, 'NOT_MAPPED_LOTS.dbf')
+    return writer
+
+
+def publish(run, gdb_path, out_name):
+    # Outputting final results to X: drive location. The gdb is copied, pruned and renamed in a local staging gdb
+    # first so only released datasets cross the network, and files unchanged since the last publish are skipped.
+
+    out_gdb_path = published_gdb_path(run, out_name)
+    staging_path = staging_gdb_path(run, out_name)
+    os.makedirs(os.path.dirname(staging_path), exist_ok=True)
+
+    print("Staging {}".format(os.path.basename(out_gdb_path)))
+    with step('stage'):
+        open_workspace(run, gdb_path).copy_workspace(staging_path)
+    with step('finalize'):
+        staged = finalize_output(staging_path, run, out_gdb_path)
+    staged.release()
+
+    print("Outputting {}".format(os.path.basename(out_gdb_path)))
+    with step('copy_to_x'):
+        publisher.publish_tree(staging_path, out_gdb_path)
+
+
+def publish_water(run):
+    publish(run, run['gdb_path_water_area'], WATER_GDB)
+
+
+def publish_shoreline(run):
+    publish(run, run['gdb_path_shoreline_clip'], SHORELINE_GDB)
+
+
+def shapefile_inputs(shp_path):
+    # The shapefile parts that carry geometry and attributes
+
+    if shp_path is None:
+        return {}
+    return {'join_shapefile': shp_path, 'join_dbf': os.path.splitext(shp_path)[0] + '.dbf'}
+
+
+def stage_name(run, stage):
+    return '{}:{}'.format(run['outpath'], stage)
+
+
+def shoreline_inputs(run):
+    # The DOF export is keyed on its files' sizes and modification times rather than hashed - exports are dated
+    # and never change once they land, and hashing the whole gdb on the network share would take longer than the
+    # erase
+
+    return {'shoreline_workspace': run['shoreline_workspace']}
+
+
+def export_stage(run, func, requires=(), inputs=None, outputs=(), after=(), stat_inputs=None):
+    # Stage running func(run), named with the export's outpath so originals, corrections and borough shards can be
+    # scheduled together. requires names stages of the same run, after names stages of other runs that must finish
+    # first. Outputs are checked through the backend so datasets inside a gdb can be listed. Index stages are keyed
+    # on the export's index settings.
+
+    return Stage(stage_name(run, func.__name__), func, (run,),
+                 [stage_name(run, required) for required in requires] + list(after), inputs, outputs,
+                 functools.partial(backends.dataset_exists, run['backend']),
+                 index_settings(run) if func in (index_water, index_shoreline) else None, stat_inputs)
+
+
+def export_stages(run, shoreline_readers=()):
+    # DAG of stages for one export. The water-included index waits for the erase, which reads that feature class,
+    # since AddIndex needs an exclusive schema lock. Each gdb is published only once nothing is still reading from
+    # it. Inputs are hashed to decide which stages need to run. shoreline_readers names stages of other exports
+    # reading this export's shoreline clipped feature class, which its index waits for likewise.
+
+    if run.get('shard_codes'):
+        return sharded_stages(run)
+
+    water, shore = run['gdb_path_water_area'], run['gdb_path_shoreline_clip']
+
+    return [export_stage(run, workspace, outputs=[run['work_path'], water, shore]),
+            export_stage(run, typed_table, ['workspace'],
+                         inputs={'input_csv': run['input_csv'], 'schema': run['schema_path']},
+                         outputs=typed_outputs(run)),
+            export_stage(run, join_file, ['workspace'],
+                         inputs=shapefile_inputs(run['join_shapefile']),
+                         outputs=[run['tax_lot_in']]),
+            export_stage(run, qa, ['typed_table', 'join_file'],
+                         outputs=[os.path.join(water, 'UNMAPPABLES'), os.path.join(shore, 'UNMAPPABLES'), qa_path(run)]),
+            export_stage(run, join_features, ['typed_table', 'join_file', 'qa'],
+                         outputs=[os.path.join(water, WATER_FC), unmatched_csv(run)]),
+            export_stage(run, erase, ['join_features'], stat_inputs=shoreline_inputs(run),
+                         outputs=[os.path.join(shore, SHORELINE_FC)]),
+            export_stage(run, index_water, ['join_features', 'erase'], outputs=[os.path.join(water, WATER_FC)]),
+            export_stage(run, index_shoreline, ['erase'], outputs=[os.path.join(shore, SHORELINE_FC)],
+                         after=shoreline_readers)] + \
+        publish_stages(run)
+
+
+def shared_export_stages(base, run):
+    # DAG of stages for the originals export and a corrections export derived from it. The corrections read their
+    # own csv but reuse the originals' repaired Join file, and their shoreline clipped lots come from the originals'
+    # clipped geometry, so the Join file is copied and repaired once and only BBLs the corrections add are erased.
+    # The corrections are still typed, checked and joined in full rather than applied as a delta on the originals'
+    # Water Included, as they carry fields the originals' feature classes lack.
+
+    run = dict(run, base=base, tax_lot_in=base['tax_lot_in'])
+    water, shore = run['gdb_path_water_area'], run['gdb_path_shoreline_clip']
+    base_join_file = stage_name(base, 'join_file')
+
+    return export_stages(base, shoreline_readers=[stage_name(run, 'derive_shoreline')]) + \
+        [export_stage(run, workspace, outputs=[run['work_path'], water, shore]),
+         export_stage(run, typed_table, ['workspace'],
+                      inputs={'input_csv': run['input_csv'], 'schema': run['schema_path']},
+                      outputs=typed_outputs(run)),
+         export_stage(run, qa, ['typed_table'],
+                      outputs=[os.path.join(water, 'UNMAPPABLES'), os.path.join(shore, 'UNMAPPABLES'), qa_path(run)],
+                      after=[base_join_file]),
+         export_stage(run, join_features, ['typed_table', 'qa'],
+                      outputs=[os.path.join(water, WATER_FC), unmatched_csv(run)], after=[base_join_file]),
+         export_stage(run, diff_corrections, ['typed_table'], outputs=[diff_path(run)],
+                      after=[stage_name(base, 'typed_table')]),
+         export_stage(run, derive_shoreline, ['join_features', 'diff_corrections'],
+                      stat_inputs=shoreline_inputs(run),
+                      outputs=[os.path.join(shore, SHORELINE_FC)], after=[stage_name(base, 'erase')]),
+         export_stage(run, index_water, ['join_features', 'derive_shoreline'],
+                      outputs=[os.path.join(water, WATER_FC)]),
+         export_stage(run, index_shoreline, ['derive_shoreline'], outputs=[os.path.join(shore, SHORELINE_FC)])] + \
+        publish_stages(run)
+
+
+def publish_stages(run):
+    # Publish of each gdb to the X: drive once its index and UNMAPPABLES table are built
+
+    return [export_stage(run, publish_water, ['index_water', 'qa'], outputs=[published_gdb_path(run, WATER_GDB)]),
+            export_stage(run, publish_shoreline, ['index_shoreline', 'qa'],
+                         outputs=[published_gdb_path(run, SHORELINE_GDB)])]
+
+
+def sharded_stages(run):
+    # DAG of stages for one export built as borough shards. The input csv is partitioned once, then each shard runs
+    # its own typed table, Join file copy, join and erase in parallel, with the QA pass over every shard's typed table
+    # run before any shard is joined. The shards are merged into the city-wide gdbs, where BBL uniqueness is checked
+    # across boroughs before the indexes are built and the gdbs published.
+
+    water, shore = run['gdb_path_water_area'], run['gdb_path_shoreline_clip']
+    stages = [export_stage(run, workspace, outputs=[run['work_path'], water, shore]),
+              export_stage(run, partition_input, ['workspace'], inputs={'input_csv': run['input_csv']},
+                           outputs=[shard_run(run, code)['input_csv'] for code in run['shard_codes']])]
+    joined = []
+    erased = []
+    checked = []
+
+    for code in run['shard_codes']:
+        part = shard_run(run, code)
+        part_water, part_shore = part['gdb_path_water_area'], part['gdb_path_shoreline_clip']
+        stages += [export_stage(part, workspace, outputs=[part['work_path'], part_water, part_shore]),
+                   export_stage(part, typed_table, ['workspace'], inputs={'schema': run['schema_path']},
+                                outputs=typed_outputs(part),
+                                after=[stage_name(run, 'partition_input')]),
+                   export_stage(part, join_file, ['workspace'], inputs=shapefile_inputs(run['join_shapefile']),
+                                outputs=[part['tax_lot_in']]),
+                   export_stage(part, join_features, ['typed_table', 'join_file'],
+                                outputs=[os.path.join(part_water, WATER_FC), unmatched_csv(part)],
+                                after=[stage_name(run, 'qa')]),
+                   export_stage(part, erase, ['join_features'],
+                                stat_inputs=shoreline_inputs(run),
+                                outputs=[os.path.join(part_shore, SHORELINE_FC)])]
+        joined += [stage_name(part, 'typed_table'), stage_name(part, 'join_features')]
+        erased.append(stage_name(part, 'erase'))
+        checked += [stage_name(part, 'typed_table'), stage_name(part, 'join_file')]
+
+    return stages + \
+        [export_stage(run, qa, ['workspace'], outputs=[os.path.join(water, 'UNMAPPABLES'),
+                                                      os.path.join(shore, 'UNMAPPABLES'), qa_path(run)],
+                      after=checked),
+         export_stage(run, merge_water, ['workspace'], outputs=[os.path.join(water, BLANK_TABLE),
+                                                                os.path.join(water, WATER_FC), unmatched_csv(run)],
+                      after=joined),
+         export_stage(run, merge_shoreline, ['workspace'], outputs=[os.path.join(shore, SHORELINE_FC)],
+                      after=erased),
+         export_stage(run, index_water, ['merge_water'], outputs=[os.path.join(water, WATER_FC)]),
+         export_stage(run, index_shoreline, ['merge_shoreline'], outputs=[os.path.join(shore, SHORELINE_FC)])] + \
+        publish_stages(run)
@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+import tempfile
+import concurrent.futures as futures
+import numpy as np
+import pandas as pd
+import mappluto_geometry as geometry
+from mappluto_geometry import GEOMETRY_FIELD
+from mappluto_schema import file_hash
+
+# Number of features checked per task on the process pool
+
+BATCH_SIZE = 50000
+
+REPORT_COLUMNS = ['OID', 'BBL', 'reason', 'action']
+
+
+def check_batch(wkbs):
+    # Check one batch of features. Runs in a worker process, so geometries travel as WKB. Returns the positions of
+    # the null or invalid geometries in the batch, why each is invalid and its repaired WKB, None where no area is
+    # left.
+
+    import shapely
+    geoms = shapely.from_wkb(wkbs)
+    positions = np.flatnonzero(~shapely.is_valid(geoms) | shapely.is_empty(geoms))
+    reasons = [reason or 'Null geometry' for reason in shapely.is_valid_reason(geoms[positions])]
+    repaired = [geometry.as_multipolygon(geom) for geom in shapely.make_valid(geoms[positions])]
+    return (positions.tolist(), reasons,
+            [None if geom is None else shapely.to_wkb(geom, byte_order=1) for geom in repaired])
+
+
+def map_batches(tasks, max_workers):
+    if max_workers == 1 or len(tasks) < 2:
+        return [check_batch(task) for task in tasks]
+    with futures.ProcessPoolExecutor(max_workers) as pool:
+        return list(pool.map(check_batch, tasks))
+
+
+def validate_features(features, key_field='BBL', oid_field='OID', batch_size=BATCH_SIZE, max_workers=None):
+    # Check feature geometries in batches across a process pool and repair only the invalid ones with make_valid,
+    # keeping their polygonal parts, as RepairGeometry does. Returns a report with one row per feature fixed - its
+    # object id, BBL, why it was invalid and whether it was repaired or deleted for having no area left - and the
+    # repaired WKB of each, None for deleted features.
+
+    wkbs = [geometry.wkb_bytes(value) for value in features[GEOMETRY_FIELD]]
+    starts = range(0, len(wkbs), batch_size)
+
+    positions = []
+    reasons = []
+    repaired = []
+    for start, (batch_positions, batch_reasons, batch_wkbs) in zip(
+            starts, map_batches([wkbs[start:start + batch_size] for start in starts], max_workers)):
+        positions += [start + position for position in batch_positions]
+        reasons += batch_reasons
+        repaired += batch_wkbs
+
+    report = pd.DataFrame({'OID': features[oid_field].values[positions],
+                           'BBL': features[key_field].values[positions],
+                           'reason': reasons,
+                           'action': ['deleted' if wkb is None else 'repaired' for wkb in repaired]},
+                          columns=REPORT_COLUMNS)
+    print("Checked {} geometries: {} repaired, {} deleted.".format(
+        len(wkbs), int((report['action'] == 'repaired').sum()), int((report['action'] == 'deleted').sum())))
+    return report, repaired
+
+
+def validation_key(paths, where_clause=None):
+    # Key for a validation result - the hashes of the source files the features were copied from and the where
+    # clause that selected them
+
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(file_hash(path).encode())
+    digest.update(str(where_clause).encode())
+    return digest.hexdigest()
+
+
+def load_repairs(cache_path):
+    # Cached validation report and repaired WKB, or None when the source has not been validated before
+
+    if not os.path.isfile(cache_path):
+        return None
+    with open(cache_path) as f:
+        cached = json.load(f)
+    report = pd.DataFrame(cached['report'], columns=REPORT_COLUMNS)
+    return report, [None if wkb is None else bytes.fromhex(wkb) for wkb in cached['repaired']]
+
+
+def save_repairs(cache_path, report, repaired):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    # Write to a temporary file of this process first so an interrupted run never leaves a partial cache entry.
+    # Exports repairing the same Join file at once each replace the entry with identical repairs.
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), prefix='validation_', suffix='.tmp')
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump({'report': json.loads(report.to_json(orient='values')),
+                       'repaired': [None if wkb is None else bytes(wkb).hex() for wkb in repaired]}, f)
+        os.replace(temp_path, cache_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,188 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import mappluto_backends as backends
+import mappluto_erase as erase
+import mappluto_geometry as geometry
+import mappluto_ingest as ingest
+import mappluto_join as join
+import mappluto_schema as schema
+import mappluto_shard as shard
+from mappluto_benchmark import (LOT_SIZE, synthetic_bbls, synthetic_frame, synthetic_schema, synthetic_shoreline,
+                                write_synthetic_shapefile)
+
+# The workspace operations the stages use, checked against every geoprocessing backend - the checks of the
+# benchmark's backend case. The arcpy backend runs on ArcGIS machines only.
+
+ROWS = 10000
+
+SHARD = 3
+
+CODES = sorted(shard.BOROUGHS)
+
+BBL_COMPILED = {'columns': [('BBL', 'DOUBLE')], 'add_fields': [['BBL', 'DOUBLE', '', '', '', '']], 'add_field': []}
+
+
+@pytest.fixture(params=['geopackage', 'arcpy'])
+def backend(request):
+    if request.param == 'arcpy':
+        pytest.importorskip('arcpy')
+    return request.param
+
+
+@pytest.fixture
+def lots(tmp_path):
+    bbls = synthetic_bbls(ROWS)
+    return bbls, write_synthetic_shapefile(str(tmp_path / 'synthetic_lots.shp'), bbls)
+
+
+@pytest.fixture
+def workspace(backend, lots, tmp_path):
+    # A workspace holding one borough shard's Join file, copied from the synthetic shapefile
+
+    bbls, shapefile = lots
+    path = backends.workspace_path(backend, str(tmp_path / 'backend_check.gdb'))
+    writer = backends.open_workspace(backend, path, geometry_token='SHAPE@WKB')
+    writer.create_workspace()
+    text = writer.field_is_text(shapefile, 'BBL')
+    writer.copy_features(shapefile, 'Join_File', shard.borough_where('"BBL"', SHARD, CODES, text))
+    yield writer, path
+    writer.release()
+
+
+def read_join_file(writer, path):
+    return writer.read_features(os.path.join(path, 'Join_File'), [writer.oid_field, 'BBL'])
+
+
+def typed_frame():
+    compiled = schema.compile_schema(synthetic_schema())
+    frame = synthetic_frame(ROWS)
+    return compiled, ingest.cast_frame(frame[[field for field in frame.columns if field in compiled['fields']]],
+                                       compiled)[0]
+
+
+def row_count(writer, table):
+    return sum(len(chunk) for chunk in writer.read_chunks(table, ['BBL']))
+
+
+def test_create_workspace(backend, workspace):
+    writer, path = workspace
+    assert backends.dataset_exists(backend, path)
+
+
+def test_field_is_text(backend, lots, tmp_path):
+    bbls, shapefile = lots
+    writer = backends.open_workspace(backend, backends.workspace_path(backend, str(tmp_path / 'text_check.gdb')))
+    assert not writer.field_is_text(shapefile, 'BBL')
+
+
+def test_copy_features_selects_the_shard(backend, lots, workspace):
+    bbls, shapefile = lots
+    writer, path = workspace
+    features = read_join_file(writer, path)
+
+    assert backends.dataset_exists(backend, os.path.join(path, 'Join_File'))
+    assert len(features) == int((shard.borough_codes(bbls, CODES) == SHARD).sum())
+    assert (shard.borough_codes(features['BBL'], CODES) == SHARD).all()
+
+
+def test_read_features(workspace):
+    writer, path = workspace
+    areas = geometry.from_values(read_join_file(writer, path)[geometry.GEOMETRY_FIELD])
+    assert np.allclose([area.area for area in areas], (LOT_SIZE * 0.9) ** 2)
+
+
+def test_write_and_unique_index(workspace):
+    writer, path = workspace
+    features = read_join_file(writer, path)
+    writer.create_feature_class('Lots', BBL_COMPILED, os.path.join(path, 'Join_File'))
+    lots = features[['BBL', geometry.GEOMETRY_FIELD]]
+    assert writer.write('Lots', [lots, lots]) == 2 * len(lots)
+
+    writer.add_index('Join_File', 'BBL', 'BBL_Join')
+    with pytest.raises(Exception):
+        writer.add_index('Lots', 'BBL', 'BBL_Lots')
+
+
+def test_add_spatial_index(backend, workspace):
+    writer, path = workspace
+    grid_size = writer.add_spatial_index('Join_File')
+    if backend == 'geopackage':
+        assert grid_size is None
+    else:
+        assert grid_size > 0
+
+
+def test_update_geometries_deletes_lots(workspace):
+    writer, path = workspace
+    features = read_join_file(writer, path)
+    deleted = features[writer.oid_field].iloc[:1].tolist()
+    writer.update_geometries('Join_File', {oid: None for oid in deleted})
+    assert row_count(writer, 'Join_File') == len(features) - len(deleted)
+
+
+def test_typed_write(workspace):
+    writer, path = workspace
+    compiled, typed = typed_frame()
+    writer.create_table('MapPLUTO_final', compiled)
+    assert writer.write('MapPLUTO_final', [typed]) == ROWS
+
+    read_back = pd.concat(writer.read_chunks('MapPLUTO_final', ['BBL', 'Block']))
+    assert len(read_back) == ROWS
+    assert (read_back['BBL'].values == typed['BBL'].values).all()
+    assert (read_back['Block'].values == typed['Block'].values).all()
+
+
+def test_join_and_erase_write(workspace):
+    import shapely
+    writer, path = workspace
+    compiled, typed = typed_frame()
+    join_path = os.path.join(path, 'Join_File')
+
+    writer.create_feature_class('Water_Included', compiled, join_path)
+    join_features = writer.read_features(join_path, ['BBL'])
+    joined = join.join_table(join_features, [typed], writer, 'Water_Included')[0]
+    assert joined == len(join_features)
+    assert row_count(writer, 'Water_Included') == joined
+
+    shoreline = synthetic_shoreline(ROWS)
+    writer.create_feature_class('Shoreline_Clipped', compiled, os.path.join(path, 'Water_Included'))
+    fields = [name for name, field_type in compiled['columns']] + [geometry.GEOMETRY_FIELD]
+    erased, summary = erase.erase_table(writer.read_chunks('Water_Included', fields), shoreline, writer,
+                                        'Shoreline_Clipped', max_workers=1)
+    clipped = geometry.from_values(writer.read_features(os.path.join(path, 'Shoreline_Clipped'),
+                                                        ['BBL'])[geometry.GEOMETRY_FIELD])
+    water = shapely.union_all(geometry.from_values(shoreline[geometry.GEOMETRY_FIELD]))
+
+    assert summary['clipped'] > 0
+    assert erased == joined - summary['erased'] == len(clipped)
+    assert float(shapely.area(shapely.intersection(clipped, water)).max()) < 1e-6
+
+
+def test_list_rename_delete_and_copy(backend, workspace, tmp_path):
+    writer, path = workspace
+    features = read_join_file(writer, path)
+    compiled = schema.compile_schema(synthetic_schema())
+    writer.create_feature_class('Lots', BBL_COMPILED, os.path.join(path, 'Join_File'))
+    writer.create_table('MapPLUTO_final', compiled)
+    writer.create_table('UNMAPPABLES', compiled)
+
+    assert sorted(writer.list_feature_classes()) == ['Join_File', 'Lots']
+    assert sorted(writer.list_tables()) == ['MapPLUTO_final', 'UNMAPPABLES']
+
+    writer.rename('UNMAPPABLES', 'NOT_MAPPED_LOTS')
+    for name in ('Lots', 'MapPLUTO_final'):
+        writer.delete(name)
+    assert writer.list_feature_classes() == ['Join_File']
+    assert writer.list_tables() == ['NOT_MAPPED_LOTS']
+
+    copy_path = backends.workspace_path(backend, str(tmp_path / 'backend_check_copy.gdb'))
+    writer.copy_workspace(copy_path)
+    writer.release()
+    copy = backends.open_workspace(backend, copy_path)
+    try:
+        assert copy.list_feature_classes() == ['Join_File']
+        assert row_count(copy, 'Join_File') == len(features)
+    finally:
+        copy.release()
@@ -0,0 +1,66 @@
+import os
+import pytest
+import mappluto_catalog as catalog
+
+
+@pytest.fixture
+def dof_path(tmp_path):
+    for name in ('dof_20240105.gdb', 'dof_20240301.gdb', 'notes', 'dof_latest.gdb'):
+        os.makedirs(str(tmp_path / 'dof' / name))
+    return str(tmp_path / 'dof')
+
+
+class Probe(object):
+    # find_shoreline stand-in recording the datasets it was asked about. Exports named in missing have no layer.
+
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.probed = []
+
+    def __call__(self, dataset_path):
+        self.probed.append(os.path.basename(os.path.dirname(dataset_path)))
+        if self.probed[-1] in self.missing:
+            return None
+        return os.path.join(dataset_path, catalog.SHORELINE_LAYER)
+
+
+def test_export_date():
+    assert catalog.export_date('dof_20240301.gdb') == '20240301'
+    assert catalog.export_date('dof_20240301_v2_20240399.gdb') == '20240301'
+    assert catalog.export_date('dof_latest.gdb') is None
+
+
+def test_catalog_is_cached(dof_path, tmp_path):
+    cache_path = str(tmp_path / 'dof_catalog.json')
+    probe = Probe()
+    exports = catalog.load_catalog(dof_path, cache_path, probe)
+    assert sorted(exports) == ['20240105', '20240301']
+    assert sorted(probe.probed) == ['dof_20240105.gdb', 'dof_20240301.gdb']
+
+    assert catalog.load_catalog(dof_path, cache_path, probe) == exports
+    assert len(probe.probed) == 2
+
+    os.makedirs(os.path.join(dof_path, 'dof_20240402.gdb'))
+    exports = catalog.load_catalog(dof_path, cache_path, probe)
+    assert probe.probed[2:] == ['dof_20240402.gdb']
+    assert catalog.select_export(exports)['date'] == '20240402'
+    assert catalog.select_export(exports, '20240105')['name'] == 'dof_20240105.gdb'
+
+
+def test_missing_shoreline_is_cached_until_the_export_changes(dof_path, tmp_path):
+    cache_path = str(tmp_path / 'dof_catalog.json')
+    probe = Probe(missing=['dof_20240301.gdb'])
+    exports = catalog.load_catalog(dof_path, cache_path, probe)
+    with pytest.raises(ValueError, match=catalog.SHORELINE_LAYER):
+        catalog.select_export(exports)
+
+    catalog.load_catalog(dof_path, cache_path, probe)
+    assert len(probe.probed) == 2
+
+    # The export gains its shoreline layer
+    probe.missing.clear()
+    workspace = os.path.join(dof_path, 'dof_20240301.gdb')
+    os.utime(workspace, (os.stat(workspace).st_atime, os.stat(workspace).st_mtime + 10))
+    exports = catalog.load_catalog(dof_path, cache_path, probe)
+    assert probe.probed[2:] == ['dof_20240301.gdb']
+    assert catalog.select_export(exports)['shoreline_fc'] is not None
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import mappluto_columnar as columnar
+
+COMPILED = {'columns': [('BBL', 'DOUBLE'), ('Borough', 'TEXT'), ('Address', 'TEXT'), ('Block', 'LONG'),
+                        ('Notes', 'TEXT')],
+            'schema_hash': 'test'}
+
+
+def typed_chunks(rows, chunksize):
+    boroughs = np.array(['MN', 'BX', 'BK', 'QN', 'SI'], dtype=object)
+    for start in range(0, rows, chunksize):
+        index = np.arange(start, min(rows, start + chunksize))
+        borough = pd.Series(boroughs[index % 5], dtype=object)
+        # Staten Island only appears after the first chunk, and some boroughs are missing
+        borough[(index < chunksize) & (index % 5 == 4)] = 'BK'
+        borough[index % 7 == 0] = None
+        yield pd.DataFrame({'BBL': (1000000000 + index).astype(float),
+                            'Borough': borough,
+                            'Address': pd.Series(['{} BROADWAY'.format(value) for value in index], dtype=object),
+                            'Block': pd.array(index % 100, dtype='Int32')})
+
+
+def test_round_trip_with_dictionary_deltas(tmp_path):
+    path = str(tmp_path / 'typed.arrow')
+    written = list(columnar.export_batches(typed_chunks(1000, 100), path, COMPILED))
+    assert len(written) == 10
+
+    reader = pa.ipc.open_file(pa.memory_map(path))
+    assert reader.num_record_batches == 10
+    assert pa.types.is_dictionary(reader.schema.field('Borough').type)
+    assert pa.types.is_dictionary(reader.schema.field('Notes').type)
+    assert pa.types.is_string(reader.schema.field('Address').type)
+    assert reader.schema.metadata[b'schema_hash'] == b'test'
+
+    expected = pd.concat(written, ignore_index=True)
+    read = pd.concat(columnar.read_chunks(path, ['BBL', 'Borough', 'Address', 'Block', 'Notes']), ignore_index=True)
+    assert read['BBL'].tolist() == expected['BBL'].tolist()
+    assert read['Borough'].fillna('').tolist() == expected['Borough'].fillna('').tolist()
+    assert read['Address'].tolist() == expected['Address'].tolist()
+    assert read['Block'].tolist() == expected['Block'].tolist()
+    assert read['Notes'].isna().all()
+    assert 'SI' in set(read['Borough'].dropna())
+
+
+def test_empty_table(tmp_path):
+    path = str(tmp_path / 'typed.arrow')
+    assert list(columnar.export_batches(iter([]), path, COMPILED)) == []
+    assert list(columnar.read_chunks(path, ['BBL'])) == []
+    assert pa.ipc.open_file(pa.memory_map(path)).schema.names == [name for name, field_type in COMPILED['columns']]
@@ -0,0 +1,23 @@
+import pandas as pd
+import mappluto_diff as diff
+
+
+def test_diff_tables():
+    original = pd.DataFrame({'BBL': [1000010001.0, 1000010002.0, 1000010003.0, 1000010003.0],
+                             'Lot': [1, 2, 3, 30], 'DCPEdit': [None, None, None, None]})
+    corrected = pd.DataFrame({'BBL': [1000010001.0, 1000010002.0, 1000010004.0],
+                              'Lot': [1, 20, 4], 'DCPEdit': [' ', 'Lot', None]})
+    frame, summary = diff.diff_tables([original], [corrected], ['Lot'], flag_field='DCPEdit')
+
+    changes = dict(zip(frame['BBL'], frame['change']))
+    assert changes == {1000010002: 'changed', 1000010003: 'removed', 1000010004: 'added'}
+    assert frame.loc[frame['flagged'], 'BBL'].tolist() == [1000010002]
+    assert summary == {'original_rows': 3, 'corrected_rows': 3, 'added': 1, 'removed': 1, 'changed': 1,
+                       'flagged': 1}
+
+
+def test_unchanged_tables_have_no_diff():
+    table = pd.DataFrame({'BBL': ['1000010001', '1000010002'], 'Lot': [1, 2]})
+    frame, summary = diff.diff_tables([table[:1], table[1:]], [table], ['BBL', 'Lot'])
+    assert len(frame) == 0
+    assert summary['changed'] == summary['added'] == summary['removed'] == 0
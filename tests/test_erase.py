@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+import mappluto_erase as erase
+import mappluto_geometry as geometry
+from mappluto_geometry import GEOMETRY_FIELD
+from test_join import Recorder
+
+shapely = pytest.importorskip('shapely')
+
+
+def square(x, y, size=10.0):
+    return [[(x, y), (x, y + size), (x + size, y + size), (x + size, y), (x, y)]]
+
+
+def test_erase_table():
+    # Lots along a row crossing a water band from x = 15 to x = 45: lots at 0 and 60 pass through, the lots at 10
+    # and 40 are clipped and the lots at 20 and 30 are erased
+    lots = pd.DataFrame({'BBL': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+                         GEOMETRY_FIELD: [geometry.polygon_blob([square(x, 0.0)], -1)
+                                          for x in (0.0, 10.0, 20.0, 30.0, 40.0, 60.0)]})
+    water = shapely.box(15.0, -5.0, 45.0, 15.0)
+    shoreline = pd.DataFrame({GEOMETRY_FIELD: geometry.to_values(np.array([water]), lots[GEOMETRY_FIELD].iloc[0])})
+    writer = Recorder()
+    rows, summary = erase.erase_table([lots[:3], lots[3:]], shoreline, writer, 'Shoreline_Clipped', tile_size=20.0,
+                                      max_workers=1)
+
+    written = pd.concat(writer.tables['Shoreline_Clipped'])
+    assert rows == 4
+    assert summary == {'passed': 2, 'clipped': 2, 'erased': 2, 'tiles': 3}
+    assert sorted(written['BBL']) == [1.0, 2.0, 5.0, 6.0]
+
+    clipped = geometry.from_values(written[GEOMETRY_FIELD])
+    areas = dict(zip(written['BBL'], shapely.area(clipped)))
+    assert areas == {1.0: 100.0, 2.0: 50.0, 5.0: 50.0, 6.0: 100.0}
+    assert (shapely.area(shapely.intersection(clipped, water)) < 1e-9).all()
+    assert (shapely.get_type_id(clipped) == shapely.GeometryType.MULTIPOLYGON).all()
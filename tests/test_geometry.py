@@ -0,0 +1,95 @@
+import os
+import sys
+import numpy as np
+import pytest
+import shapely
+import mappluto_backends as backends
+import mappluto_benchmark as benchmark
+import mappluto_geometry as geometry
+
+BBLS = [1000010001.0, 1000010002.0, 1000010003.0]
+
+
+def delete_record(shp_path, number):
+    # Flag a record of the shapefile's .dbf as deleted, as dBASE does, leaving its shape in the .shp
+
+    dbf_path = os.path.splitext(shp_path)[0] + '.dbf'
+    with open(dbf_path, "rb") as dbf:
+        record_count, header_length, record_length, columns = geometry.read_dbf_header(dbf, 'latin-1')
+    with open(dbf_path, "r+b") as dbf:
+        dbf.seek(header_length + number * record_length)
+        dbf.write(geometry.DBF_DELETED)
+
+
+@pytest.fixture
+def shapefile(tmp_path):
+    return benchmark.write_synthetic_shapefile(str(tmp_path / 'lots.shp'), np.array(BBLS))
+
+
+def test_read_shapefile(shapefile):
+    features = geometry.read_shapefile(shapefile, ['BBL'])
+    assert features['BBL'].tolist() == BBLS
+    assert list(features.index) == [0, 1, 2]
+    geoms = geometry.from_values(features[geometry.GEOMETRY_FIELD])
+    assert shapely.area(geoms).tolist() == pytest.approx([0.81 * benchmark.LOT_SIZE ** 2] * 3)
+
+
+def test_read_shapefile_skips_deleted_records(shapefile):
+    delete_record(shapefile, 1)
+    features = geometry.read_shapefile(shapefile, ['BBL'])
+    assert features['BBL'].tolist() == [BBLS[0], BBLS[2]]
+    assert list(features.index) == [0, 1]
+    # The remaining records keep their own shapes rather than shifting onto the deleted record's
+    bounds = shapely.bounds(geometry.from_values(features[geometry.GEOMETRY_FIELD]))
+    assert bounds[1][0] == 2 * benchmark.LOT_SIZE
+
+
+def test_read_dbf(shapefile):
+    dbf_path = os.path.splitext(shapefile)[0] + '.dbf'
+    assert geometry.dbf_field_type(dbf_path, 'bbl') == 'N'
+    assert geometry.dbf_field_type(dbf_path, 'Borough') is None
+    with pytest.raises(KeyError):
+        geometry.read_dbf(dbf_path, ['Borough'])
+
+
+def test_geopackage_reads_shapefile_without_gdal(shapefile, tmp_path, monkeypatch):
+    monkeypatch.setattr(backends, 'has_gdal', lambda: False)
+    writer = backends.GeoPackageWriter(str(tmp_path / 'lots.gpkg'))
+    try:
+        delete_record(shapefile, 0)
+        assert not writer.field_is_text(shapefile, 'BBL')
+        writer.copy_features(shapefile, 'Join_File')
+        assert writer.read_features('Join_File', ['BBL'])['BBL'].tolist() == BBLS[1:]
+    finally:
+        writer.close()
+
+
+def test_gdal_layers_need_gdal(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'osgeo', None)
+    with pytest.raises(ImportError, match='GDAL'):
+        backends.read_ogr(os.path.join('dof.gdb', 'Shoreline_Polygon'))
+
+
+def test_geopackage_copies_only_selected_features(tmp_path, monkeypatch):
+    monkeypatch.setattr(backends, 'has_gdal', lambda: False)
+    bbls = [1000010001.0, 3000010001.0, 3000010002.0, 4000010001.0]
+    shapefile = benchmark.write_synthetic_shapefile(str(tmp_path / 'lots.shp'), np.array(bbls))
+    decoded = []
+    read_shp_geometries = geometry.read_shp_geometries
+
+    def counting_reader(shp_path, srs_id, records=None):
+        geometries = read_shp_geometries(shp_path, srs_id, records)
+        decoded.append(sum(shape is not None for shape in geometries))
+        return geometries
+
+    monkeypatch.setattr(geometry, 'read_shp_geometries', counting_reader)
+    writer = backends.GeoPackageWriter(str(tmp_path / 'shard.gpkg'))
+    try:
+        writer.copy_features(shapefile, 'Join_File', '("BBL" >= 3000000000 AND "BBL" < 4000000000)')
+        features = writer.read_features('Join_File', ['BBL'])
+        assert features['BBL'].tolist() == bbls[1:3]
+        assert decoded == [2]
+        assert writer.read_features('Join_File', ['BBL'], where_clause='"BBL" > 3000010001')['BBL'].tolist() == \
+            bbls[2:3]
+    finally:
+        writer.close()
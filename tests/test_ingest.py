@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import mappluto_ingest as ingest
+import mappluto_schema as schema
+
+SCHEMA = {'bbl': ['BBL', 'DOUBLE', '', '', '', 'BBL', 'NON_NULLABLE'],
+          'lot': ['Lot', 'SHORT', '', '', '', 'Lot', 'NULLABLE'],
+          'numfloors': ['NumFloors', 'FLOAT', '', '', '', 'NumFloors', 'NULLABLE'],
+          'borough': ['Borough', 'TEXT', '', '', '2', 'Borough', 'NULLABLE']}
+
+
+def test_cast_frame():
+    compiled = schema.compile_schema(SCHEMA)
+    frame = pd.DataFrame({'bbl': ['1000010001', 'x', None, '1e400'],
+                          'lot': ['1', '1.5', '40000', None],
+                          'numfloors': ['2.5', '1e39', '-1e39', 'inf'],
+                          'borough': ['MN', 'MNX', None, 'BK']}, dtype=object)
+    typed, failed = ingest.cast_frame(frame, compiled)
+
+    assert list(typed.columns) == ['BBL', 'Lot', 'NumFloors', 'Borough']
+    assert failed['bbl'].tolist() == [False, True, True, True]
+    assert failed['lot'].tolist() == [False, True, True, False]
+    assert failed['numfloors'].tolist() == [False, True, True, True]
+    assert failed['borough'].tolist() == [False, True, False, False]
+
+    # Out of range float32 values are nulled and reported rather than stored as infinity
+    assert typed['NumFloors'].dtype == np.float32
+    assert typed['NumFloors'].iloc[0] == 2.5
+    assert typed['NumFloors'].iloc[1:].isna().all()
+    assert typed['Lot'].tolist()[0] == 1 and typed['Lot'].iloc[1:].isna().all()
+
+    report = ingest.cast_report(frame, failed, compiled)
+    assert report['numfloors']['failed'] == 3
+    assert report['numfloors']['samples'] == ['1e39', '-1e39', 'inf']
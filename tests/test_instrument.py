@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+import mappluto_instrument as instrument
+
+
+def allocate(mb):
+    block = np.ones(int(mb * 1024 * 1024 / 8))
+    return float(block.sum())
+
+
+@pytest.mark.skipif(not instrument.PEAK_RESETS, reason="the peak RSS high-water mark cannot be reset here")
+def test_step_peak_is_its_own():
+    instrument.collect()
+    with instrument.step('outer'):
+        with instrument.step('large'):
+            allocate(200)
+        with instrument.step('small'):
+            allocate(1)
+    records = {record['step']: record for record in instrument.collect()}
+    assert records['large']['peak_rss_mb'] - records['small']['peak_rss_mb'] > 150
+    # An enclosing step and the process peak still cover the peaks of the steps inside them
+    assert records['outer']['peak_rss_mb'] >= records['large']['peak_rss_mb']
+    assert round(instrument.peak_rss_mb(), 1) >= records['large']['peak_rss_mb']
+
+
+def test_step_records_failure():
+    instrument.collect()
+    with pytest.raises(ValueError):
+        with instrument.step('failing') as record:
+            record['rows'] = 3
+            raise ValueError('bad row')
+    record = instrument.collect()[0]
+    assert (record['step'], record['status'], record['rows']) == ('failing', 'failed', 3)
+    assert not instrument.STEP_PEAKS
@@ -0,0 +1,43 @@
+import pandas as pd
+import mappluto_join as join
+from mappluto_geometry import GEOMETRY_FIELD
+
+
+class Recorder(object):
+    # Writer stand-in keeping the chunks written to each table
+
+    def __init__(self):
+        self.tables = {}
+
+    def write(self, table, chunks):
+        self.tables[table] = [chunk for chunk in chunks]
+        return sum(len(chunk) for chunk in self.tables[table])
+
+
+def test_bbl_key():
+    keys = join.bbl_key(['1000010001', 1000010002.0, 1000010003, '1000010004.5', None, 'x', -5])
+    assert keys.tolist() == [1000010001, 1000010002, 1000010003] + [join.NO_KEY] * 4
+
+
+def test_join_table_keeps_common_bbls_and_reports_the_rest():
+    features = pd.DataFrame({'BBL': [1000010001.0, 1000010002.0, 1000010002.0, 1000010003.0, None],
+                             GEOMETRY_FIELD: [b'a', b'b', b'b2', b'c', b'd']})
+    chunks = [pd.DataFrame({'BBL': ['1000010001', '1000010004', 'x'], 'Lot': [1, 4, 0]}),
+              pd.DataFrame({'BBL': ['1000010002', '1000010001'], 'Lot': [2, 9]})]
+    writer = Recorder()
+    rows, report = join.join_table(features, chunks, writer, 'Water_Included')
+
+    joined = pd.concat(writer.tables['Water_Included'])
+    assert rows == 2
+    assert joined['BBL'].tolist() == ['1000010001', '1000010002']
+    assert joined['Lot'].tolist() == [1, 2]
+    assert joined[GEOMETRY_FIELD].tolist() == [b'a', b'b']
+
+    reasons = {(side, reason): sorted(str(value) for value in group['BBL'])
+               for (side, reason), group in report.groupby(['side', 'reason'])}
+    assert reasons == {('features', 'invalid BBL'): ['nan'],
+                       ('features', 'duplicate BBL'): ['1000010002.0'],
+                       ('features', 'no attribute row'): ['1000010003'],
+                       ('attributes', 'invalid BBL'): ['x'],
+                       ('attributes', 'no tax lot geometry'): ['1000010004'],
+                       ('attributes', 'duplicate BBL'): ['1000010001']}
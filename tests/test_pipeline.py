@@ -0,0 +1,109 @@
+import os
+import pytest
+import mappluto_pipeline as pipeline
+from mappluto_instrument import StageFailure
+
+
+def copy_text(source, target):
+    with open(source) as f:
+        text = f.read()
+    with open(target, "w") as f:
+        f.write(text)
+    return len(text)
+
+
+def fail(message):
+    raise RuntimeError(message)
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = {name: str(tmp_path / name) for name in ('input.csv', 'shoreline.gdb', 'load.out', 'join.out')}
+    with open(paths['input.csv'], "w") as f:
+        f.write('bbl\n1000010001\n')
+    os.makedirs(paths['shoreline.gdb'])
+    with open(os.path.join(paths['shoreline.gdb'], 'a00000001.gdbtable'), "w") as f:
+        f.write('water')
+    return paths
+
+
+def build(files, settings=None):
+    return [pipeline.Stage('load', copy_text, (files['input.csv'], files['load.out']),
+                           inputs={'csv': files['input.csv']}, outputs=[files['load.out']], settings=settings),
+            pipeline.Stage('join', copy_text, (files['load.out'], files['join.out']), requires=['load'],
+                           outputs=[files['join.out']], stat_inputs={'shoreline': files['shoreline.gdb']})]
+
+
+def statuses(plan):
+    return {name: (entry['status'], entry['reason']) for name, entry in plan.items()}
+
+
+def test_stage_order():
+    stage = pipeline.Stage
+    order = pipeline.stage_order([stage('c', fail, requires=['a', 'b']), stage('b', fail, requires=['a']),
+                                  stage('a', fail)])
+    assert [entry.name for entry in order] == ['a', 'b', 'c']
+
+    with pytest.raises(ValueError, match='Duplicate'):
+        pipeline.stage_order([stage('a', fail), stage('a', fail)])
+    with pytest.raises(ValueError, match='unknown'):
+        pipeline.stage_order([stage('a', fail, requires=['x'])])
+    with pytest.raises(ValueError, match='cyclic'):
+        pipeline.stage_order([stage('a', fail, requires=['b']), stage('b', fail, requires=['a'])])
+
+
+def test_unchanged_stages_are_skipped(files, tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    assert pipeline.run_stages(build(files), 1, manifest_path) == {'load': 15, 'join': 15}
+
+    manifest = pipeline.load_manifest(manifest_path)
+    plan = pipeline.plan_stages(build(files), manifest)
+    assert statuses(plan) == {'load': ('skipped', 'unchanged'), 'join': ('skipped', 'unchanged')}
+    assert plan['join']['result'] == 15
+
+    records = []
+    assert pipeline.run_stages(build(files), 1, manifest_path, records=records) == {'load': 15, 'join': 15}
+    assert [(record['stage'], record['status']) for record in records] == [('load', 'skipped'), ('join', 'skipped')]
+
+    forced = pipeline.plan_stages(build(files), manifest, force=True)
+    assert statuses(forced) == {'load': ('pending', 'forced rebuild'), 'join': ('pending', 'forced rebuild')}
+
+
+def test_changes_rerun_the_stage_and_its_dependents(files, tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    pipeline.run_stages(build(files), 1, manifest_path)
+    manifest = pipeline.load_manifest(manifest_path)
+
+    with open(files['input.csv'], "a") as f:
+        f.write('1000010002\n')
+    assert statuses(pipeline.plan_stages(build(files), manifest)) == \
+        {'load': ('pending', 'inputs changed: csv'), 'join': ('pending', 'upstream changed: load')}
+
+    pipeline.run_stages(build(files), 1, manifest_path)
+    manifest = pipeline.load_manifest(manifest_path)
+    assert statuses(pipeline.plan_stages(build(files), manifest))['load'] == ('skipped', 'unchanged')
+    assert statuses(pipeline.plan_stages(build(files, {'drop': ['geom']}), manifest))['load'] == \
+        ('pending', 'settings changed')
+
+    # Stat inputs are compared on size and modification time, not contents
+    table = os.path.join(files['shoreline.gdb'], 'a00000001.gdbtable')
+    stat = os.stat(table)
+    os.utime(table, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert statuses(pipeline.plan_stages(build(files), manifest)) == \
+        {'load': ('skipped', 'unchanged'), 'join': ('pending', 'inputs changed: shoreline')}
+
+    os.remove(files['load.out'])
+    assert statuses(pipeline.plan_stages(build(files), manifest))['load'] == ('pending', 'outputs missing')
+
+
+def test_failed_stage_is_rerun(files, tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    stages = build(files) + [pipeline.Stage('check', fail, ('bad lots',), requires=['join'])]
+    with pytest.raises(StageFailure) as failure:
+        pipeline.run_stages(stages, 1, manifest_path)
+    assert failure.value.stage == 'check'
+
+    plan = pipeline.plan_stages(stages, pipeline.load_manifest(manifest_path))
+    assert statuses(plan)['join'] == ('skipped', 'unchanged')
+    assert plan['check']['status'] == 'pending'
+    assert plan['check']['reason'].startswith('failed in previous build: RuntimeError: bad lots')
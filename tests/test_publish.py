@@ -0,0 +1,57 @@
+import os
+import json
+import pathlib
+import mappluto_publish as publish
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_publish_tree_copies_only_the_delta(tmp_path):
+    source = str(tmp_path / 'MapPLUTO.gdb')
+    for name in ('a00000001.gdbtable', 'a00000002.gdbtable', 'index/a00000001.spx', 'x.lock'):
+        write(os.path.join(source, name), name * 100)
+    target = str(tmp_path / 'published' / 'MapPLUTO.gdb')
+    destination = pathlib.Path(target).as_uri()
+
+    summary = publish.publish_tree(source, destination, max_workers=2)
+    assert summary == {'copied': 3, 'skipped': 0, 'removed': 0, 'bytes': 5500}
+    assert publish.tree_files(target) == publish.tree_files(source)
+    with open(target + publish.MANIFEST_SUFFIX) as f:
+        assert sorted(json.load(f)) == sorted(publish.tree_files(source))
+
+    assert publish.publish_tree(source, destination) == {'copied': 0, 'skipped': 3, 'removed': 0, 'bytes': 0}
+
+    write(os.path.join(source, 'a00000001.gdbtable'), 'changed')
+    os.remove(os.path.join(source, 'a00000002.gdbtable'))
+    assert publish.publish_tree(source, destination) == {'copied': 1, 'skipped': 1, 'removed': 1, 'bytes': 7}
+    assert publish.tree_files(target) == ['a00000001.gdbtable', os.path.join('index', 'a00000001.spx')]
+    with open(os.path.join(target, 'a00000001.gdbtable')) as f:
+        assert f.read() == 'changed'
+
+
+def test_publish_tree_recopies_a_damaged_target(tmp_path):
+    source = str(tmp_path / 'MapPLUTO.gdb')
+    write(os.path.join(source, 'a00000001.gdbtable'), 'lots')
+    target = str(tmp_path / 'published' / 'MapPLUTO.gdb')
+    publish.publish_tree(source, target)
+
+    # A file missing from the destination or of a different size there is copied again even though its source
+    # is unchanged
+    os.remove(os.path.join(target, 'a00000001.gdbtable'))
+    assert publish.publish_tree(source, target)['copied'] == 1
+    write(os.path.join(target, 'a00000001.gdbtable'), 'lots and more')
+    assert publish.publish_tree(source, target)['copied'] == 1
+
+
+def test_publish_single_file_workspace(tmp_path):
+    source = str(tmp_path / 'MapPLUTO.gpkg')
+    write(source, 'geopackage')
+    target = str(tmp_path / 'published' / 'MapPLUTO.gpkg')
+    assert publish.publish_tree(source, target)['copied'] == 1
+    assert publish.publish_tree(source, target)['skipped'] == 1
+    with open(target) as f:
+        assert f.read() == 'geopackage'
@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+import mappluto_shard as shard
+from test_join import Recorder
+
+CODES = sorted(shard.BOROUGHS)
+
+
+def test_borough_codes():
+    codes = shard.borough_codes(['1000010001', 3000010001.0, 5000010001, None, '9000010001', 'x'], CODES)
+    assert codes.tolist() == [1, 3, 5, 1, 1, 1]
+
+
+def test_borough_where():
+    assert shard.borough_where('"BBL"', 3, CODES) == '("BBL" >= 3000000000 AND "BBL" < 4000000000)'
+    assert shard.borough_where('"BBL"', 3, CODES, text=True) == \
+        '("BBL" >= \'3000000000\' AND "BBL" < \'4000000000\')'
+    assert shard.borough_where('"BBL"', 1, [1, 2]) == \
+        '"BBL" IS NULL OR NOT (("BBL" >= 2000000000 AND "BBL" < 3000000000))'
+    assert shard.borough_where('"BBL"', 1, [1]) is None
+
+
+def test_partition_csv(tmp_path):
+    input_csv = str(tmp_path / 'input.csv')
+    pd.DataFrame({'bbl': ['1000010001', '2000010001', '', '3000010001.0', '2000010002'],
+                  'zip': ['00501', '10001', '10002', '11201', '10451']}).to_csv(input_csv, index=False)
+    shard_csvs = {code: str(tmp_path / 'shard_{}.csv'.format(code)) for code in (1, 2, 3)}
+    counts = shard.partition_csv(input_csv, shard_csvs, 'bbl', chunksize=2)
+
+    assert counts == {1: 2, 2: 2, 3: 1}
+    shards = {code: pd.read_csv(path, dtype=str) for code, path in shard_csvs.items()}
+    assert shards[1]['bbl'].fillna('').tolist() == ['1000010001', '']
+    assert shards[2]['bbl'].tolist() == ['2000010001', '2000010002']
+    assert shards[3]['zip'].tolist() == ['11201']
+
+
+def test_partition_empty_csv(tmp_path):
+    input_csv = str(tmp_path / 'input.csv')
+    pd.DataFrame({'bbl': [], 'zip': []}).to_csv(input_csv, index=False)
+    shard_csvs = {code: str(tmp_path / 'shard_{}.csv'.format(code)) for code in (1, 2)}
+    assert shard.partition_csv(input_csv, shard_csvs, 'bbl') == {1: 0, 2: 0}
+    assert list(pd.read_csv(shard_csvs[2]).columns) == ['bbl', 'zip']
+
+
+def test_merge_chunks():
+    writer = Recorder()
+    sources = [[pd.DataFrame({'BBL': [1000010001.0, None]})], [pd.DataFrame({'BBL': [2000010001.0, None]})]]
+    assert shard.merge_chunks(sources, writer, 'MapPLUTO', 'BBL') == 4
+
+    sources = [[pd.DataFrame({'BBL': [1000010001.0]})], [pd.DataFrame({'BBL': ['1000010001']})]]
+    with pytest.raises(ValueError, match='1000010001'):
+        shard.merge_chunks(sources, writer, 'MapPLUTO', 'BBL')